@@ -1,3 +1,4 @@
 from .players import Player, VariableSampleRatePlayer
+from .collection import SessionCollection
 
 __version__ = "0.1"
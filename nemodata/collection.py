@@ -0,0 +1,285 @@
+from collections import deque
+from typing import Iterator, List, Optional, Tuple, Union
+import multiprocessing
+import os
+import queue
+import traceback
+
+import logging
+
+from .players import Player, LazyImages
+from .shared_frames import FramePool, FrameSlot, session_frame_bytes
+
+
+def _decode_into_pool(player: Player, packet: dict, pool: FramePool) -> dict:
+    """Decodes the images of a packet read with lazy_images into free slots, replacing them with FrameSlots"""
+
+    images = packet.get("images")
+    if not isinstance(images, LazyImages):
+        return packet
+
+    slots = {}
+    for pos in images:
+        img_num = images.frame_number(pos)
+        if img_num is None:
+            slots[pos] = None
+            continue
+
+        shape = player.open_videos[pos].frame_shape
+        slot = pool.acquire()
+
+        if player._read_image(pos, img_num, pool.view(slot, shape)) is None:
+            pool.release(slot)
+            slots[pos] = None
+        else:
+            slots[pos] = FrameSlot(slot, shape)
+
+    packet = dict(packet)
+    packet["images"] = slots
+    return packet
+
+
+def _session_worker(player_class: type, session_path: str, player_kwargs: dict, session_index: int,
+                    packets: multiprocessing.Queue, pool: Optional[FramePool] = None):
+    """Plays back one session in a worker process, sending its packets to the parent through the queue"""
+
+    try:
+        if pool is not None:
+            # images are decoded by _decode_into_pool(), not by the Player
+            player_kwargs = dict(player_kwargs, lazy_images=True)
+
+        with player_class(session_path, **player_kwargs) as player:
+            for packet in player.stream_generator():
+                if pool is not None:
+                    packet = _decode_into_pool(player, packet, pool)
+
+                packets.put(("packet", session_index, packet))
+    except Exception:
+        packets.put(("error", session_index, traceback.format_exc()))
+    else:
+        packets.put(("end", session_index, None))
+
+
+class SessionCollection:
+    """
+    Plays back many recorded sessions at once, each by its own Player running in a worker process.
+    Packets are read from the workers through bounded queues, so workers pause when the consumer falls behind.
+    """
+
+    def __init__(self,
+                 session_paths: List[str],
+                 ordered: Optional[bool] = True,
+                 num_workers: Optional[int] = None,
+                 max_buffered_packets: Optional[int] = 64,
+                 player_class: Optional[type] = Player,
+                 player_kwargs: Optional[dict] = None,
+                 start_method: Optional[str] = None,
+                 shared_memory: Optional[bool] = False,
+                 keep_frames: Optional[bool] = False
+                 ):
+        """
+        Args:
+            session_paths (List[str]): Directories of the sessions to be played back
+            ordered (Optional[bool]): If true packets come session after session, each session in recording order,
+                while the following sessions are already read ahead by the other workers. If false packets come
+                in whatever order the workers produce them, packets of one session are still in recording order.
+            num_workers (Optional[int]): Maximum number of sessions played back at once, defaults to the CPU count
+            max_buffered_packets (Optional[int]): Packets a worker may read ahead of the consumer (in ordered mode)
+                or packets all workers may read ahead together (in unordered mode)
+            player_class (Optional[type]): Player or VariableSampleRatePlayer
+            player_kwargs (Optional[dict]): Arguments given to each Player besides the session path
+            start_method (Optional[str]): multiprocessing start method of the workers, the platform default if None
+            shared_memory (Optional[bool]): If true workers decode the images into shared memory (see FramePool)
+                and only the rest of the packet is pickled. The images are then views of the shared memory, valid
+                until the next packet is requested, or until release() is called if keep_frames is true.
+            keep_frames (Optional[bool]): If true the shared memory images of a packet stay valid until the packet
+                is given to release(), workers wait once all their slots are held
+        """
+
+        self.session_paths = list(session_paths)
+        self.ordered = ordered
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_buffered_packets = max_buffered_packets
+        self.player_class = player_class
+        self.player_kwargs = player_kwargs or {}
+
+        self.shared_memory = shared_memory
+        self.keep_frames = keep_frames
+
+        self._context = multiprocessing.get_context(start_method)
+        self._workers = {}
+        self._pools = {}
+        # slots of the packets handed to the consumer and not released yet
+        self._held_slots = {}
+
+    def __len__(self):
+        return len(self.session_paths)
+
+    def _start_worker(self, session_index: int, packets: multiprocessing.Queue):
+        pool = None
+
+        if self.shared_memory:
+            positions = self.player_kwargs.get("enabled_positions", ("center", "left", "right"))
+            slot_bytes = session_frame_bytes(self.session_paths[session_index], positions,
+                                             self.player_kwargs.get("output_size"),
+                                             self.player_kwargs.get("color_format", "bgr"))
+
+            # enough for the packets waiting in the queue, the one being decoded and the one held by the consumer
+            pool = FramePool((self.max_buffered_packets + 2) * len(positions), slot_bytes, self._context)
+            self._pools[session_index] = pool
+
+        worker = self._context.Process(target=_session_worker,
+                                       args=(self.player_class, self.session_paths[session_index],
+                                             self.player_kwargs, session_index, packets, pool),
+                                       name=f"SessionCollection({self.session_paths[session_index]})",
+                                       daemon=True)
+        worker.start()
+        self._workers[session_index] = worker
+
+    def _get(self, packets: multiprocessing.Queue, session_indices: List[int]) -> Tuple[str, int, object]:
+        """Waits for the next message from the workers, failing if one of them died without finishing"""
+
+        while True:
+            try:
+                return packets.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+            # workers that exit normally always send "end" or "error" first
+            for session_index in session_indices:
+                exitcode = self._workers[session_index].exitcode
+                if exitcode is not None and exitcode != 0:
+                    raise Exception(f"Worker playing back {self.session_paths[session_index]} "
+                                    f"exited with code {exitcode}")
+
+    def _handle(self, message: Tuple[str, int, object]) -> bool:
+        """Returns True if the message ended its session, raises the errors sent by workers"""
+
+        kind, session_index, payload = message
+
+        if kind == "error":
+            raise Exception(f"Error while playing back {self.session_paths[session_index]}:\n{payload}")
+
+        if kind == "end":
+            self._workers.pop(session_index).join()
+
+            # images still held by the consumer keep their memory until they are dropped
+            if session_index in self._pools:
+                self._pools.pop(session_index).close(unlink=True)
+
+            logging.debug(f"Finished playing back {self.session_paths[session_index]}")
+            return True
+
+        return False
+
+    def _deliver(self, session_index: int, packet: dict) -> Tuple[str, dict]:
+        """Turns the FrameSlots of a packet into images, releasing the previous packet unless keep_frames is set"""
+
+        if not self.keep_frames:
+            for held_id in list(self._held_slots):
+                self.release(held_id)
+
+        images = packet.get("images")
+
+        if self.shared_memory and isinstance(images, dict):
+            pool = self._pools[session_index]
+            slots = []
+
+            for pos, image in images.items():
+                if isinstance(image, FrameSlot):
+                    images[pos] = pool.view(image.slot, image.shape)
+                    slots.append(image.slot)
+
+            if slots:
+                self._held_slots[id(packet)] = (pool, slots)
+
+        return self.session_paths[session_index], packet
+
+    def release(self, packet: Union[dict, int]):
+        """
+        Gives the shared memory slots holding the images of a packet back to its worker.
+        Only needed with keep_frames, otherwise packets are released when the next one is requested.
+
+        Args:
+            packet (Union[dict, int]): Packet returned by stream_generator()
+        """
+
+        held = self._held_slots.pop(packet if isinstance(packet, int) else id(packet), None)
+        if held is None:
+            return
+
+        pool, slots = held
+        for slot in slots:
+            pool.release(slot)
+
+    def _ordered_generator(self) -> Iterator[Tuple[str, dict]]:
+        pending = deque(range(len(self.session_paths)))
+        queues = {}
+
+        for session_index in range(len(self.session_paths)):
+
+            # sessions are started in order, so the current one is always among the running ones
+            while pending and len(self._workers) < self.num_workers:
+                next_index = pending.popleft()
+                queues[next_index] = self._context.Queue(self.max_buffered_packets)
+                self._start_worker(next_index, queues[next_index])
+
+            packets = queues.pop(session_index)
+
+            while True:
+                message = self._get(packets, [session_index])
+                if self._handle(message):
+                    break
+
+                yield self._deliver(session_index, message[2])
+
+    def _unordered_generator(self) -> Iterator[Tuple[str, dict]]:
+        pending = deque(range(len(self.session_paths)))
+        packets = self._context.Queue(self.max_buffered_packets)
+
+        while pending or self._workers:
+
+            while pending and len(self._workers) < self.num_workers:
+                self._start_worker(pending.popleft(), packets)
+
+            message = self._get(packets, list(self._workers))
+            if not self._handle(message):
+                yield self._deliver(message[1], message[2])
+
+    def stream_generator(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Plays back all the sessions.
+
+        Returns:
+            Iterator[Tuple[str, dict]]: Generator providing the session path and the played back packet
+        """
+
+        try:
+            if self.ordered:
+                yield from self._ordered_generator()
+            else:
+                yield from self._unordered_generator()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the workers that are still running, e.g. when the consumer stops early."""
+
+        for worker in self._workers.values():
+            worker.terminate()
+            worker.join()
+
+        for pool in self._pools.values():
+            pool.close(unlink=True)
+
+        self._workers = {}
+        self._pools = {}
+        self._held_slots = {}
+
+    def __enter__(self):
+        """This allows the SessionCollection to be (optionally) used in Python 'with' statements"""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """This allows the SessionCollection to be (optionally) used in Python 'with' statements"""
+        self.close()
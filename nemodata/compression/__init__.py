@@ -1,4 +1,5 @@
 from .compressor import Compressor, JITCompressor
 from .decompressor import Decompressor, JITDecompressor
+from .array_codec import ArrayPatch
 
 __version__ = "0.1"
@@ -0,0 +1,123 @@
+import numpy as np
+from typing import Optional
+
+
+# how the compressors encode arrays that changed only partially
+ARRAY_CODECS = ("xor", "delta")
+
+
+class ArrayPatch:
+    """
+    Stands in for an array in a compressed packet, holding only its difference to the array of the previous packet.
+    Sparse patches keep the positions and new values of the few elements that changed. Dense patches keep the
+    element-wise difference to the previous array, which is mostly zeros for slowly varying data and shrinks well
+    once the stream is compressed on disk or over the network.
+    """
+
+    __slots__ = ("codec", "shape", "dtype", "indices", "data")
+
+    def __init__(self, codec: str, shape: tuple, dtype: np.dtype, indices: Optional[np.ndarray], data: np.ndarray):
+        """
+        Args:
+            codec (str): "xor" or "delta", how the dense difference is computed (see ARRAY_CODECS)
+            shape (tuple): Shape of the encoded array
+            dtype (np.dtype): Data type of the encoded array
+            indices (Optional[np.ndarray]): Flat positions of the changed elements, None for dense patches
+            data (np.ndarray): New values of the changed elements, or the dense difference
+        """
+
+        self.codec = codec
+        self.shape = shape
+        self.dtype = dtype
+        self.indices = indices
+        self.data = data
+
+    def __getstate__(self):
+        return self.codec, self.shape, self.dtype, self.indices, self.data
+
+    def __setstate__(self, state):
+        self.codec, self.shape, self.dtype, self.indices, self.data = state
+
+    @property
+    def is_sparse(self) -> bool:
+        return self.indices is not None
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.indices.nbytes if self.is_sparse else 0)
+
+    def apply(self, reference: np.ndarray) -> np.ndarray:
+        """
+        Reconstructs the encoded array.
+
+        Args:
+            reference (np.ndarray): The array the patch was computed against, it is not modified
+
+        Returns:
+            np.ndarray: A new array
+        """
+
+        if reference.shape != self.shape or reference.dtype != self.dtype:
+            raise Exception(f"Array patch for {self.shape} {self.dtype} applied to {reference.shape} {reference.dtype}")
+
+        if self.is_sparse:
+            array = np.array(reference, copy=True, order="C")
+            array.reshape(-1)[self.indices] = self.data
+            return array
+
+        reference = np.ascontiguousarray(reference)
+
+        if self.codec == "delta":
+            # integers wrap around, so adding the difference back is exact
+            return reference + self.data
+
+        return (_as_bytes(reference) ^ self.data).view(self.dtype).reshape(self.shape)
+
+
+def _as_bytes(array: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+
+
+def _is_patchable(array: np.ndarray) -> bool:
+    return array.dtype != object and array.dtype.itemsize > 0 and array.size > 0
+
+
+def encode_array(codec: str, array: np.ndarray, reference: np.ndarray,
+                 sparse_max_fraction: Optional[float] = 0.25) -> Optional[ArrayPatch]:
+    """
+    Encodes an array as its difference to the reference array.
+
+    Args:
+        codec (str): Dense difference used when too many elements changed, "xor" of the raw bytes or "delta" of
+            the values. "delta" is only exact for integers and falls back to "xor" for other data types.
+        array (np.ndarray): The new array
+        reference (np.ndarray): The array of the previous packet
+        sparse_max_fraction (Optional[float]): Largest fraction of changed elements stored as a sparse patch
+
+    Returns:
+        Optional[ArrayPatch]: The patch, None if the arrays can't be patched (different shapes or data types)
+    """
+
+    if codec not in ARRAY_CODECS:
+        raise Exception(f"Unknown array codec {codec}, expected one of {ARRAY_CODECS}")
+
+    if not isinstance(reference, np.ndarray) or array.shape != reference.shape or array.dtype != reference.dtype \
+            or not _is_patchable(array):
+        return None
+
+    array = np.ascontiguousarray(array)
+    reference = np.ascontiguousarray(reference)
+
+    # elements are compared by their bytes, so NaNs that didn't change count as unchanged
+    itemsize = array.dtype.itemsize
+    changed_bytes = (_as_bytes(array) != _as_bytes(reference)).reshape(array.size, itemsize)
+    indices = np.flatnonzero(changed_bytes.any(axis=1))
+
+    if len(indices) <= sparse_max_fraction * array.size:
+        index_dtype = np.uint32 if array.size < 2 ** 32 else np.uint64
+        return ArrayPatch(codec, array.shape, array.dtype, indices.astype(index_dtype), array.reshape(-1)[indices])
+
+    if codec == "delta" and np.issubdtype(array.dtype, np.integer):
+        return ArrayPatch(codec, array.shape, array.dtype, None, array - reference)
+
+    return ArrayPatch("xor", array.shape, array.dtype, None, _as_bytes(array) ^ _as_bytes(reference))
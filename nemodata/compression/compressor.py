@@ -1,8 +1,138 @@
 import numpy as np
 from copy import deepcopy
-from typing import Iterator
+from typing import Iterator, Optional
+import hashlib
 import yaml
 
+from .array_codec import ARRAY_CODECS, encode_array
+
+
+# arrays at least this big are not copied into the reference state of the compressors
+DIGEST_MIN_BYTES = 4096
+
+# how the reference state of the compressors keeps large arrays
+LARGE_ARRAY_MODES = ("digest", "reference", "copy")
+
+
+class ArrayDigest:
+    """
+    Stands in for a large array in the reference state of a compressor.
+    Holds the shape, dtype and a SHA-1 digest of the contents, which is enough to tell whether the next packet
+    carries the same array, without keeping a copy of it.
+    """
+
+    __slots__ = ("shape", "dtype", "digest")
+
+    def __init__(self, array: np.ndarray):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.digest = hashlib.sha1(np.ascontiguousarray(array).data).digest()
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayDigest) and self.shape == other.shape and self.dtype == other.dtype \
+            and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+
+class _ReferenceState:
+    """Reference state of a compressor, keeping large arrays as configured (see LARGE_ARRAY_MODES)"""
+
+    def __init__(self, large_arrays: str, digest_min_bytes: int, array_codec: Optional[str] = None,
+                 sparse_max_fraction: Optional[float] = 0.25):
+        if large_arrays not in LARGE_ARRAY_MODES:
+            raise Exception(f"Unknown large array mode {large_arrays}, expected one of {LARGE_ARRAY_MODES}")
+
+        if array_codec is not None and array_codec not in ARRAY_CODECS:
+            raise Exception(f"Unknown array codec {array_codec}, expected one of {ARRAY_CODECS}")
+
+        if array_codec is not None and large_arrays == "digest":
+            raise Exception("Array codecs need the previous arrays, they can't be used with large_arrays=\"digest\"")
+
+        self.large_arrays = large_arrays
+        self.digest_min_bytes = digest_min_bytes
+        self.array_codec = array_codec
+        self.sparse_max_fraction = sparse_max_fraction
+
+    def _is_large(self, value) -> bool:
+        return isinstance(value, np.ndarray) and value.nbytes >= self.digest_min_bytes and value.dtype != object
+
+    def value(self, value):
+        """What the reference state keeps of a value"""
+
+        if self.large_arrays != "copy" and self._is_large(value):
+            return ArrayDigest(value) if self.large_arrays == "digest" else value
+
+        return deepcopy(value)
+
+    def copy(self, packet: dict) -> dict:
+        """Reference state for a whole packet"""
+        return {k: self.copy(v) if isinstance(v, dict) else self.value(v) for k, v in packet.items()}
+
+    def prune_dict(self, reference: dict, target: dict):
+        """
+        Removes elements in the target dict which already exist in the reference dict and stores the changed ones in
+        the reference dict.
+        """
+
+        to_delete = []
+
+        for k, v in target.items():
+            if isinstance(v, dict):
+                if isinstance(reference.get(k), dict):
+                    self.prune_dict(reference[k], target[k])
+                else:
+                    # a new dict, or one replacing another value (e.g. a sensor that had no data), is kept whole
+                    reference[k] = self.copy(v)
+                continue
+
+            reference_value = reference.get(k)
+
+            if isinstance(reference_value, ArrayDigest) and isinstance(v, np.ndarray):
+                # the array is hashed once, both to compare it and as the new reference
+                digest = ArrayDigest(v)
+                if digest == reference_value:
+                    to_delete.append(k)
+                else:
+                    reference[k] = digest
+            elif k in reference and _is_unchanged(v, reference_value):
+                to_delete.append(k)
+            else:
+                if self.array_codec is not None and isinstance(v, np.ndarray):
+                    patch = encode_array(self.array_codec, v, reference_value, self.sparse_max_fraction)
+                    if patch is not None:
+                        target[k] = patch
+
+                reference[k] = self.value(v)
+
+        for k, v in target.items():
+            if isinstance(v, dict) and len(v) == 0:
+                to_delete.append(k)
+
+        for k in to_delete:
+            del target[k]
+
+
+def _is_unchanged(value, reference_value) -> bool:
+    if isinstance(value, np.ndarray) or isinstance(reference_value, np.ndarray):
+        # with large_arrays="reference" an array that was not replaced is known to be unchanged
+        if value is reference_value:
+            return True
+        return isinstance(value, np.ndarray) and isinstance(reference_value, np.ndarray) \
+            and np.array_equal(value, reference_value)
+
+    if isinstance(reference_value, ArrayDigest):
+        return False
+
+    return value == reference_value
+
+
+def _copy_tree(packet: dict) -> dict:
+    """Copies the nested dicts of a packet so keys can be deleted from them, the values themselves are shared"""
+
+    return {k: _copy_tree(v) if isinstance(v, dict) else v for k, v in packet.items()}
+
 
 class Compressor:
     """
@@ -11,15 +141,28 @@ class Compressor:
     in preparation for saving on disk or streaming over the network.
     """
 
-    def __init__(self, source_generator: Iterator[dict]):
+    def __init__(self, source_generator: Iterator[dict], large_arrays: Optional[str] = "copy",
+                 digest_min_bytes: Optional[int] = DIGEST_MIN_BYTES, array_codec: Optional[str] = None,
+                 sparse_max_fraction: Optional[float] = 0.25):
         """
         Instantiates the wrapper with a target generator containing redundant data
 
         Args:
             source_generator (Iterator[dict]): target generator
+            large_arrays (Optional[str]): How arrays of at least digest_min_bytes are remembered for comparing them
+                with the next packet. "copy" keeps a copy. "digest" keeps only a hash (see ArrayDigest), bounding
+                the memory used by the reference state, at the cost of hashing every array. "reference" keeps the
+                array itself, which is the fastest but requires that arrays are never modified once they were
+                compressed (e.g. not reused buffers).
+            digest_min_bytes (Optional[int]): Smaller arrays are always copied
+            array_codec (Optional[str]): If set, arrays that changed are replaced by their difference to the previous
+                array (see ArrayPatch), "xor" or "delta". Not available with large_arrays="digest".
+            sparse_max_fraction (Optional[float]): Largest fraction of changed elements for which only the changed
+                elements are stored, see encode_array()
         """
 
         self.source_generator = source_generator
+        self._reference_state = _ReferenceState(large_arrays, digest_min_bytes, array_codec, sparse_max_fraction)
         self.last_packet = None
 
     def _prune_dict(self, reference: dict, target: dict):
@@ -32,27 +175,7 @@ class Compressor:
             target (dict): target generator
         """
 
-        to_delete = []
-
-        for k, v in target.items():
-            if isinstance(v, dict):
-                self._prune_dict(reference[k], target[k])
-            else:
-                if isinstance(v, np.ndarray) and np.array_equal(v, reference[k]):
-                    to_delete.append(k)
-                    # del target[k]
-                elif not isinstance(v, np.ndarray) and k in reference and v == reference[k]:
-                    to_delete.append(k)
-                    # del target[k]
-                else:
-                    reference[k] = deepcopy(v)
-
-        for k, v in target.items():
-            if isinstance(v, dict) and len(v) == 0:
-                to_delete.append(k)
-
-        for k in to_delete:
-            del target[k]
+        self._reference_state.prune_dict(reference, target)
 
     def compressed_generator(self) -> Iterator[dict]:
         """
@@ -65,7 +188,7 @@ class Compressor:
         for data_packet in self.source_generator:
 
             if self.last_packet is None:
-                self.last_packet = deepcopy(data_packet)
+                self.last_packet = self._reference_state.copy(data_packet)
                 yield data_packet
             else:
                 self._prune_dict(self.last_packet, data_packet)
@@ -79,11 +202,25 @@ class JITCompressor:
     in preparation for saving on disk or streaming over the network.
     """
 
-    def __init__(self):
+    def __init__(self, large_arrays: Optional[str] = "copy", digest_min_bytes: Optional[int] = DIGEST_MIN_BYTES,
+                 array_codec: Optional[str] = None, sparse_max_fraction: Optional[float] = 0.25):
         """
         Instantiates the wrapper with a target generator containing redundant data
+
+        Args:
+            large_arrays (Optional[str]): How arrays of at least digest_min_bytes are remembered for comparing them
+                with the next packet. "copy" keeps a copy. "digest" keeps only a hash (see ArrayDigest), bounding
+                the memory used by the reference state, at the cost of hashing every array. "reference" keeps the
+                array itself, which is the fastest but requires that arrays are never modified once they were
+                compressed (e.g. not reused buffers).
+            digest_min_bytes (Optional[int]): Smaller arrays are always copied
+            array_codec (Optional[str]): If set, arrays that changed are replaced by their difference to the previous
+                array (see ArrayPatch), "xor" or "delta". Not available with large_arrays="digest".
+            sparse_max_fraction (Optional[float]): Largest fraction of changed elements for which only the changed
+                elements are stored, see encode_array()
         """
 
+        self._reference_state = _ReferenceState(large_arrays, digest_min_bytes, array_codec, sparse_max_fraction)
         self.last_packet = None
 
     def _prune_dict(self, reference: dict, target: dict):
@@ -96,27 +233,7 @@ class JITCompressor:
             target (dict): target generator
         """
 
-        to_delete = []
-
-        for k, v in target.items():
-            if isinstance(v, dict):
-                self._prune_dict(reference[k], target[k])
-            else:
-                if isinstance(v, np.ndarray) and np.array_equal(v, reference[k]):
-                    to_delete.append(k)
-                    # del target[k]
-                elif not isinstance(v, np.ndarray) and k in reference and v == reference[k]:
-                    to_delete.append(k)
-                    # del target[k]
-                else:
-                    reference[k] = deepcopy(v)
-
-        for k, v in target.items():
-            if isinstance(v, dict) and len(v) == 0:
-                to_delete.append(k)
-
-        for k in to_delete:
-            del target[k]
+        self._reference_state.prune_dict(reference, target)
 
     def rewind(self):
         self.last_packet = None
@@ -131,9 +248,10 @@ class JITCompressor:
         """
 
         if self.last_packet is None:
-            self.last_packet = deepcopy(source_packet)
+            self.last_packet = self._reference_state.copy(source_packet)
             return source_packet
         else:
-            source_packet = deepcopy(source_packet)
+            # pruning only deletes keys, so the source packet is left intact by copying just its dicts
+            source_packet = _copy_tree(source_packet)
             self._prune_dict(self.last_packet, source_packet)
             return source_packet
@@ -1,6 +1,35 @@
-from typing import Iterator
+from typing import Iterator, Optional
 from copy import deepcopy
 
+from .array_codec import ArrayPatch
+
+
+def _grow_shared(reference: dict, target: dict, fill_none: bool) -> dict:
+    """
+    Fills the values missing from target with the ones of reference, sharing them instead of copying them.
+    Only target is modified, so reference and the packets it was built from stay valid, and the grown target
+    becomes the next reference.
+
+    Args:
+        reference (dict): previous decompressed packet, or a subtree of it
+        target (dict): compressed packet, or a subtree of it
+        fill_none (bool): If true None values in target are also replaced
+
+    Returns:
+        dict: target
+    """
+
+    for k, v in reference.items():
+        if k not in target or (fill_none and target[k] is None):
+            target[k] = v
+        elif isinstance(target[k], ArrayPatch):
+            # patches build a new array, the previous one is left as it was
+            target[k] = target[k].apply(v)
+        elif isinstance(v, dict) and isinstance(target[k], dict):
+            _grow_shared(v, target[k], fill_none)
+
+    return target
+
 
 class Decompressor:
     """
@@ -8,15 +37,18 @@ class Decompressor:
     Adds back the redundant data that was removed during the compression process.
     """
 
-    def __init__(self, source_generator: Iterator[dict]):
+    def __init__(self, source_generator: Iterator[dict], share_values: Optional[bool] = False):
         """
         Instantiates the wrapper with a target generator containing compressed data
 
         Args:
             source_generator (Iterator[dict]): target generator
+            share_values (Optional[bool]): If true values carried over from previous packets are shared instead of
+                copied, so consecutive packets may hold the same objects and must be treated as read-only
         """
 
         self.source_generator = source_generator
+        self.share_values = share_values
         self.last_packet = None
 
     def _grow_dict(self, reference: dict, target: dict):
@@ -39,6 +71,8 @@ class Decompressor:
             elif isinstance(v, dict):
                 self._grow_dict(reference[k], target[k])
             else:
+                if isinstance(target[k], ArrayPatch):
+                    target[k] = target[k].apply(v)
                 reference[k] = deepcopy(target[k])
 
         for k, v in target.items():
@@ -55,7 +89,12 @@ class Decompressor:
 
         for data_packet in self.source_generator:
 
-            if self.last_packet is None:
+            if self.share_values:
+                if self.last_packet is not None:
+                    _grow_shared(self.last_packet, data_packet, fill_none=False)
+                self.last_packet = data_packet
+                yield data_packet
+            elif self.last_packet is None:
                 self.last_packet = deepcopy(data_packet)
                 yield data_packet
             else:
@@ -69,11 +108,16 @@ class JITDecompressor:
     Adds back the redundant data that was removed during the compression process.
     """
 
-    def __init__(self):
+    def __init__(self, share_values: Optional[bool] = False):
         """
         Instantiates the wrapper
+
+        Args:
+            share_values (Optional[bool]): If true values carried over from previous packets are shared instead of
+                copied, so consecutive packets may hold the same objects and must be treated as read-only
         """
 
+        self.share_values = share_values
         self.last_packet = None
 
     def _grow_dict(self, reference: dict, target: dict):
@@ -93,6 +137,8 @@ class JITDecompressor:
             elif isinstance(v, dict):
                 self._grow_dict(reference[k], target[k])
             else:
+                if isinstance(target[k], ArrayPatch):
+                    target[k] = target[k].apply(v)
                 reference[k] = deepcopy(target[k])
 
         for k, v in target.items():
@@ -111,7 +157,12 @@ class JITDecompressor:
             dict: Decompressed packet
         """
 
-        if self.last_packet is None:
+        if self.share_values:
+            if self.last_packet is not None:
+                _grow_shared(self.last_packet, source_packet, fill_none=True)
+            self.last_packet = source_packet
+            return source_packet
+        elif self.last_packet is None:
             self.last_packet = deepcopy(source_packet)
             return source_packet
         else:
@@ -0,0 +1,329 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import logging
+
+from .index import FrameIndex, index_path_for
+from .keyframes import KeyframeIndex, keyframes_path_for
+from .players import Player
+from .records import METADATA_FILES, FramedMetadataWriter, PickleMetadataReader, open_metadata, \
+    session_metadata_path
+from .sidecar import source_signature
+from .telemetry import Telemetry, telemetry_path_for
+
+
+# progress of a session's conversion, kept in the session directory so interrupted conversions resume
+STATE_FILE = "nemoconvert.json"
+STATE_VERSION = 1
+
+
+def find_sessions(paths: List[str]) -> List[str]:
+    """
+    Looks for recorded sessions, directories holding metadata.pkl or metadata.nrec.
+
+    Args:
+        paths (List[str]): Session directories, or directories searched recursively for sessions
+
+    Returns:
+        List[str]: Sorted session directories
+    """
+
+    sessions = set()
+
+    for path in paths:
+        for root, _, files in os.walk(path):
+            if any(name in files for name in METADATA_FILES):
+                sessions.add(root)
+
+    return sorted(sessions)
+
+
+def _load_state(session_path: str) -> dict:
+    try:
+        with open(os.path.join(session_path, STATE_FILE), "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return state if state.get("version") == STATE_VERSION else {}
+
+
+def _save_state(session_path: str, state: dict):
+    path = os.path.join(session_path, STATE_FILE)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+
+    with open(tmp_path, "w") as f:
+        json.dump(dict(state, version=STATE_VERSION), f, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+def reframe_metadata(pickle_path: str, framed_path: str) -> int:
+    """
+    Rewrites metadata.pkl in the framed format (see records). The new file is written next to its destination and
+    moved in place once complete, so an interrupted conversion never leaves a partial metadata.nrec behind.
+    The signature of metadata.pkl is stored in the header, so the Player ignores metadata.nrec if it is re-recorded.
+
+    Args:
+        pickle_path (str): Source metadata.pkl
+        framed_path (str): Destination metadata.nrec
+
+    Returns:
+        int: Number of packets written
+    """
+
+    tmp_path = f"{framed_path}.tmp{os.getpid()}"
+    num_packets = 0
+
+    # taken before reading, a metadata.pkl changed during the conversion leaves a stale metadata.nrec behind
+    signature = source_signature(pickle_path)
+
+    try:
+        with PickleMetadataReader(pickle_path) as reader, \
+                FramedMetadataWriter(tmp_path, reader.video_paths, source=signature) as writer:
+            for packet in reader.iter_packets():
+                writer.append(packet)
+                num_packets += 1
+
+        os.replace(tmp_path, framed_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return num_packets
+
+
+def _values_equal(expected, actual) -> bool:
+    if isinstance(expected, np.ndarray) or isinstance(actual, np.ndarray):
+        return isinstance(expected, np.ndarray) and isinstance(actual, np.ndarray) and expected.dtype == actual.dtype \
+            and np.array_equal(expected, actual, equal_nan=expected.dtype.kind == "f")
+
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and expected.keys() == actual.keys() \
+            and all(_values_equal(v, actual[k]) for k, v in expected.items())
+
+    if isinstance(expected, (list, tuple)):
+        return type(expected) is type(actual) and len(expected) == len(actual) \
+            and all(_values_equal(e, a) for e, a in zip(expected, actual))
+
+    if type(expected) is not type(actual):
+        return False
+
+    if expected == actual:
+        return True
+
+    # objects without __eq__ (e.g. GPS sentences) are compared by their attributes
+    return hasattr(expected, "__dict__") and _values_equal(vars(expected), vars(actual))
+
+
+def verify_session(session_path: str):
+    """
+    Replays a converted session with a Player, checking it against the packets of metadata.pkl (or of
+    metadata.nrec for sessions recorded in the framed format): the index, the telemetry and every packet,
+    without decoding the images.
+
+    Args:
+        session_path (str): Session directory
+
+    Raises:
+        Exception: On the first difference found
+    """
+
+    source_path = os.path.join(session_path, "metadata.pkl")
+    if not os.path.exists(source_path):
+        source_path = session_metadata_path(session_path)
+
+    with open_metadata(source_path) as source:
+        positions = tuple(source.video_paths)
+
+        with Player(session_path, enabled_positions=positions, lazy_images=True) as player:
+            num_packets = 0
+
+            for i, expected in enumerate(source.iter_packets()):
+                packet = player.get_next_packet()
+
+                if packet is None:
+                    raise Exception(f"{session_path}: replay ended after {i} packets")
+
+                if player.frame_index.datetime_at(i) != expected["datetime"]:
+                    raise Exception(f"{session_path}: wrong index datetime for packet {i}")
+
+                expected_images = expected.get("images")
+                images = packet.get("images")
+
+                if (expected_images is None) != (images is None):
+                    raise Exception(f"{session_path}: wrong images for packet {i}")
+
+                for pos in positions:
+                    expected_frame = None if expected_images is None else expected_images.get(pos)
+                    frame = None if images is None else images.frame_number(pos)
+
+                    if expected_frame != frame or expected_frame != player.frame_index.frame_number(i, pos):
+                        raise Exception(f"{session_path}: wrong {pos} frame number for packet {i}")
+
+                others = {k: v for k, v in expected.items() if k != "images"}
+                if not _values_equal(others, {k: v for k, v in packet.items() if k != "images"}):
+                    raise Exception(f"{session_path}: packet {i} differs from the recording")
+
+                num_packets += 1
+
+            if player.get_next_packet() is not None or len(player) != num_packets:
+                raise Exception(f"{session_path}: replay has more packets than the recording")
+
+            if len(player.telemetry()) != num_packets:
+                raise Exception(f"{session_path}: telemetry doesn't cover all the packets")
+
+
+def convert_session(session_path: str,
+                    reframe: Optional[bool] = False,
+                    verify: Optional[bool] = True,
+                    index_method: Optional[str] = "scan",
+                    force: Optional[bool] = False
+                    ) -> dict:
+    """
+    Brings a session up to the indexed layout: builds the frame index, telemetry and keyframe sidecars and
+    optionally rewrites metadata.pkl as metadata.nrec. Steps that were already done (by an earlier, possibly
+    interrupted, run) and whose sources haven't changed since are skipped.
+
+    Args:
+        session_path (str): Session directory
+        reframe (Optional[bool]): If true metadata.pkl is also rewritten in the framed format (see records),
+            which the Player then reads instead of metadata.pkl
+        verify (Optional[bool]): If true the converted session is checked with verify_session()
+        index_method (Optional[str]): "scan" or "unpickle", see FrameIndex.build()
+        force (Optional[bool]): If true the progress recorded by earlier runs is ignored and every step is run again,
+            sidecars that are up to date are still reused
+
+    Returns:
+        dict: The steps that were "done" and "skipped"
+    """
+
+    state = {} if force else _load_state(session_path)
+    state.setdefault("steps", {})
+    report = {"done": [], "skipped": []}
+
+    def finished(step: str, signature: dict):
+        state["steps"][step] = signature
+        _save_state(session_path, state)
+        report["done"].append(step)
+
+    def up_to_date(step: str, signature: dict, output_path: Optional[str] = None) -> bool:
+        # a step whose output was deleted since is run again
+        if state["steps"].get(step) == signature and (output_path is None or os.path.exists(output_path)):
+            report["skipped"].append(step)
+            return True
+        return False
+
+    pickle_path = os.path.join(session_path, "metadata.pkl")
+    framed_path = os.path.join(session_path, "metadata.nrec")
+
+    if reframe and os.path.exists(pickle_path):
+        signature = source_signature(pickle_path)
+
+        if not up_to_date("reframe", signature, framed_path):
+            num_packets = reframe_metadata(pickle_path, framed_path)
+            logging.info(f"{session_path}: reframed {num_packets} packets")
+            finished("reframe", signature)
+
+    metadata_path = session_metadata_path(session_path)
+    signature = dict(source_signature(metadata_path), path=os.path.basename(metadata_path))
+
+    # the sidecars are invalidated by their own signatures, building an up to date one only loads it
+    if not up_to_date("index", signature, index_path_for(metadata_path)):
+        FrameIndex.build(metadata_path, use_sidecar=True, method=index_method)
+        finished("index", signature)
+
+    if not up_to_date("telemetry", signature, telemetry_path_for(metadata_path)):
+        Telemetry.build(metadata_path, use_sidecar=True)
+        finished("telemetry", signature)
+
+    with open_metadata(metadata_path) as reader:
+        video_paths = reader.video_paths
+
+    for pos, video_path in video_paths.items():
+        video_path = os.path.join(session_path, video_path)
+        step = f"keyframes:{pos}"
+
+        if not os.path.exists(video_path) or \
+                up_to_date(step, source_signature(video_path), keyframes_path_for(video_path)):
+            continue
+
+        if KeyframeIndex.build(video_path, use_sidecar=True) is None:
+            logging.warning(f"{session_path}: no keyframe table for {pos}, is PyAV installed?")
+            continue
+
+        finished(step, source_signature(video_path))
+
+    if verify and not up_to_date("verify", signature):
+        verify_session(session_path)
+        finished("verify", signature)
+
+    return report
+
+
+def convert_sessions(session_paths: List[str],
+                     num_workers: Optional[int] = None,
+                     **options
+                     ) -> Iterator[Tuple[str, Optional[dict], Optional[Exception]]]:
+    """
+    Converts many sessions in parallel, one session per worker process, see convert_session().
+
+    Args:
+        session_paths (List[str]): Session directories
+        num_workers (Optional[int]): Number of worker processes, defaults to the CPU count
+        **options: Arguments given to convert_session()
+
+    Returns:
+        Iterator[Tuple[str, Optional[dict], Optional[Exception]]]: Session path, report and error of each session,
+            in the order they finish
+    """
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(convert_session, path, **options): path for path in session_paths}
+
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="nemoconvert",
+                                     description="Builds the index, telemetry and keyframe caches of recorded "
+                                                 "sessions, resuming where an earlier run stopped.")
+    parser.add_argument("paths", nargs="+", help="session directories or directories containing sessions")
+    parser.add_argument("--reframe", action="store_true", help="also rewrite metadata.pkl as metadata.nrec")
+    parser.add_argument("--no-verify", action="store_true", help="don't replay the converted sessions")
+    parser.add_argument("--force", action="store_true", help="redo the steps already done")
+    parser.add_argument("--index-method", default="scan", choices=("scan", "unpickle"))
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, the CPU count by default")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    sessions = find_sessions(args.paths)
+    logging.info(f"Converting {len(sessions)} sessions")
+
+    failed = 0
+    for path, report, error in convert_sessions(sessions, args.workers, reframe=args.reframe,
+                                                verify=not args.no_verify, index_method=args.index_method,
+                                                force=args.force):
+        if error is not None:
+            failed += 1
+            logging.error(f"{path}: {error}")
+        else:
+            logging.info(f"{path}: done {report['done']}, already done {report['skipped']}")
+
+    logging.info(f"Converted {len(sessions) - failed} of {len(sessions)} sessions")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from typing import Hashable, Optional
+import threading
+
+import numpy as np
+
+
+class FrameCache:
+    """
+    Least recently used cache of decoded frames, limited by the total size of the cached images.
+    Frames are copied in and out, so the images handed to the caller can be modified freely.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes (int): Memory budget, least recently used frames are evicted to stay under it
+        """
+
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._frames = OrderedDict()
+        # the Player may decode the cameras of a packet concurrently
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._frames
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """
+        Args:
+            key (Hashable): Frame key, (camera position, frame number) in Player
+
+        Returns:
+            Optional[np.ndarray]: Copy of the cached frame or None if it is not cached
+        """
+
+        with self._lock:
+            frame = self._frames.get(key)
+
+            if frame is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._frames.move_to_end(key)
+
+        return frame.copy()
+
+    def put(self, key: Hashable, frame: Optional[np.ndarray]):
+        """
+        Caches a copy of a frame, evicting the least recently used frames if the budget is exceeded.
+        Frames bigger than the whole budget are not cached.
+
+        Args:
+            key (Hashable): Frame key
+            frame (Optional[np.ndarray]): Decoded frame, None (past the end of the video) is not cached
+        """
+
+        if frame is None or frame.nbytes > self.max_bytes:
+            return
+
+        frame = frame.copy()
+
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= previous.nbytes
+
+            self._frames[key] = frame
+            self.size_bytes += frame.nbytes
+
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.size_bytes -= evicted.nbytes
+
+    def clear(self):
+        """Drops all the cached frames, the hit and miss counters are kept."""
+
+        with self._lock:
+            self._frames.clear()
+            self.size_bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of the lookups that were hits, 0 before the first lookup."""
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -6,7 +6,6 @@ import time
 import os
 from threading import Event
 
-import cv2
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtCore import QThread, pyqtSignal, Qt, pyqtSlot, QByteArray
 from PyQt5.QtGui import QImage, QPixmap, QIcon
@@ -56,14 +55,15 @@ class StreamThread(QThread):
 
         self.telemetry_delay_frames = 10
 
-        self.player = Player(self.rec_path)  # VariableSampleRatePlayer(self.rec_path, min_packet_delay_ms=300)
+        # VariableSampleRatePlayer(self.rec_path, min_packet_delay_ms=300)
+        # frames are downscaled and converted to RGB by the decoding threads
+        self.player = Player(self.rec_path, background_indexing=True, prefetch_frames=4,
+                             frame_cache_bytes=256 * 2 ** 20, output_size=1 / 2.8, color_format="rgb")
         self.player.start()
 
         # self.change_pixmap = pyqtSignal(QImage) THIS IS WRONG! Because of the internal implementation of QtSignal
 
-    def img_ocv_to_qt(self, ocv_img):
-        rgb_frame = cv2.cvtColor(ocv_img, cv2.COLOR_BGR2RGB)
-
+    def img_ocv_to_qt(self, rgb_frame):
         h, w, ch = rgb_frame.shape
         bytes_per_line = ch * w
         qt_image = QImage(rgb_frame.data, w, h, bytes_per_line, QImage.Format_RGB888)
@@ -81,11 +81,11 @@ class StreamThread(QThread):
         self.player.rewind()
 
         start_datetime = self.player.start_datetime
-        end_datetime = self.player.end_datetime
 
-        self.signal_end_time.emit(self.strfdelta(end_datetime - start_datetime, "{H:02d}:{M:02d}:{S:02d}"))
+        self.signal_end_time.emit(self.strfdelta(self.player.end_datetime - start_datetime, "{H:02d}:{M:02d}:{S:02d}"))
 
-        total_num_frames = len(self.player)
+        # the indices are still growing in the background, so the length and end time are refreshed while playing
+        end_time_final = False
 
         source_stream = self.player.stream_generator(loop=True)
 
@@ -113,16 +113,6 @@ class StreamThread(QThread):
 
             # show telemetry to user
 
-            for pos in recv_obj["images"].keys():
-
-                if not recv_obj["images"][pos] is None:
-
-                    # recv_obj["images"][pos] = cv2.imdecode(recv_obj["images"][pos])
-
-                    recv_obj["images"][pos] = cv2.resize(recv_obj["images"][pos],
-                                                         (int(recv_obj["images"][pos].shape[1] / 2.8),
-                                                          int(recv_obj["images"][pos].shape[0] / 2.8)))
-
             if "left" in recv_obj["images"].keys() and recv_obj["images"]["left"] is not None:
                 self.signal_change_pixmap_left.emit(self.img_ocv_to_qt(recv_obj["images"]["left"]))
 
@@ -180,12 +170,17 @@ class StreamThread(QThread):
                                                          "{H:02d}:{M:02d}:{S:02d}"))
 
             crt_frame = self.player.crt_frame_index
-            self.signal_progress.emit(int(crt_frame / total_num_frames * 100))
+            self.signal_progress.emit(min(100, int(crt_frame / len(self.player) * 100)))
 
             if telemetry_delay > self.telemetry_delay_frames:
 
                 telemetry_delay = 0
 
+                if not end_time_final:
+                    end_time_final = self.player.index_complete
+                    self.signal_end_time.emit(self.strfdelta(self.player.end_datetime - start_datetime,
+                                                             "{H:02d}:{M:02d}:{S:02d}"))
+
                 avg_delay_ms = statistics.mean(multiple_delay_ms)
                 multiple_delay_ms.clear()
                 #self.signal_fps.emit(int(1/avg_delay_ms * 1000))
@@ -230,8 +225,10 @@ class StreamThread(QThread):
 
     def goto(self, percent):
         if not self.can_play.is_set():
-            target_frame = int(percent * len(self.player) / 100)
-            self.player.crt_frame_index = target_frame
+            # seek by time, packets are not evenly spread over the recording
+            start_datetime = self.player.start_datetime
+            target_datetime = start_datetime + (self.player.end_datetime - start_datetime) * percent / 100
+            self.player.seek_datetime(target_datetime)
 
 
 class MyWindow(QtWidgets.QMainWindow):
@@ -0,0 +1,504 @@
+from typing import Iterator, Optional, Tuple
+import datetime
+import pickle
+import threading
+
+import numpy as np
+
+import logging
+
+from .sidecar import source_signature, read_columns, write_columns
+
+
+INDEX_VERSION = 1
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_ONE_US = datetime.timedelta(microseconds=1)
+
+
+def datetime_to_us(value: datetime.datetime) -> int:
+    """
+    Converts a packet datetime to an integer number of microseconds since the epoch.
+    Naive datetimes are converted as they are, without assuming any time zone.
+
+    Args:
+        value (datetime.datetime): Packet datetime
+
+    Returns:
+        int: Microseconds since 1970-01-01
+    """
+
+    if value.tzinfo is None:
+        return (value - _EPOCH) // _ONE_US
+    return (value - _EPOCH_UTC) // _ONE_US
+
+
+def us_to_datetime(value: int, aware: Optional[bool] = False) -> datetime.datetime:
+    """
+    Inverse of datetime_to_us().
+
+    Args:
+        value (int): Microseconds since 1970-01-01
+        aware (Optional[bool]): If true the result will be a UTC datetime, otherwise a naive one
+
+    Returns:
+        datetime.datetime: Packet datetime
+    """
+
+    return (_EPOCH_UTC if aware else _EPOCH) + datetime.timedelta(microseconds=int(value))
+
+
+def index_path_for(metadata_path: str) -> str:
+    """Path of the sidecar file that caches the index of the given metadata file."""
+    return metadata_path + ".index"
+
+
+def iter_unpickled_records(metadata_file,
+                           positions: Tuple[str]) -> Iterator[Tuple[int, datetime.datetime, Tuple[int]]]:
+    """
+    Reads packets one by one from a metadata file and yields what the index needs to know about them.
+    The file must be positioned after its header (the video paths).
+
+    Args:
+        metadata_file: File object opened in binary mode
+        positions (Tuple[str]): Names of the cameras whose frame numbers will be recorded
+
+    Returns:
+        Iterator[Tuple[int, datetime.datetime, Tuple[int]]]: Offset, datetime and per camera frame numbers
+            (-1 where the packet has no image) of each packet
+    """
+
+    while True:
+        offset = metadata_file.tell()
+        try:
+            packet = pickle.load(metadata_file)
+        except (EOFError, pickle.UnpicklingError):
+            break
+
+        yield offset, packet["datetime"], packet_frame_numbers(packet.get("images"), positions)
+
+
+def iter_records(metadata_file, positions: Tuple[str],
+                 method: Optional[str] = "scan") -> Iterator[Tuple[int, datetime.datetime, Tuple[int]]]:
+    """
+    Yields what the index needs to know about each packet, using the chosen reading method.
+
+    Args:
+        metadata_file: File object opened in binary mode, positioned after its header (the video paths)
+        positions (Tuple[str]): Names of the cameras whose frame numbers will be recorded
+        method (Optional[str]): "scan" or "unpickle", see FrameIndex.build()
+
+    Returns:
+        Iterator[Tuple[int, datetime.datetime, Tuple[int]]]: see iter_unpickled_records()
+    """
+
+    if method == "scan":
+        from .pickle_scanner import iter_scanned_records
+        return iter_scanned_records(metadata_file, positions)
+    elif method == "unpickle":
+        return iter_unpickled_records(metadata_file, positions)
+    else:
+        raise Exception(f"Unknown indexing method {method}")
+
+
+def packet_frame_numbers(images: Optional[dict], positions: Tuple[str]) -> Tuple[int]:
+    """
+    Args:
+        images (Optional[dict]): The "images" field of a packet, camera name to frame number (or None)
+        positions (Tuple[str]): Names of the cameras, in the order of the result
+
+    Returns:
+        Tuple[int]: Frame number for each camera, -1 where the packet has no image
+    """
+
+    if images is None:
+        return (-1,) * len(positions)
+    return tuple(-1 if images.get(pos) is None else int(images[pos]) for pos in positions)
+
+
+class FrameIndex:
+    """
+    Byte offsets, timestamps and per camera frame numbers of every packet in a metadata file.
+    Can be saved as a sidecar next to the metadata file and memory mapped back in later sessions.
+    """
+
+    def __init__(self,
+                 positions: Tuple[str],
+                 offsets: Optional[np.ndarray] = None,
+                 timestamps: Optional[np.ndarray] = None,
+                 frame_numbers: Optional[np.ndarray] = None,
+                 aware: Optional[bool] = False
+                 ):
+        """
+        Instantiates the index, either empty or from existing arrays.
+
+        Args:
+            positions (Tuple[str]): Names of all the cameras in the recording, in column order of frame_numbers
+            offsets (Optional[np.ndarray]): int64 byte offset of each packet in the metadata file
+            timestamps (Optional[np.ndarray]): int64 packet datetimes, see datetime_to_us()
+            frame_numbers (Optional[np.ndarray]): int64 (num_packets, num_positions) frame numbers, -1 if no image
+            aware (Optional[bool]): True if the recording uses time zone aware datetimes
+        """
+
+        self.positions = tuple(positions)
+        self.aware = aware
+
+        if offsets is None:
+            offsets = np.empty(0, dtype=np.int64)
+            timestamps = np.empty(0, dtype=np.int64)
+            frame_numbers = np.empty((0, len(self.positions)), dtype=np.int64)
+
+        self._offsets = offsets
+        self._timestamps = timestamps
+        self._frame_numbers = frame_numbers
+        self._size = len(offsets)
+
+        # views of the first _size packets, replaced as a whole once new packets are written, so threads reading
+        # the index while an IndexBuilder grows it never see the storage and the size out of step
+        self._columns = (offsets, timestamps, frame_numbers)
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._columns[0]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._columns[1]
+
+    @property
+    def frame_numbers(self) -> np.ndarray:
+        return self._columns[2]
+
+    def _publish(self):
+        size = self._size
+        self._columns = (self._offsets[:size], self._timestamps[:size], self._frame_numbers[:size])
+
+    def append(self, offset: int, timestamp: int, frame_numbers: Tuple[int]):
+        """
+        Adds a packet at the end of the index. Storage grows geometrically.
+
+        Args:
+            offset (int): Byte offset of the packet in the metadata file
+            timestamp (int): Packet datetime, see datetime_to_us()
+            frame_numbers (Tuple[int]): Frame number for each camera in self.positions, -1 if no image
+        """
+
+        self._append(offset, timestamp, frame_numbers)
+        self._publish()
+
+    def _append(self, offset: int, timestamp: int, frame_numbers: Tuple[int]):
+        """Writes a packet past the published ones, readers only see it once _publish() is called"""
+
+        if self._size == len(self._offsets):
+            capacity = max(1024, 2 * self._size)
+
+            offsets = np.empty(capacity, dtype=np.int64)
+            timestamps = np.empty(capacity, dtype=np.int64)
+            frames = np.empty((capacity, len(self.positions)), dtype=np.int64)
+
+            offsets[:self._size] = self._offsets[:self._size]
+            timestamps[:self._size] = self._timestamps[:self._size]
+            frames[:self._size] = self._frame_numbers[:self._size]
+
+            self._offsets, self._timestamps, self._frame_numbers = offsets, timestamps, frames
+
+        self._offsets[self._size] = offset
+        self._timestamps[self._size] = timestamp
+        self._frame_numbers[self._size] = frame_numbers
+        self._size += 1
+
+    def extend(self, records: Iterator[Tuple[int, datetime.datetime, Tuple[int]]]):
+        """
+        Appends packets to the index, published to readers all at once when the records are exhausted.
+
+        Args:
+            records (Iterator[Tuple[int, datetime.datetime, Tuple[int]]]): Offset, datetime and frame numbers
+                of each packet, e.g. from iter_unpickled_records()
+        """
+
+        for offset, packet_datetime, frames in records:
+            if self._size == 0:
+                # aware and naive datetimes don't mix, the first packet decides for the whole recording
+                self.aware = packet_datetime.tzinfo is not None
+            self._append(offset, datetime_to_us(packet_datetime), frames)
+
+        self._publish()
+
+    @classmethod
+    def from_records(cls, positions: Tuple[str],
+                     records: Iterator[Tuple[int, datetime.datetime, Tuple[int]]]) -> "FrameIndex":
+        """
+        Builds an index from the records of a metadata file.
+
+        Args:
+            positions (Tuple[str]): Names of all the cameras in the recording
+            records (Iterator[Tuple[int, datetime.datetime, Tuple[int]]]): see extend()
+
+        Returns:
+            FrameIndex: Index of the records
+        """
+
+        index = cls(positions)
+        index.extend(records)
+        return index
+
+    def datetime_at(self, i: int) -> datetime.datetime:
+        """
+        Args:
+            i (int): Packet index, negative values count from the end
+
+        Returns:
+            datetime.datetime: Datetime of the packet
+        """
+        return us_to_datetime(self.timestamps[i], self.aware)
+
+    def frame_number(self, i: int, pos: str) -> Optional[int]:
+        """
+        Args:
+            i (int): Packet index
+            pos (str): Camera name
+
+        Returns:
+            Optional[int]: Frame number of the camera image in packet i or None if the packet has no such image
+        """
+
+        value = int(self.frame_numbers[i, self.positions.index(pos)])
+        return None if value < 0 else value
+
+    def save(self, path: str, signature: dict):
+        """
+        Writes the index to a sidecar file.
+
+        Args:
+            path (str): Destination file
+            signature (dict): source_signature() of the indexed metadata file
+        """
+
+        meta = {"kind": "frame_index", "version": INDEX_VERSION, "positions": list(self.positions), "aware": self.aware}
+        meta.update(signature)
+
+        write_columns(path, {
+            "offsets": self.offsets,
+            "timestamps": self.timestamps,
+            "frame_numbers": self.frame_numbers
+        }, meta)
+
+    @classmethod
+    def load(cls, path: str, signature: dict) -> Optional["FrameIndex"]:
+        """
+        Memory maps an index saved with save().
+
+        Args:
+            path (str): Sidecar file
+            signature (dict): source_signature() of the metadata file, the sidecar is ignored if it doesn't match
+
+        Returns:
+            Optional[FrameIndex]: The index or None if the sidecar is missing or stale
+        """
+
+        expected = {"kind": "frame_index", "version": INDEX_VERSION}
+        expected.update(signature)
+
+        result = read_columns(path, expected)
+        if result is None:
+            return None
+
+        meta, columns = result
+
+        return cls(meta["positions"], columns["offsets"], columns["timestamps"], columns["frame_numbers"],
+                   meta["aware"])
+
+    @classmethod
+    def from_sidecar(cls, metadata_path: str) -> Optional["FrameIndex"]:
+        """
+        Args:
+            metadata_path (str): Path to metadata.pkl
+
+        Returns:
+            Optional[FrameIndex]: The cached index of the file or None if there is no up to date sidecar
+        """
+
+        sidecar_path = index_path_for(metadata_path)
+        index = cls.load(sidecar_path, source_signature(metadata_path))
+
+        if index is not None:
+            logging.info(f"Loaded indices for {len(index)} frames from {sidecar_path}")
+
+        return index
+
+    @classmethod
+    def build(cls, metadata_path: str, use_sidecar: Optional[bool] = True,
+              method: Optional[str] = "scan") -> "FrameIndex":
+        """
+        Loads the index of a metadata file from its sidecar, or builds it by reading the whole file.
+        A freshly built index is saved as a sidecar for the next time.
+
+        Args:
+            metadata_path (str): Path to metadata.pkl
+            use_sidecar (Optional[bool]): If false the sidecar is neither read nor written
+            method (Optional[str]): How packets of metadata.pkl are read when building the index.
+                "scan" walks the pickle opcodes and decodes only the fields the index needs (see pickle_scanner),
+                "unpickle" loads every packet completely. Framed files (see records) keep the fields the index
+                needs in their record headers and are never unpickled.
+
+        Returns:
+            FrameIndex: Index of all the packets in the file
+        """
+
+        if use_sidecar:
+            index = cls.from_sidecar(metadata_path)
+            if index is not None:
+                return index
+
+        builder = IndexBuilder(metadata_path, method, use_sidecar)
+        builder.run()
+
+        return builder.index
+
+
+class IndexBuilder(threading.Thread):
+    """
+    Builds the FrameIndex of a metadata file, either in the calling thread (run()) or in the background (start()).
+    While building in the background the index can already be used, it grows as packets are read.
+    """
+
+    # readers waiting for packets are woken up after this many new packets
+    BATCH_SIZE = 256
+
+    def __init__(self, metadata_path: str, method: Optional[str] = "scan", save_sidecar: Optional[bool] = True):
+        """
+        Prepares an empty index for the file.
+
+        Args:
+            metadata_path (str): Path to metadata.pkl or metadata.nrec
+            method (Optional[str]): "scan" or "unpickle", see FrameIndex.build()
+            save_sidecar (Optional[bool]): If true the finished index is saved next to the metadata file
+        """
+
+        super(IndexBuilder, self).__init__(daemon=True, name=f"IndexBuilder({metadata_path})")
+
+        self.metadata_path = metadata_path
+        self.method = method
+        self.save_sidecar = save_sidecar
+
+        # taken before reading, so changes made to the file while it is indexed invalidate the sidecar
+        self._signature = source_signature(metadata_path)
+
+        from .records import open_metadata
+        self._reader = open_metadata(metadata_path)
+
+        self.index = FrameIndex(tuple(self._reader.video_paths.keys()))
+        # every packet was indexed
+        self.complete = False
+        # stop() ended the build early, the index only holds the packets read until then
+        self.stopped = False
+        self.error = None
+        # run() returned, whether the index is complete or not
+        self._finished = False
+
+        self._condition = threading.Condition()
+        self._stop_requested = False
+
+    def run(self):
+        """Reads the whole metadata file into self.index"""
+
+        try:
+            batch = []
+
+            for record in self._reader.iter_index_records(self.index.positions, self.method):
+                batch.append(record)
+
+                if len(batch) >= self.BATCH_SIZE:
+                    self._publish(batch)
+                    batch = []
+
+                    if self._stop_requested:
+                        self.stopped = True
+                        return
+
+            self._publish(batch)
+            logging.info(f"Indices built for {len(self.index)} frames!")
+
+            if self.save_sidecar:
+                sidecar_path = index_path_for(self.metadata_path)
+                try:
+                    self.index.save(sidecar_path, self._signature)
+                except OSError as e:
+                    logging.warning(f"Could not save index sidecar {sidecar_path}: {e}")
+
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self._reader.close()
+
+            with self._condition:
+                self.complete = self.error is None and not self.stopped
+                self._finished = True
+                self._condition.notify_all()
+
+    def _publish(self, batch: list):
+        with self._condition:
+            self.index.extend(batch)
+            self._condition.notify_all()
+
+    def wait_for_length(self, length: Optional[int] = None) -> int:
+        """
+        Blocks until the index holds at least the requested number of packets, or until it is complete.
+
+        Args:
+            length (Optional[int]): Number of packets needed, None waits for the complete index
+
+        Returns:
+            int: Number of packets in the index
+
+        Raises:
+            Exception: If the build failed, or was stopped before indexing the packets waited for
+        """
+
+        with self._condition:
+            while not self._finished and (length is None or len(self.index) < length):
+                self._condition.wait()
+
+        self._check_finished(length is None or len(self.index) < length)
+        return len(self.index)
+
+    def wait_for_timestamp(self, timestamp: int) -> int:
+        """
+        Blocks until the index reaches a packet at or after the given time, or until it is complete.
+
+        Args:
+            timestamp (int): Microsecond timestamp, see datetime_to_us()
+
+        Returns:
+            int: Number of packets in the index
+
+        Raises:
+            Exception: If the build failed, or was stopped before indexing the packets waited for
+        """
+
+        with self._condition:
+            while not self._finished and (len(self.index) == 0 or self.index.timestamps[-1] < timestamp):
+                self._condition.wait()
+
+        self._check_finished(len(self.index) == 0 or self.index.timestamps[-1] < timestamp)
+        return len(self.index)
+
+    def _check_finished(self, unsatisfied: bool):
+        """Raises if the build failed, or if it was stopped before reaching what a waiting reader needs"""
+
+        if self.error is not None:
+            raise Exception(f"Building the index of {self.metadata_path} failed") from self.error
+
+        if self.stopped and unsatisfied:
+            raise Exception(f"Building the index of {self.metadata_path} was stopped after {len(self.index)} packets")
+
+    def stop(self):
+        """Asks a background build to stop early and waits for it, readers still waiting for packets then raise"""
+        self._stop_requested = True
+        if self.is_alive():
+            self.join()
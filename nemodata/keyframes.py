@@ -0,0 +1,175 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+import logging
+
+from .sidecar import source_signature, read_columns, write_columns
+
+try:
+    # optional, only used to list the keyframes of a video without decoding it
+    import av
+except ImportError:
+    av = None
+
+# errors PyAV raises for unreadable or unsupported files, named AVError before PyAV 9
+_AV_ERRORS = (OSError, IndexError) + tuple(getattr(av, name) for name in ("FFmpegError", "AVError")
+                                           if hasattr(av, name))
+
+
+KEYFRAMES_VERSION = 1
+
+
+def keyframes_path_for(video_path: str) -> str:
+    """Path of the sidecar file that caches the keyframe table of the given video."""
+    return video_path + ".keyframes"
+
+
+class KeyframeIndex:
+    """
+    Frame numbers and byte positions of the keyframes (frames that can be decoded on their own) of a video.
+    A frame can be decoded exactly by seeking to the keyframe before it and decoding forward from there.
+    """
+
+    def __init__(self, frame_numbers: np.ndarray, byte_positions: np.ndarray, num_frames: int):
+        """
+        Args:
+            frame_numbers (np.ndarray): int64 sorted zero indexed frame numbers of the keyframes
+            byte_positions (np.ndarray): int64 offset of each keyframe in the video file, -1 if unknown
+            num_frames (int): Number of frames in the video
+        """
+
+        self.frame_numbers = frame_numbers
+        self.byte_positions = byte_positions
+        self.num_frames = num_frames
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def keyframe_for(self, frame_number: int) -> Tuple[int, int]:
+        """
+        Args:
+            frame_number (int): Zero indexed frame number
+
+        Returns:
+            Tuple[int, int]: Frame number and byte position of the closest keyframe at or before frame_number
+        """
+
+        i = int(np.searchsorted(self.frame_numbers, frame_number, side="right")) - 1
+        i = max(i, 0)
+        return int(self.frame_numbers[i]), int(self.byte_positions[i])
+
+    @classmethod
+    def from_video(cls, video_path: str) -> Optional["KeyframeIndex"]:
+        """
+        Lists the keyframes of a video by reading its packets, without decoding any frame. Requires PyAV.
+
+        Args:
+            video_path (str): Path to the video file
+
+        Returns:
+            Optional[KeyframeIndex]: The keyframe table, None if PyAV is not installed or the video can't be read
+        """
+
+        if av is None:
+            return None
+
+        try:
+            with av.open(video_path) as container:
+                stream = container.streams.video[0]
+
+                packets = []
+                for packet in container.demux(stream):
+                    if packet.size == 0:
+                        # flush packet at the end of the stream
+                        continue
+
+                    timestamp = packet.pts if packet.pts is not None else packet.dts
+                    packets.append((len(packets) if timestamp is None else timestamp,
+                                    packet.is_keyframe,
+                                    -1 if packet.pos is None else packet.pos))
+        except _AV_ERRORS as e:
+            logging.warning(f"Could not list the keyframes of {video_path}: {e}")
+            return None
+
+        # frames are numbered in presentation order, which differs from the packet order when B-frames are used
+        packets.sort(key=lambda p: p[0])
+
+        frame_numbers = [i for i, p in enumerate(packets) if p[1]]
+        byte_positions = [p[2] for p in packets if p[1]]
+
+        if not frame_numbers or frame_numbers[0] != 0:
+            # the first frame must always be decodable
+            frame_numbers.insert(0, 0)
+            byte_positions.insert(0, -1)
+
+        return cls(np.array(frame_numbers, dtype=np.int64), np.array(byte_positions, dtype=np.int64), len(packets))
+
+    def save(self, path: str, signature: dict):
+        """
+        Writes the table to a sidecar file.
+
+        Args:
+            path (str): Destination file
+            signature (dict): source_signature() of the video
+        """
+
+        meta = {"kind": "keyframes", "version": KEYFRAMES_VERSION, "num_frames": self.num_frames}
+        meta.update(signature)
+
+        write_columns(path, {"frame_numbers": self.frame_numbers, "byte_positions": self.byte_positions}, meta)
+
+    @classmethod
+    def load(cls, path: str, signature: dict) -> Optional["KeyframeIndex"]:
+        """
+        Memory maps a table saved with save().
+
+        Args:
+            path (str): Sidecar file
+            signature (dict): source_signature() of the video, the sidecar is ignored if it doesn't match
+
+        Returns:
+            Optional[KeyframeIndex]: The table or None if the sidecar is missing or stale
+        """
+
+        expected = {"kind": "keyframes", "version": KEYFRAMES_VERSION}
+        expected.update(signature)
+
+        result = read_columns(path, expected)
+        if result is None:
+            return None
+
+        meta, columns = result
+
+        return cls(columns["frame_numbers"], columns["byte_positions"], meta["num_frames"])
+
+    @classmethod
+    def build(cls, video_path: str, use_sidecar: Optional[bool] = True) -> Optional["KeyframeIndex"]:
+        """
+        Loads the keyframe table of a video from its sidecar, or builds it and saves the sidecar.
+
+        Args:
+            video_path (str): Path to the video file
+            use_sidecar (Optional[bool]): If false the sidecar is neither read nor written
+
+        Returns:
+            Optional[KeyframeIndex]: The table or None if it can't be built (e.g. PyAV is not installed)
+        """
+
+        sidecar_path = keyframes_path_for(video_path)
+        signature = source_signature(video_path)
+
+        if use_sidecar:
+            keyframes = cls.load(sidecar_path, signature)
+            if keyframes is not None:
+                return keyframes
+
+        keyframes = cls.from_video(video_path)
+
+        if keyframes is not None and use_sidecar:
+            try:
+                keyframes.save(sidecar_path, signature)
+            except OSError as e:
+                logging.warning(f"Could not save keyframes sidecar {sidecar_path}: {e}")
+
+        return keyframes
@@ -0,0 +1,278 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+import asyncio
+import pickle
+import struct
+
+import logging
+
+from .compression import JITCompressor, JITDecompressor
+from .players import Player
+
+
+# length of the pickled packet and number of raw buffers that follow it, an empty message ends the stream
+_MESSAGE_HEADER = struct.Struct("<QI")
+_BUFFER_LENGTH = struct.Struct("<Q")
+
+
+def encode_message(packet: Optional[dict]) -> List[memoryview]:
+    """
+    Serializes a packet for sending. The packet is pickled with protocol 5 without its arrays (images and other
+    NumPy data), which follow the pickle as raw buffers, without being copied.
+
+    Args:
+        packet (Optional[dict]): Compressed packet, None for the message ending the stream
+
+    Returns:
+        List[memoryview]: Chunks to be written in order
+    """
+
+    if packet is None:
+        return [memoryview(_MESSAGE_HEADER.pack(0, 0))]
+
+    buffers = []
+    payload = pickle.dumps(packet, protocol=5, buffer_callback=buffers.append)
+    buffers = [buffer.raw() for buffer in buffers]
+
+    header = _MESSAGE_HEADER.pack(len(payload), len(buffers)) + \
+        b"".join(_BUFFER_LENGTH.pack(buffer.nbytes) for buffer in buffers)
+
+    return [memoryview(header), memoryview(payload)] + buffers
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[dict]:
+    """
+    Reads a message written by encode_message().
+
+    Args:
+        reader (asyncio.StreamReader): Connection to the server
+
+    Returns:
+        Optional[dict]: The compressed packet, its arrays are read-only. None at the end of the stream.
+    """
+
+    payload_len, num_buffers = _MESSAGE_HEADER.unpack(await reader.readexactly(_MESSAGE_HEADER.size))
+
+    if payload_len == 0:
+        return None
+
+    lengths = await reader.readexactly(_BUFFER_LENGTH.size * num_buffers)
+    payload = await reader.readexactly(payload_len)
+    buffers = [await reader.readexactly(length) for length, in _BUFFER_LENGTH.iter_unpack(lengths)]
+
+    return pickle.loads(payload, buffers=buffers)
+
+
+class _Subscriber:
+    """A connected client, with its own compressor and queue of packets waiting to be sent"""
+
+    def __init__(self, writer: asyncio.StreamWriter, max_queued_packets: int, compressor_kwargs: dict):
+        self.writer = writer
+        self.queue = asyncio.Queue(max_queued_packets)
+        self.compressor = JITCompressor(**compressor_kwargs)
+        self.closed = False
+
+    async def put(self, packet: Optional[dict]):
+        if not self.closed:
+            await self.queue.put(packet)
+
+    def close(self):
+        self.closed = True
+
+        # a producer waiting for room in the queue must not wait forever
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+        self.writer.close()
+
+
+class PacketServer:
+    """
+    Plays back a recording once and streams its packets to every connected client over TCP.
+    Each client gets its own JITCompressor, so clients can connect at any time and receive a complete first packet.
+    Clients that fall behind fill their bounded queue and then hold back the playback, so memory use stays bounded.
+
+    Packets are sent pickled (see encode_message()), clients must only connect to servers they trust.
+    """
+
+    def __init__(self,
+                 player: Player,
+                 host: Optional[str] = "127.0.0.1",
+                 port: Optional[int] = 0,
+                 max_queued_packets: Optional[int] = 8,
+                 min_subscribers: Optional[int] = 1,
+                 large_arrays: Optional[str] = "reference",
+                 array_codec: Optional[str] = None
+                 ):
+        """
+        Args:
+            player (Player): Started Player whose packets are streamed, from its current position to the end
+            host (Optional[str]): Interface the server listens on
+            port (Optional[int]): TCP port, 0 picks a free one (see self.port once started)
+            max_queued_packets (Optional[int]): Packets waiting to be sent to each client before the playback waits
+            min_subscribers (Optional[int]): Playback starts once this many clients have connected
+            large_arrays (Optional[str]): See JITCompressor. The Player never modifies the arrays it returned,
+                so by default they are kept by reference instead of being copied for every client.
+            array_codec (Optional[str]): See JITCompressor
+        """
+
+        self.player = player
+        self.host = host
+        self.port = port
+        self.max_queued_packets = max_queued_packets
+        self.min_subscribers = min_subscribers
+        self.compressor_kwargs = {"large_arrays": large_arrays, "array_codec": array_codec}
+
+        self.packets_sent = 0
+        self.finished = False
+        self._subscribers = []
+        self._server = None
+        self._producer = None
+        self._enough_subscribers = None
+        # the Player is not thread safe, it is only ever used by this thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PacketServer")
+
+    async def start(self):
+        """Starts listening for clients and plays back the recording once enough of them have connected."""
+
+        self._enough_subscribers = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._producer = asyncio.ensure_future(self._produce())
+
+        logging.info(f"Streaming {self.player.in_path} on {self.host}:{self.port}")
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriber = _Subscriber(writer, self.max_queued_packets, self.compressor_kwargs)
+        self._subscribers.append(subscriber)
+
+        if len(self._subscribers) >= self.min_subscribers:
+            self._enough_subscribers.set()
+
+        if self.finished:
+            await subscriber.put(None)
+
+        try:
+            while (packet := await subscriber.queue.get()) is not None:
+                packet = subscriber.compressor.compress_next_packet(packet)
+                writer.writelines(encode_message(packet))
+                await writer.drain()
+
+            writer.writelines(encode_message(None))
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.info(f"Client {writer.get_extra_info('peername')} disconnected: {e}")
+        finally:
+            self._subscribers.remove(subscriber)
+            subscriber.close()
+
+    async def _produce(self):
+        loop = asyncio.get_running_loop()
+        await self._enough_subscribers.wait()
+
+        while True:
+            packet = await loop.run_in_executor(self._executor, self.player.get_next_packet)
+
+            # clients connecting from now on are told right away that the recording has ended
+            self.finished = packet is None
+
+            for subscriber in list(self._subscribers):
+                await subscriber.put(packet)
+
+            if packet is None:
+                break
+
+            self.packets_sent += 1
+
+    async def wait_finished(self):
+        """Waits until the recording has been played back to its end."""
+        await asyncio.shield(self._producer)
+
+    async def close(self):
+        """Stops the playback and disconnects the clients, the Player is left open."""
+
+        if self._producer is not None:
+            self._producer.cancel()
+            try:
+                await self._producer
+            except asyncio.CancelledError:
+                pass
+
+        for subscriber in list(self._subscribers):
+            subscriber.close()
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class PacketClient:
+    """
+    Receives the packets of a PacketServer, decompressed with a JITDecompressor, so values that are None
+    (e.g. missing images) are filled in with the previous ones. Arrays are read-only views of the received data.
+    """
+
+    def __init__(self, host: Optional[str] = "127.0.0.1", port: Optional[int] = 8470,
+                 share_values: Optional[bool] = False):
+        """
+        Args:
+            host (Optional[str]): Address of the server
+            port (Optional[int]): TCP port of the server
+            share_values (Optional[bool]): See JITDecompressor
+        """
+
+        self.host = host
+        self.port = port
+        self._decompressor = JITDecompressor(share_values=share_values)
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def get_next_packet(self) -> Optional[dict]:
+        """
+        Returns:
+            Optional[dict]: The next packet, None once the server finished playing back the recording
+        """
+
+        packet = await read_message(self._reader)
+
+        if packet is None:
+            return None
+
+        return self._decompressor.decompress_next_packet(packet)
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """Async generator providing the received packets."""
+
+        while (packet := await self.get_next_packet()) is not None:
+            yield packet
+
+    def __aiter__(self):
+        return self.stream()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
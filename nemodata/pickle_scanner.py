@@ -0,0 +1,496 @@
+from typing import Iterator, Optional, Tuple
+import codecs
+import datetime
+import mmap
+import pickle
+import struct
+
+import logging
+
+from .index import iter_unpickled_records, packet_frame_numbers
+
+
+class _Opaque:
+    """Placeholder for any object the scanner does not build (arrays, GPS sentences, ...)"""
+
+    def __repr__(self):
+        return "<opaque>"
+
+
+OPAQUE = _Opaque()
+
+
+class _Global:
+    """A class or function referenced by the pickle, kept by name only"""
+
+    __slots__ = ("module", "name")
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+
+
+class _BytesRef:
+    """A bytes payload that was skipped over, it can still be read from the buffer if needed"""
+
+    __slots__ = ("start", "length")
+
+    def __init__(self, start: int, length: int):
+        self.start = start
+        self.length = length
+
+
+class ScanError(Exception):
+    """Raised when a record uses pickle features the scanner does not understand"""
+
+
+_U1 = struct.Struct("<B")
+_U2 = struct.Struct("<H")
+_I4 = struct.Struct("<i")
+_U4 = struct.Struct("<I")
+_U8 = struct.Struct("<Q")
+_F8 = struct.Struct(">d")
+
+# opcodes whose argument is skipped over, by the size of their argument (or of its length prefix)
+_FIXED_ARG_SIZES = {
+    pickle.PROTO[0]: 1, pickle.BININT[0]: 4, pickle.BININT1[0]: 1, pickle.BININT2[0]: 2, pickle.BINFLOAT[0]: 8,
+    pickle.BINPUT[0]: 1, pickle.LONG_BINPUT[0]: 4, pickle.BINGET[0]: 1, pickle.LONG_BINGET[0]: 4,
+    pickle.EXT1[0]: 1, pickle.EXT2[0]: 2, pickle.EXT4[0]: 4,
+}
+_COUNTED_ARG_SIZES = {
+    pickle.SHORT_BINSTRING[0]: _U1, pickle.SHORT_BINUNICODE[0]: _U1, pickle.SHORT_BINBYTES[0]: _U1,
+    pickle.LONG1[0]: _U1, pickle.BINSTRING[0]: _U4, pickle.BINUNICODE[0]: _U4, pickle.BINBYTES[0]: _U4,
+    pickle.LONG4[0]: _U4, pickle.BINUNICODE8[0]: _U8, pickle.BINBYTES8[0]: _U8, pickle.BYTEARRAY8[0]: _U8,
+}
+_LINE_ARG_COUNTS = {
+    pickle.INT[0]: 1, pickle.LONG[0]: 1, pickle.FLOAT[0]: 1, pickle.STRING[0]: 1, pickle.UNICODE[0]: 1,
+    pickle.PUT[0]: 1, pickle.GET[0]: 1, pickle.PERSID[0]: 1, pickle.GLOBAL[0]: 2, pickle.INST[0]: 2,
+}
+
+_FRAME = pickle.FRAME[0]
+_STOP = pickle.STOP[0]
+_PROTO = pickle.PROTO[0]
+
+# after this many records in a row that had to be unpickled, scanning is abandoned for the file
+MAX_CONSECUTIVE_FALLBACKS = 16
+
+_WANTED_KEYS = ("datetime", "images")
+
+# the wanted values are complete right after one of these: REDUCE for datetimes, SETITEM(S) for the images
+_COMPLETING_OPS = frozenset((pickle.REDUCE[0], pickle.SETITEM[0], pickle.SETITEMS[0]))
+
+
+def _skip_op(buf, pos: int) -> Tuple[int, int]:
+    """Steps over one opcode without interpreting it. Returns the opcode and the position after it."""
+
+    op = buf[pos]
+    pos += 1
+
+    if op in _FIXED_ARG_SIZES:
+        return op, pos + _FIXED_ARG_SIZES[op]
+
+    length_struct = _COUNTED_ARG_SIZES.get(op)
+    if length_struct is not None:
+        length, = length_struct.unpack_from(buf, pos)
+        return op, pos + length_struct.size + length
+
+    if op == _FRAME:
+        return op, pos + 8
+
+    for _ in range(_LINE_ARG_COUNTS.get(op, 0)):
+        _, pos = _read_line(buf, pos)
+
+    return op, pos
+
+
+def _read_line(buf, pos: int) -> Tuple[bytes, int]:
+    end = buf.find(b"\n", pos)
+    if end < 0:
+        raise ScanError("Truncated record")
+    return buf[pos:end], end + 1
+
+
+def _as_bytes(buf, value) -> Optional[bytes]:
+    if isinstance(value, _BytesRef):
+        return buf[value.start:value.start + value.length]
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        # bytes saved by protocols 0 - 2 come back as latin1 strings
+        return value.encode("latin1")
+    return None
+
+
+def _reduce(buf, func, args):
+    """Evaluates the few REDUCE calls the index needs, everything else becomes OPAQUE"""
+
+    if not isinstance(func, _Global) or not isinstance(args, tuple):
+        return OPAQUE
+
+    if func.module == "datetime" and func.name == "datetime" and len(args) == 1:
+        state = _as_bytes(buf, args[0])
+        if state is not None and len(state) == 10:
+            return datetime.datetime(state)
+    elif func.module in ("_codecs", "codecs") and func.name == "encode" and len(args) == 2 \
+            and isinstance(args[0], str) and isinstance(args[1], str):
+        return codecs.encode(args[0], args[1])
+
+    return OPAQUE
+
+
+def _is_complete(key: str, value) -> bool:
+    """
+    Tells if a wanted value can no longer change. Datetimes are never modified after their REDUCE
+    and the images dict is filled by a single SETITEM or SETITEMS.
+    """
+
+    if key == "datetime":
+        return isinstance(value, datetime.datetime)
+    return isinstance(value, dict) and len(value) > 0
+
+
+def _is_settled(value) -> bool:
+    """
+    Tells if a value on the stack can't receive the items pushed after it. An empty dict or list may still be
+    waiting for the single SETITEM or APPEND the pickler emits for a container of one item, and a class may still
+    be waiting for its REDUCE.
+    """
+
+    if isinstance(value, (dict, list)):
+        return len(value) > 0
+    return not isinstance(value, _Global)
+
+
+def _root_pairs(stack: list, marks: list) -> Iterator[Tuple[str, object]]:
+    """
+    Yields the pairs on the stack that are waiting for the SETITEMS of the root dict (stack[0]).
+    The stack above the root's MARK is only read as key, value pairs up to the first value that may still be
+    a nested container being filled, the items after it could belong to that container rather than to the root.
+    """
+
+    if len(marks) != 1 or marks[0] != 1:
+        return
+
+    for i in range(1, len(stack) - 1, 2):
+        key, value = stack[i], stack[i + 1]
+
+        if not isinstance(key, str):
+            return
+
+        yield key, value
+
+        if not _is_settled(value):
+            return
+
+
+def _wanted_values(stack: list, marks: list) -> Optional[dict]:
+    """
+    Checks if the top level dict of the record has received all the wanted keys.
+    Pairs still on the stack (waiting for the final SETITEMS of the root dict) are counted as long as they
+    certainly belong to the root dict and their value is complete.
+    """
+
+    root = stack[0]
+    found = {k: root[k] for k in _WANTED_KEYS if k in root and _is_complete(k, root[k])}
+
+    for key, value in _root_pairs(stack, marks):
+        if key in _WANTED_KEYS and _is_complete(key, value):
+            found[key] = value
+
+    return found if len(found) == len(_WANTED_KEYS) else None
+
+
+def scan_record(buf, pos: int) -> Tuple[int, dict]:
+    """
+    Walks the opcodes of one pickled packet and decodes only its "datetime" and "images" fields.
+    Arrays, GPS sentences and other objects are never constructed, bytes payloads are jumped over.
+    Once both fields are known the rest of the record is skipped, whole pickle frames at a time.
+
+    Args:
+        buf: Buffer holding the metadata file (e.g. an mmap)
+        pos (int): Offset of the record in the buffer
+
+    Returns:
+        Tuple[int, dict]: Offset right after the record and a dict with the decoded fields
+    """
+
+    stack = []
+    marks = []
+    memo = {}
+    frame_end = 0
+
+    while True:
+        op = buf[pos]
+        pos += 1
+
+        if op == 0x94:  # MEMOIZE
+            memo[len(memo)] = stack[-1]
+        elif op == 0x8c:  # SHORT_BINUNICODE
+            length = buf[pos]
+            stack.append(str(buf[pos + 1:pos + 1 + length], "utf-8"))
+            pos += 1 + length
+        elif op == 0x28:  # MARK
+            marks.append(len(stack))
+        elif op == 0x7d:  # EMPTY_DICT
+            stack.append({})
+        elif op in (0x75, 0x73):  # SETITEMS, SETITEM
+            start = marks.pop() if op == 0x75 else len(stack) - 2
+            target = stack[start - 1]
+            if isinstance(target, dict):
+                for i in range(start, len(stack), 2):
+                    target[stack[i]] = stack[i + 1]
+            del stack[start:]
+        elif op == 0x4b:  # BININT1
+            stack.append(buf[pos])
+            pos += 1
+        elif op == 0x4d:  # BININT2
+            stack.append(_U2.unpack_from(buf, pos)[0])
+            pos += 2
+        elif op == 0x4a:  # BININT
+            stack.append(_I4.unpack_from(buf, pos)[0])
+            pos += 4
+        elif op == 0x47:  # BINFLOAT
+            stack.append(_F8.unpack_from(buf, pos)[0])
+            pos += 8
+        elif op == 0x4e:  # NONE
+            stack.append(None)
+        elif op == 0x88:  # NEWTRUE
+            stack.append(True)
+        elif op == 0x89:  # NEWFALSE
+            stack.append(False)
+        elif op in (0x68, 0x6a):  # BINGET, LONG_BINGET
+            if op == 0x68:
+                stack.append(memo[buf[pos]])
+                pos += 1
+            else:
+                stack.append(memo[_U4.unpack_from(buf, pos)[0]])
+                pos += 4
+        elif op in (0x71, 0x72):  # BINPUT, LONG_BINPUT
+            if op == 0x71:
+                memo[buf[pos]] = stack[-1]
+                pos += 1
+            else:
+                memo[_U4.unpack_from(buf, pos)[0]] = stack[-1]
+                pos += 4
+        elif op in (0x43, 0x42, 0x8e, 0x96):  # SHORT_BINBYTES, BINBYTES, BINBYTES8, BYTEARRAY8
+            length_struct = _COUNTED_ARG_SIZES[op] if op != 0x96 else _U8
+            length, = length_struct.unpack_from(buf, pos)
+            pos += length_struct.size
+            stack.append(_BytesRef(pos, length))
+            pos += length
+        elif op in (0x58, 0x8d):  # BINUNICODE, BINUNICODE8
+            length_struct = _U4 if op == 0x58 else _U8
+            length, = length_struct.unpack_from(buf, pos)
+            pos += length_struct.size
+            stack.append(str(buf[pos:pos + length], "utf-8"))
+            pos += length
+        elif op in (0x55, 0x54):  # SHORT_BINSTRING, BINSTRING
+            length_struct = _U1 if op == 0x55 else _U4
+            length, = length_struct.unpack_from(buf, pos)
+            pos += length_struct.size
+            stack.append(str(buf[pos:pos + length], "latin1"))
+            pos += length
+        elif op in (0x85, 0x86, 0x87):  # TUPLE1, TUPLE2, TUPLE3
+            n = op - 0x84
+            items = tuple(stack[-n:])
+            del stack[-n:]
+            stack.append(items)
+        elif op == 0x74:  # TUPLE
+            start = marks.pop()
+            items = tuple(stack[start:])
+            del stack[start:]
+            stack.append(items)
+        elif op == 0x29:  # EMPTY_TUPLE
+            stack.append(())
+        elif op == 0x5d:  # EMPTY_LIST
+            stack.append([])
+        elif op in (0x61, 0x65):  # APPEND, APPENDS
+            start = marks.pop() if op == 0x65 else len(stack) - 1
+            target = stack[start - 1]
+            if isinstance(target, list):
+                target.extend(stack[start:])
+            del stack[start:]
+        elif op == 0x93:  # STACK_GLOBAL
+            name = stack.pop()
+            stack[-1] = _Global(stack[-1], name)
+        elif op == 0x63:  # GLOBAL
+            module, pos = _read_line(buf, pos)
+            name, pos = _read_line(buf, pos)
+            stack.append(_Global(module.decode("utf-8"), name.decode("utf-8")))
+        elif op == 0x52:  # REDUCE
+            args = stack.pop()
+            stack[-1] = _reduce(buf, stack[-1], args)
+        elif op == 0x81:  # NEWOBJ
+            del stack[-1]
+            stack[-1] = OPAQUE
+        elif op == 0x92:  # NEWOBJ_EX
+            del stack[-2:]
+            stack[-1] = OPAQUE
+        elif op == 0x62:  # BUILD
+            del stack[-1]
+        elif op in (0x64, 0x6c, 0x91, 0x6f):  # DICT, LIST, FROZENSET, OBJ
+            start = marks.pop()
+            items = stack[start:]
+            del stack[start:]
+            if op == 0x64:
+                stack.append(dict(zip(items[::2], items[1::2])))
+            elif op == 0x6c:
+                stack.append(items)
+            else:
+                stack.append(OPAQUE)
+        elif op == 0x8f:  # EMPTY_SET
+            stack.append(OPAQUE)
+        elif op == 0x90:  # ADDITEMS
+            del stack[marks.pop():]
+        elif op == 0x30:  # POP
+            if marks and marks[-1] == len(stack):
+                marks.pop()
+            else:
+                stack.pop()
+        elif op == 0x31:  # POP_MARK
+            del stack[marks.pop():]
+        elif op == 0x32:  # DUP
+            stack.append(stack[-1])
+        elif op == 0x8a:  # LONG1
+            length = buf[pos]
+            stack.append(int.from_bytes(buf[pos + 1:pos + 1 + length], "little", signed=True))
+            pos += 1 + length
+        elif op == _FRAME:
+            frame_end = pos + 8 + _U8.unpack_from(buf, pos)[0]
+            pos += 8
+        elif op == _PROTO:
+            pos += 1
+        elif op == _STOP:
+            root = stack[-1] if stack else None
+            if not isinstance(root, dict):
+                raise ScanError("Record is not a dict")
+            return pos, root
+        elif op in (0x49, 0x4c, 0x46):  # INT, LONG, FLOAT
+            line, pos = _read_line(buf, pos)
+            if op == 0x46:
+                stack.append(float(line))
+            elif line in (b"00", b"01"):
+                stack.append(line == b"01")
+            else:
+                stack.append(int(line.rstrip(b"L")))
+        elif op in (0x70, 0x67):  # PUT, GET
+            line, pos = _read_line(buf, pos)
+            if op == 0x70:
+                memo[int(line)] = stack[-1]
+            else:
+                stack.append(memo[int(line)])
+        elif op in (0x53, 0x56):  # STRING, UNICODE
+            line, pos = _read_line(buf, pos)
+            if op == 0x56:
+                stack.append(line.decode("raw-unicode-escape"))
+            else:
+                stack.append(codecs.escape_decode(line[1:-1])[0].decode("latin1"))
+        else:
+            raise ScanError(f"Unsupported pickle opcode {op:#x}")
+
+        if op in _COMPLETING_OPS and len(marks) <= 1 and isinstance(stack[0], dict):
+            wanted = _wanted_values(stack, marks)
+            if wanted is not None:
+                return _skip_rest(buf, pos, frame_end), wanted
+
+
+def _skip_rest(buf, pos: int, frame_end: int) -> int:
+    """Finds the end of a record without interpreting the remaining opcodes"""
+
+    buf_len = len(buf)
+
+    while True:
+        if pos < frame_end:
+            # frames always hold whole opcodes, a PROTO (start of the next record) right after one means
+            # the STOP was its last opcode
+            pos = frame_end
+            if pos >= buf_len or buf[pos] == _PROTO:
+                return pos
+
+        op, next_pos = _skip_op(buf, pos)
+
+        if op == _FRAME:
+            frame_end = next_pos + _U8.unpack_from(buf, pos + 1)[0]
+        elif op == _STOP:
+            return next_pos
+        elif op not in _FIXED_ARG_SIZES and op not in _COUNTED_ARG_SIZES and op not in _LINE_ARG_COUNTS \
+                and op not in _SIMPLE_OPS:
+            raise ScanError(f"Unsupported pickle opcode {op:#x}")
+
+        pos = next_pos
+
+
+# opcodes without arguments
+_SIMPLE_OPS = frozenset(op[0] for op in (
+    pickle.MARK, pickle.POP, pickle.POP_MARK, pickle.DUP, pickle.NONE, pickle.NEWTRUE, pickle.NEWFALSE,
+    pickle.EMPTY_DICT, pickle.DICT, pickle.EMPTY_LIST, pickle.LIST, pickle.EMPTY_TUPLE, pickle.TUPLE,
+    pickle.TUPLE1, pickle.TUPLE2, pickle.TUPLE3, pickle.EMPTY_SET, pickle.ADDITEMS, pickle.FROZENSET,
+    pickle.APPEND, pickle.APPENDS, pickle.SETITEM, pickle.SETITEMS, pickle.MEMOIZE, pickle.STACK_GLOBAL,
+    pickle.REDUCE, pickle.BUILD, pickle.OBJ, pickle.NEWOBJ, pickle.NEWOBJ_EX, pickle.BINPERSID,
+    pickle.NEXT_BUFFER, pickle.READONLY_BUFFER,
+))
+
+
+def iter_scanned_records(metadata_file,
+                         positions: Tuple[str]) -> Iterator[Tuple[int, datetime.datetime, Tuple[int]]]:
+    """
+    Drop in replacement for index.iter_unpickled_records() that scans the pickle opcodes instead of loading
+    the packets. Records the scanner can't decode (e.g. time zone aware datetimes) are unpickled normally,
+    and if that keeps happening the rest of the file is simply unpickled.
+
+    Args:
+        metadata_file: File object opened in binary mode, positioned after its header (the video paths)
+        positions (Tuple[str]): Names of the cameras whose frame numbers will be recorded
+
+    Returns:
+        Iterator[Tuple[int, datetime.datetime, Tuple[int]]]: Offset, datetime and per camera frame numbers
+            (-1 where the packet has no image) of each packet
+    """
+
+    pos = metadata_file.tell()
+
+    try:
+        buf = mmap.mmap(metadata_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # empty file
+        return
+
+    consecutive_fallbacks = 0
+
+    try:
+        buf_len = len(buf)
+
+        while pos < buf_len:
+            try:
+                end, fields = scan_record(buf, pos)
+                packet_datetime = fields.get("datetime")
+                frames = packet_frame_numbers(fields.get("images"), positions)
+
+                if not isinstance(packet_datetime, datetime.datetime):
+                    raise ScanError("Packet datetime could not be decoded")
+
+                consecutive_fallbacks = 0
+            except (ScanError, IndexError, KeyError, TypeError, ValueError, struct.error) as e:
+                logging.debug(f"Falling back to unpickling the record at {pos}: {e}")
+
+                metadata_file.seek(pos, 0)
+                consecutive_fallbacks += 1
+
+                if consecutive_fallbacks > MAX_CONSECUTIVE_FALLBACKS:
+                    logging.info("Packets can't be scanned, unpickling the rest of the file")
+                    yield from iter_unpickled_records(metadata_file, positions)
+                    return
+
+                try:
+                    packet = pickle.load(metadata_file)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+
+                end = metadata_file.tell()
+                packet_datetime = packet["datetime"]
+                frames = packet_frame_numbers(packet.get("images"), positions)
+
+            yield pos, packet_datetime, frames
+            pos = end
+    finally:
+        buf.close()
@@ -1,9 +1,14 @@
-from typing import Iterator, Optional, Tuple, Union
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple, Union
+from collections import deque
+from collections.abc import MutableMapping
 from copy import deepcopy
+import asyncio
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-import pickle
 
 import cv2
 
@@ -12,17 +17,69 @@ import logging
 import datetime
 
 from .compression import JITDecompressor
+from .index import FrameIndex, IndexBuilder, datetime_to_us
+from .telemetry import Telemetry, CHANNELS, channel_value
+from .keyframes import KeyframeIndex
+from .frame_cache import FrameCache
+from .records import open_metadata, session_metadata_path
+
+
+# colour formats VideoReadBuffer can output, and the conversion from the BGR frames decoded by OpenCV
+COLOR_CONVERSIONS = {
+    "bgr": None,
+    "rgb": cv2.COLOR_BGR2RGB,
+    "gray": cv2.COLOR_BGR2GRAY,
+}
+
+
+def output_frame_shape(resolution: Tuple[float, float],
+                       output_size: Optional[Union[Tuple[int, int], float]] = None,
+                       color_format: Optional[str] = "bgr") -> Tuple[int, ...]:
+    """
+    Shape of the frames a VideoReadBuffer outputs.
+
+    Args:
+        resolution (Tuple[float, float]): Width and height of the video
+        output_size (Optional[Union[Tuple[int, int], float]]): See VideoReadBuffer
+        color_format (Optional[str]): See VideoReadBuffer
+
+    Returns:
+        Tuple[int, ...]: (height, width, 3), or (height, width) for "gray"
+    """
+
+    if output_size is None:
+        width, height = int(resolution[0]), int(resolution[1])
+    elif isinstance(output_size, (int, float)):
+        width, height = int(resolution[0] * output_size), int(resolution[1] * output_size)
+    else:
+        width, height = output_size
+
+    if color_format not in COLOR_CONVERSIONS:
+        raise Exception(f"Unknown color format {color_format}, expected one of {list(COLOR_CONVERSIONS)}")
+
+    return (height, width) if color_format == "gray" else (height, width, 3)
 
 
 class VideoReadBuffer:
     """Wrapper for the chosen video player backend, which also keeps track of the read frame indices."""
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, prefetch_frames: Optional[int] = 0, keyframe_seeking: Optional[bool] = True,
+                 max_grab_frames: Optional[int] = 16, output_size: Optional[Union[Tuple[int, int], float]] = None,
+                 interpolation: Optional[int] = cv2.INTER_LINEAR, color_format: Optional[str] = "bgr"):
         """
         Instantiates the buffer with the parameters of the video that will be played.
 
         Args:
             path (str): Path to the video file
+            prefetch_frames (Optional[int]): If bigger than 0 a worker thread decodes up to this many frames ahead,
+                so decoding overlaps with the work done on the previous frames
+            keyframe_seeking (Optional[bool]): If true seeks jump to the keyframe before the target and decode forward
+                to it, using a keyframe index built on the first seek (requires PyAV, see keyframes.KeyframeIndex)
+            max_grab_frames (Optional[int]): Seeks up to this many frames ahead decode forward without seeking
+            output_size (Optional[Union[Tuple[int, int], float]]): Width and height the frames are resized to,
+                or a scale factor for both. Frames keep the video resolution if None.
+            interpolation (Optional[int]): OpenCV interpolation flag used for resizing (e.g. cv2.INTER_AREA)
+            color_format (Optional[str]): "bgr" (OpenCV's default), "rgb" or "gray"
         """
 
         self.path = path
@@ -34,32 +91,209 @@ class VideoReadBuffer:
             self._video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
         )
 
+        self.output_size = output_size
+        self.interpolation = interpolation
+        self.color_format = color_format
+
+        self._frame_shape = output_frame_shape(self.resolution, output_size, color_format)
+        self._resize = self._frame_shape[:2] != (int(self.resolution[1]), int(self.resolution[0]))
+        self._color_conversion = COLOR_CONVERSIONS[color_format]
+
+        # reused by _decode() for the frames before resizing and before the colour conversion
+        self._raw_frame = None
+        self._resized_frame = None
+
         self._crt_frame = 0
+        # frame the capture will decode next, ahead of _crt_frame while prefetching
+        self._capture_frame = 0
+
+        self.keyframe_seeking = keyframe_seeking
+        self.max_grab_frames = max_grab_frames
+        self._keyframes = None
+        self._keyframes_loaded = False
+
+        self.prefetch_frames = prefetch_frames
+        self._prefetch_queue = None
+        self._prefetch_thread = None
+        self._prefetch_stop = None
+        self._prefetch_finished = False
+
+        if self.prefetch_frames > 0:
+            self._start_prefetch()
+
+    def _start_prefetch(self):
+        self._prefetch_queue = queue.Queue(maxsize=self.prefetch_frames)
+        self._prefetch_stop = threading.Event()
+        self._prefetch_finished = False
+
+        self._prefetch_thread = threading.Thread(target=self._prefetch_worker,
+                                                 args=(self._prefetch_queue, self._prefetch_stop),
+                                                 name=f"VideoReadBuffer({self.path})",
+                                                 daemon=True)
+        self._prefetch_thread.start()
+
+    def _prefetch_worker(self, frames: queue.Queue, stop: threading.Event):
+        """Decodes frames in order into the queue, which blocks the worker while it is full"""
+
+        while not stop.is_set():
+            res, frame = self._decode()
+            if res:
+                self._capture_frame += 1
+
+            # None marks the end of the video
+            frames.put(frame if res else None)
+
+            if not res:
+                break
+
+    def _stop_prefetch(self):
+        """Stops the worker, the frames it decoded ahead are discarded"""
+
+        if self._prefetch_thread is None:
+            return
+
+        self._prefetch_stop.set()
+
+        # a worker blocked on a full queue is released by making room
+        while self._prefetch_thread.is_alive():
+            try:
+                self._prefetch_queue.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+        self._prefetch_thread.join()
+        self._prefetch_thread = None
+        self._prefetch_queue = None
+
+    def _decode(self, out: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Decodes the next frame and converts it to the output size and colour format, on the calling thread.
+        The intermediate frames are kept in reused buffers, only the output is a new array (unless out is given).
+        """
+
+        if not self._resize and self._color_conversion is None:
+            return self._video_capture.read(image=out)
+
+        res, self._raw_frame = self._video_capture.read(image=self._raw_frame)
+        if not res:
+            return False, None
+
+        frame = self._raw_frame
+
+        if self._resize:
+            height, width = self._frame_shape[:2]
+            dst = out if self._color_conversion is None else self._resized_frame
+            frame = cv2.resize(frame, (width, height), dst=dst, interpolation=self.interpolation)
+
+            if self._color_conversion is not None:
+                self._resized_frame = frame
+
+        if self._color_conversion is not None:
+            frame = cv2.cvtColor(frame, self._color_conversion, dst=out)
+
+        return True, frame
+
+    @property
+    def keyframes(self) -> Optional[KeyframeIndex]:
+        """Keyframe index of the video, built on first use. None if it is disabled or can't be built."""
+
+        if not self._keyframes_loaded:
+            self._keyframes_loaded = True
+            if self.keyframe_seeking:
+                self._keyframes = KeyframeIndex.build(self.path)
+
+        return self._keyframes
+
+    def _grab_to(self, frame_number: int):
+        """Decodes forward without returning the frames, until the capture is at frame_number"""
+
+        while self._capture_frame < frame_number:
+            if not self._video_capture.grab():
+                break
+            self._capture_frame += 1
+
+        # past the end of the video the following reads return None anyway
+        self._capture_frame = frame_number
 
     def set_frame(self, frame_number: int):
         """
         Go to a specific frame in the video.
+        Frames close ahead are reached by decoding forward, other frames by seeking to the keyframe before them and
+        decoding forward from there, which is both faster and more accurate than seeking to the frame directly.
 
         Args:
             frame_number (int): Zero indexed frame number
         """
 
-        self._video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        if frame_number == self._crt_frame:
+            return
+
+        self._stop_prefetch()
+
+        distance = frame_number - self._capture_frame
+
+        if 0 <= distance <= self.max_grab_frames:
+            self._grab_to(frame_number)
+        elif self.keyframes is not None:
+            keyframe, _ = self.keyframes.keyframe_for(frame_number)
+
+            # a keyframe between the current position and the target has to be decoded anyway
+            if distance < 0 or keyframe > self._capture_frame:
+                self._video_capture.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                self._capture_frame = keyframe
+
+            self._grab_to(frame_number)
+        else:
+            self._video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            self._capture_frame = frame_number
+
         self._crt_frame = frame_number
 
-    def read_frame(self) -> np.ndarray:
+        if self.prefetch_frames > 0:
+            self._start_prefetch()
+
+    def rewind(self):
+        """Go back to the first frame of the video."""
+        self.set_frame(0)
+
+    def read_frame(self, out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Get the next frame in the video.
         The frame will be returned and the buffer will advance by one frame.
 
+        Args:
+            out (Optional[np.ndarray]): Preallocated array of shape frame_shape the frame is decoded into
+
         Returns:
-            np.ndarray: Frame as OpenCV format image
+            np.ndarray: Frame as OpenCV format image, out if it was given
         """
 
-        res, frame = self._video_capture.read()
+        if self._prefetch_queue is not None:
+            if self._prefetch_finished:
+                frame = None
+            else:
+                frame = self._prefetch_queue.get()
+                self._prefetch_finished = frame is None
+        else:
+            res, frame = self._decode(out)
+            if res:
+                self._capture_frame += 1
+            else:
+                frame = None
+
         self._crt_frame += 1
+
+        if out is not None and frame is not None and frame is not out:
+            np.copyto(out, frame)
+            frame = out
+
         return frame
 
+    @property
+    def frame_shape(self) -> Tuple[int, ...]:
+        """Shape of the frames returned by read_frame(), see output_frame_shape()"""
+        return self._frame_shape
+
     def get_crt_frame_number(self) -> int:
         """
         Get index of the current frame.
@@ -72,16 +306,108 @@ class VideoReadBuffer:
 
     def close(self):
         """Closes the video file and cleans all used resources."""
+        self._stop_prefetch()
         self._video_capture.release()
 
 
+class LazyImages(MutableMapping):
+    """
+    The "images" of a packet, decoding each camera image the first time it is accessed.
+    Behaves like the dict of images returned by a Player and turns into one when copied or pickled.
+    """
+
+    def __init__(self, player: "Player", frame_numbers: Dict[str, Optional[int]]):
+        """
+        Args:
+            player (Player): Player the packet was read from, whose videos decode the images
+            frame_numbers (Dict[str, Optional[int]]): Frame number of each camera image, None if there is no image
+        """
+
+        self._player = player
+        self._frame_numbers = frame_numbers
+        self._images = {}
+
+    def __getitem__(self, pos: str) -> Optional[np.ndarray]:
+        if pos not in self._images:
+            img_num = self._frame_numbers[pos]
+            self._images[pos] = None if img_num is None else self._player._read_image(pos, img_num)
+
+        return self._images[pos]
+
+    def __setitem__(self, pos: str, image: Optional[np.ndarray]):
+        if pos not in self._frame_numbers:
+            self._frame_numbers[pos] = None
+        self._images[pos] = image
+
+    def __delitem__(self, pos: str):
+        del self._frame_numbers[pos]
+        self._images.pop(pos, None)
+
+    def __iter__(self):
+        return iter(self._frame_numbers)
+
+    def __len__(self):
+        return len(self._frame_numbers)
+
+    def __repr__(self):
+        loaded = {pos: "<decoded>" if pos in self._images else f"<frame {img_num}>"
+                  for pos, img_num in self._frame_numbers.items()}
+        return f"LazyImages({loaded})"
+
+    def frame_number(self, pos: str) -> Optional[int]:
+        """
+        Args:
+            pos (str): Camera name
+
+        Returns:
+            Optional[int]: Frame number of the camera image in its video, None if there is no image
+        """
+        return self._frame_numbers[pos]
+
+    def is_loaded(self, pos: str) -> bool:
+        """
+        Args:
+            pos (str): Camera name
+
+        Returns:
+            bool: True if the image of the camera was already decoded (or has no frame)
+        """
+        return pos in self._images or self._frame_numbers.get(pos) is None
+
+    def load(self) -> dict:
+        """
+        Decodes all the images that were not accessed yet.
+
+        Returns:
+            dict: Camera name to image, like the "images" of a packet read without lazy_images
+        """
+        return {pos: self[pos] for pos in self._frame_numbers}
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.load(), memo)
+
+    def __reduce__(self):
+        return dict, (self.load(),)
+
+
 class Player:
     """Plays back a dataset recorded using a Recorder object"""
 
     def __init__(self,
                  in_path: Optional[str] = "./test_recording/",
                  compute_indices: Optional[bool] = True,
-                 enabled_positions: Optional[Tuple[str]] = ("center", "left", "right")
+                 enabled_positions: Optional[Tuple[str]] = ("center", "left", "right"),
+                 use_index_sidecar: Optional[bool] = True,
+                 index_method: Optional[str] = "scan",
+                 background_indexing: Optional[bool] = False,
+                 prefetch_frames: Optional[int] = 0,
+                 parallel_decode: Optional[bool] = False,
+                 keyframe_seeking: Optional[bool] = True,
+                 frame_cache_bytes: Optional[int] = 0,
+                 lazy_images: Optional[bool] = False,
+                 output_size: Optional[Union[Tuple[int, int], float]] = None,
+                 interpolation: Optional[int] = cv2.INTER_LINEAR,
+                 color_format: Optional[str] = "bgr"
                  ):
         """
         Instantiates the Player with the details of the dataset that will be played back.
@@ -92,6 +418,27 @@ class Player:
             in_path (Optional[str]): Directory where the dataset is found on disk
             compute_indices (Optional[bool]): If true seeking options for the dataset will be enabled
             enabled_positions (Optional[Tuple[str]]): Names of the cameras to be used (e.g. ("center", "left"))
+            use_index_sidecar (Optional[bool]): If true the indices are cached in a file next to metadata.pkl
+                and loaded from there on the next start(), as long as metadata.pkl has not changed
+            index_method (Optional[str]): "scan" builds the indices by walking the pickle opcodes, without
+                constructing the packets, "unpickle" loads every packet
+            background_indexing (Optional[bool]): If true start() returns without waiting for the indices,
+                they are built by a background thread while the Player streams. Until they are complete len() and
+                end_datetime only cover the packets indexed so far and seeks wait for the packet they need.
+            prefetch_frames (Optional[int]): If bigger than 0 each camera decodes up to this many frames ahead
+                in a worker thread, overlapping decoding with the processing of the previous packets
+            parallel_decode (Optional[bool]): If true the images of a packet are decoded concurrently, one thread
+                per camera, so a packet takes about as long as its slowest camera
+            keyframe_seeking (Optional[bool]): If true videos seek to the keyframe before the target frame and decode
+                forward to it (see VideoReadBuffer)
+            frame_cache_bytes (Optional[int]): If bigger than 0 decoded frames are kept in a least recently used cache
+                of this many bytes, so revisited frames are not decoded again (see frame_cache)
+            lazy_images (Optional[bool]): If true packet["images"] is a LazyImages mapping that decodes each camera
+                image on first access, images that are never accessed are skipped without being converted
+            output_size (Optional[Union[Tuple[int, int], float]]): Width and height the images are resized to, or a
+                scale factor, applied by the decoding thread (see VideoReadBuffer)
+            interpolation (Optional[int]): OpenCV interpolation flag used by output_size
+            color_format (Optional[str]): "bgr", "rgb" or "gray" images
         """
 
         self.in_path = in_path
@@ -99,10 +446,30 @@ class Player:
         self.open_videos = {}
         self.metadata_file = None
         self.uses_indices = compute_indices
+        self.use_index_sidecar = use_index_sidecar
+        self.index_method = index_method
+        self.background_indexing = background_indexing
+        self.prefetch_frames = prefetch_frames
+        self.parallel_decode = parallel_decode
+        self.keyframe_seeking = keyframe_seeking
+        self.frame_cache_bytes = frame_cache_bytes
+        self.frame_cache = FrameCache(frame_cache_bytes) if frame_cache_bytes > 0 else None
+        self.lazy_images = lazy_images
+        self.output_size = output_size
+        self.interpolation = interpolation
+        self.color_format = color_format
         self._crt_frame_index = 0
-        self.indices = []
+        self.frame_index = None
+        self._index_builder = None
+        self._telemetry = None
+        self._decode_executor = None
+        # runs the Player for astream(), a single thread so packets are read in order
+        self._async_executor = None
+        # packets requested by astream() and not read yet, cancelled by close()
+        self._async_futures = set()
+        # process that opened the files, see _ensure_open()
+        self._pid = None
         self.start_datetime = None
-        self.end_datetime = None
 
     def start(self):
         """
@@ -110,39 +477,116 @@ class Player:
         Is called automatically by __enter__() if the Player is called within a Python "with" statement.
         """
 
-        self.metadata_file = open(os.path.join(self.in_path, "metadata.pkl"), "rb")
+        metadata_path = self.metadata_path
 
-        video_paths = pickle.load(self.metadata_file)
-
-        for pos in self.enabled_positions:
-            self.open_videos[pos] = VideoReadBuffer(os.path.join(self.in_path, video_paths[pos]))
+        self._open_files()
 
         if self.uses_indices:
             logging.info("Player now computing indices...")
 
-            while True:
-                self.indices.append(self.metadata_file.tell())
-                try:
-                    crt_frame = pickle.load(self.metadata_file)
-                except (EOFError, pickle.UnpicklingError):
-                    self.indices.pop()
-                    break
+            if self.background_indexing:
+                self.frame_index = FrameIndex.from_sidecar(metadata_path) if self.use_index_sidecar else None
 
-            self.metadata_file.seek(self.indices[-1], 0)
-            last_frame = pickle.load(self.metadata_file)
-            self.end_datetime = last_frame["datetime"]
+                if self.frame_index is None:
+                    self._index_builder = IndexBuilder(metadata_path, self.index_method, self.use_index_sidecar)
+                    self.frame_index = self._index_builder.index
+                    self._index_builder.start()
+                    self._index_builder.wait_for_length(1)
+            else:
+                self.frame_index = FrameIndex.build(metadata_path, self.use_index_sidecar, self.index_method)
+
+            if len(self.frame_index) > 0:
+                self.start_datetime = self.frame_index.datetime_at(0)
+
+            logging.info(f"Indices available for {len(self.indices)} frames!")
 
-            self.metadata_file.seek(self.indices[0], 0)
-            first_frame = pickle.load(self.metadata_file)
-            self.start_datetime = first_frame["datetime"]
+    def _open_files(self):
+        """Opens the metadata file and the videos for the current process, positioned at the current packet."""
 
-            self.metadata_file.seek(self.indices[0], 0)
+        self.metadata_file = open_metadata(self.metadata_path)
 
-            logging.info(f"Indices built for {len(self.indices)} frames!")
+        video_paths = self.metadata_file.video_paths
+
+        self.open_videos = {}
+        for pos in self.enabled_positions:
+            self.open_videos[pos] = VideoReadBuffer(os.path.join(self.in_path, video_paths[pos]), self.prefetch_frames,
+                                                   self.keyframe_seeking, output_size=self.output_size,
+                                                   interpolation=self.interpolation, color_format=self.color_format)
+
+        if self.parallel_decode and len(self.open_videos) > 1:
+            self._decode_executor = ThreadPoolExecutor(max_workers=len(self.open_videos),
+                                                       thread_name_prefix="PlayerDecode")
+
+        if self._crt_frame_index > 0 and self.frame_index is not None:
+            if self._crt_frame_index < len(self.indices):
+                self.metadata_file.seek(int(self.indices[self._crt_frame_index]), 0)
+            else:
+                self.metadata_file.seek(0, 2)
+
+        self._pid = os.getpid()
+
+    def _ensure_open(self):
+        """
+        Makes sure the files are open in the current process.
+        A Player that was never started is started, one inherited from a parent process (forked or unpickled)
+        reopens its files instead of sharing the parent's file offsets and decoders.
+        """
+
+        if self._pid == os.getpid():
+            return
+
+        if self.frame_index is None:
+            self.start()
+            return
+
+        # the parent's worker threads do not exist in this process
+        self._decode_executor = None
+
+        if self._index_builder is not None and not self._index_builder.complete:
+            self._index_builder = None
+            self.frame_index = FrameIndex.build(self.metadata_path, self.use_index_sidecar, self.index_method)
+
+        self._open_files()
+
+    def __getstate__(self):
+        """The Player is pickled without its open files, which are reopened lazily by the receiving process."""
+
+        # workers have to share the indices instead of each rebuilding them
+        self.wait_for_index()
+
+        state = self.__dict__.copy()
+        state["metadata_file"] = None
+        state["open_videos"] = {}
+        state["_decode_executor"] = None
+        state["_async_executor"] = None
+        state["_async_futures"] = set()
+        state["_index_builder"] = None
+        state["_telemetry"] = None
+        state["_pid"] = None
+
+        if self.frame_cache is not None:
+            state["frame_cache"] = FrameCache(self.frame_cache_bytes)
+
+        return state
 
     def close(self):
         """Closes video and metadata files and cleans all used resources."""
-        self.metadata_file.close()
+        if self._async_executor is not None:
+            # packets read ahead by astream() are cancelled, the one being read finishes before the files close
+            for future in list(self._async_futures):
+                future.cancel()
+            self._async_executor.shutdown(wait=True)
+            self._async_executor = None
+
+        if self._index_builder is not None:
+            self._index_builder.stop()
+
+        if self._decode_executor is not None:
+            self._decode_executor.shutdown()
+            self._decode_executor = None
+
+        if self.metadata_file is not None:
+            self.metadata_file.close()
 
         for video_reader in self.open_videos.values():
             video_reader.close()
@@ -156,12 +600,90 @@ class Player:
         """This allows the Player to be (optionally) used in Python 'with' statements"""
         self.close()
 
+    async def __aenter__(self):
+        """This allows the Player to be used in 'async with' statements, start() runs without blocking the loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """This allows the Player to be used in 'async with' statements"""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    @property
+    def metadata_path(self) -> str:
+        """metadata.nrec if the session was converted to the framed format (see records), otherwise metadata.pkl"""
+        return session_metadata_path(self.in_path)
+
+    @property
+    def indices(self) -> np.ndarray:
+        """Byte offsets of the packets in metadata.pkl, empty until start() has computed them."""
+        if self.frame_index is None:
+            return np.empty(0, dtype=np.int64)
+        return self.frame_index.offsets
+
+    @property
+    def index_complete(self) -> bool:
+        """True once the indices cover the whole recording (always the case without background_indexing)"""
+        return self._index_builder is None or self._index_builder.complete
+
+    def wait_for_index(self):
+        """Blocks until the indices cover the whole recording."""
+        if self._index_builder is not None:
+            self._index_builder.wait_for_length()
+
+    @property
+    def end_datetime(self) -> Optional[datetime.datetime]:
+        """Datetime of the last packet, or of the last one indexed so far while indexing in the background"""
+        if self.frame_index is None or len(self.frame_index) == 0:
+            return None
+        return self.frame_index.datetime_at(len(self.frame_index) - 1)
+
     def __len__(self):
         if self.uses_indices:
             return len(self.indices)
         else:
             raise Exception("Cannot use len() on player that has no frame indices")
 
+    def __getitem__(self, item: Union[int, slice]) -> Union[dict, list]:
+        """
+        Random access to the packets of the recording, without moving the get_next_packet() cursor.
+        The Player opens its files on first use in each process, so it can be handed to forked or spawned workers
+        (e.g. as a map-style dataset) which then read the recording in parallel.
+
+        Args:
+            item (Union[int, slice]): Frame index of the packet, negative values count from the end
+
+        Returns:
+            Union[dict, list]: The packet as returned by get_next_packet(), or a list of packets for a slice
+        """
+
+        self._ensure_open()
+
+        if not self.uses_indices:
+            raise Exception("Cannot index a player that has no frame indices")
+
+        if isinstance(item, slice):
+            self.wait_for_index()
+            return [self[i] for i in range(*item.indices(len(self)))]
+
+        packet_small = self.metadata_file.read_packet_at(int(self.indices[self._resolve_index(item)]))
+
+        return self._load_images(packet_small)
+
+    def _resolve_index(self, item: int) -> int:
+        """Turns a frame index that may count from the end into a position in the index, waiting until it is indexed"""
+
+        if item < 0:
+            self.wait_for_index()
+            item += len(self)
+        elif item >= len(self) and self._index_builder is not None:
+            self._index_builder.wait_for_length(item + 1)
+
+        if not 0 <= item < len(self):
+            raise IndexError(f"Frame index {item} out of range for a recording of {len(self)} packets")
+
+        return item
+
     @property
     def crt_frame_index(self):
         return self._crt_frame_index
@@ -171,69 +693,208 @@ class Player:
 
         if self.uses_indices:
 
+            if value >= len(self.indices) and self._index_builder is not None:
+                self._index_builder.wait_for_length(value + 1)
+
             if not 0 <= value < len(self.indices):
                 raise Exception(f"Out of range seek to frame index {value} in a {len(self.indices)} frame video")
 
             self._crt_frame_index = value
 
-            self.metadata_file.seek(self.indices[value], 0)
+            self.metadata_file.seek(int(self.indices[value]), 0)
 
-            # TODO these will cause a little lag on video restart as they are set automatically to the correct values
-            # TODO could maybe explore a few frames in this region and set the correct frame indices from here
-            # for pos in self.enabled_positions:
-            #     self.open_videos[pos].set_frame(value)
+            # packets missing an image or with a cached image leave their video to be resynced by the next frame
+            # that has to be decoded
+            for pos in self.enabled_positions:
+                frame_number = self.frame_index.frame_number(value, pos)
+                if frame_number is None or pos not in self.open_videos:
+                    continue
+                if self.frame_cache is not None and (pos, frame_number) in self.frame_cache:
+                    continue
+                self.open_videos[pos].set_frame(frame_number)
 
         else:
             raise Exception("Cannot use len() on player that has no frame indices")
 
-    def get_next_packet(self) -> Optional[Union[dict, None]]:
+    def frame_at(self, target_datetime: datetime.datetime) -> int:
         """
-        Return the next packet in the recording.
-        Recording will advance to the next packet after get_next_packet() is called.
+        Finds the packet that was current at a given time, using a binary search over the packet datetimes.
 
+        Args:
+            target_datetime (datetime.datetime): Moment in the recording
 
         Returns:
-            Optional[Union[dict, None]]: Read data packet. If recording has finished returns None.
+            int: Index of the last packet recorded at or before target_datetime,
+                0 if target_datetime comes before the recording
         """
 
-        try:
-            packet_small = pickle.load(self.metadata_file)
+        if not self.uses_indices:
+            raise Exception("Cannot search by datetime on player that has no frame indices")
+
+        timestamp = datetime_to_us(target_datetime)
+
+        if self._index_builder is not None:
+            # the answer is final once a later packet (or the end of the file) has been indexed
+            self._index_builder.wait_for_timestamp(timestamp + 1)
+
+        position = int(np.searchsorted(self.frame_index.timestamps, timestamp, side="right")) - 1
+
+        return max(position, 0)
+
+    def seek_datetime(self, target_datetime: datetime.datetime):
+        """
+        Moves the playback to the packet that was current at a given time, see frame_at().
+
+        Args:
+            target_datetime (datetime.datetime): Moment in the recording
+        """
+
+        self.crt_frame_index = self.frame_at(target_datetime)
+
+    def telemetry(self) -> Telemetry:
+        """
+        Sensor channels (canbus, imu, gps) of the whole recording as NumPy columns, one row per packet.
+        They are extracted on the first call and cached next to metadata.pkl, later calls memory map the cache.
+        Doesn't require start() to be called and doesn't move the playback position.
+
+        Returns:
+            Telemetry: Columns by channel name (see telemetry.CHANNELS) and their timestamps
+        """
+
+        if self._telemetry is None:
+            self._telemetry = Telemetry.build(self.metadata_path, self.use_index_sidecar)
+
+        return self._telemetry
+
+    def _read_image(self, pos: str, img_num: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Decodes one camera image, moving the video to the right frame first if needed.
+        Cached frames are returned without touching the video, which resyncs on the next frame that is decoded.
+
+        Args:
+            pos (str): Camera name
+            img_num (int): Frame number in the camera's video
+            out (Optional[np.ndarray]): Preallocated array the image is decoded into, see VideoReadBuffer.read_frame()
+
+        Returns:
+            np.ndarray: Frame as OpenCV format image
+        """
+
+        if self.frame_cache is not None:
+            frame = self.frame_cache.get((pos, img_num))
+            if frame is not None:
+                if out is not None:
+                    np.copyto(out, frame)
+                    frame = out
+                return frame
+
+        video = self.open_videos[pos]
+
+        if not img_num == video.get_crt_frame_number():
+            logging.debug("Frame index differs from video index! Attempting automatic resync!")
+            video.set_frame(img_num)
+
+        frame = video.read_frame(out)
+
+        if self.frame_cache is not None:
+            self.frame_cache.put((pos, img_num), frame)
+
+        return frame
+
+    def _read_metadata_packet(self) -> Optional[dict]:
+        """
+        Reads the next packet without its images, "images" holds the frame number of each camera image.
+        The recording advances to the next packet, the videos are left untouched.
+
+        Returns:
+            Optional[dict]: Packet as stored in metadata.pkl. If recording has finished returns None.
+        """
+
+        packet_small = self.metadata_file.read_packet()
+
+        if packet_small is not None:
             self._crt_frame_index += 1
-        except (EOFError, pickle.UnpicklingError):
-            return None
 
-        if "images" in packet_small:
-            # a packet with images, get them from the videos
+        return packet_small
 
-            packet_big = deepcopy(packet_small)
+    def _load_images(self, packet_small: dict) -> dict:
+        """
+        Replaces the frame numbers of a packet read by _read_metadata_packet() with the decoded images.
+
+        Args:
+            packet_small (dict): Packet as stored in metadata.pkl, it is not modified
+
+        Returns:
+            dict: The packet with images, as returned by get_next_packet()
+        """
+
+        if "images" not in packet_small:
+            return packet_small
 
-            for pos, img_num in packet_small["images"].items():
+        # a packet with images, get them from the videos
 
-                if img_num is None:
-                    packet_big["images"][pos] = None
-                else:
-                    if not img_num == self.open_videos[pos].get_crt_frame_number():
-                        logging.debug("Frame index differs from video index! Attempting automatic resync!")
-                        self.open_videos[pos].set_frame(img_num)
+        # the packet was just unpickled, so only the images dict has to be copied to be modified
+        packet_big = dict(packet_small)
+        packet_big["images"] = dict(packet_small["images"])
+
+        # cameras that are not enabled have no video to read from
+        to_read = {}
+        for pos, img_num in packet_small["images"].items():
+            if img_num is None or pos not in self.open_videos:
+                packet_big["images"][pos] = None
+            else:
+                to_read[pos] = img_num
 
-                    img = self.open_videos[pos].read_frame()
-                    packet_big["images"][pos] = img
+        if self.lazy_images:
+            frame_numbers = {pos: to_read.get(pos) for pos in packet_big["images"]}
+            packet_big["images"] = LazyImages(self, frame_numbers)
+        elif self._decode_executor is not None and len(to_read) > 1:
+            pending = {pos: self._decode_executor.submit(self._read_image, pos, img_num)
+                       for pos, img_num in to_read.items()}
 
-            return packet_big
+            for pos, future in pending.items():
+                packet_big["images"][pos] = future.result()
         else:
-            return packet_small
+            for pos, img_num in to_read.items():
+                packet_big["images"][pos] = self._read_image(pos, img_num)
+
+        return packet_big
+
+    def get_next_packet(self) -> Optional[Union[dict, None]]:
+        """
+        Return the next packet in the recording.
+        Recording will advance to the next packet after get_next_packet() is called.
+
+
+        Returns:
+            Optional[Union[dict, None]]: Read data packet. If recording has finished returns None.
+        """
+
+        packet_small = self._next_packet_metadata()
+
+        if packet_small is None:
+            return None
+
+        return self._load_images(packet_small)
+
+    def _next_packet_metadata(self) -> Optional[dict]:
+        """
+        The packet get_next_packet() returns next, before its images are loaded (see _load_images()).
+
+        Returns:
+            Optional[dict]: Packet as stored in metadata.pkl. If recording has finished returns None.
+        """
+        return self._read_metadata_packet()
 
     def rewind(self):
         """Rewinds the dataset, the next packet returned by the stream will be the first packet in the dataset"""
 
         self._crt_frame_index = 0
 
-        self.metadata_file.seek(0, 0)
-
-        video_paths = pickle.load(self.metadata_file)
+        self.metadata_file.rewind()
 
         for pos in self.enabled_positions:
-            self.open_videos[pos].set_frame(0)
+            self.open_videos[pos].rewind()
 
     def stream_generator(self, loop: Optional[bool] = False) -> Iterator[dict]:
         """
@@ -257,6 +918,157 @@ class Player:
             else:
                 break
 
+    async def astream(self, max_in_flight: Optional[int] = 4) -> AsyncIterator[dict]:
+        """
+        Async version of stream_generator(). Packets are read and their images decoded on a thread of the Player,
+        so the event loop is never blocked and many Players can be driven by the same loop.
+        Packets after the last one consumed may already have been read, a stream left early doesn't resume from
+        the last packet it yielded. close() cancels the packets read ahead and ends the stream.
+
+        Args:
+            max_in_flight (Optional[int]): Packets requested ahead of the consumer
+
+        Returns:
+            AsyncIterator[dict]: Async generator providing played back packets
+        """
+
+        loop = asyncio.get_running_loop()
+
+        if self._async_executor is None:
+            self._async_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PlayerAsync")
+        executor = self._async_executor
+
+        pending = deque()
+
+        def request():
+            try:
+                future = executor.submit(self.get_next_packet)
+            except RuntimeError:
+                # the Player was closed
+                return
+
+            self._async_futures.add(future)
+            future.add_done_callback(self._async_futures.discard)
+            pending.append(asyncio.wrap_future(future, loop=loop))
+
+        for _ in range(max(max_in_flight, 1)):
+            request()
+
+        try:
+            while pending:
+                try:
+                    packet = await pending.popleft()
+                except asyncio.CancelledError:
+                    if executor is self._async_executor:
+                        raise
+                    # cancelled by close()
+                    return
+
+                if packet is None:
+                    return
+
+                request()
+                yield packet
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def __aiter__(self):
+        """Allows 'async for packet in player', see astream()"""
+        return self.astream()
+
+    def stream_batches(self,
+                       batch_size: int,
+                       fields: Optional[Tuple[str]] = None,
+                       reuse_buffers: Optional[bool] = True
+                       ) -> Iterator[dict]:
+        """
+        Plays back the recording in batches of stacked arrays instead of one packet at a time.
+        Images are decoded straight into preallocated (N, H, W, 3) arrays and telemetry is written into float64
+        arrays of length N (NaN where a packet holds no data, see telemetry.CHANNELS).
+
+        Args:
+            batch_size (int): Number of packets N in each batch, the last batch may be shorter
+            fields (Optional[Tuple[str]]): Camera names and telemetry channels to be included,
+                all the enabled cameras and all the channels if None
+            reuse_buffers (Optional[bool]): If true every batch is written into the same arrays, so a batch is only
+                valid until the next one is requested
+
+        Returns:
+            Iterator[dict]: Generator providing batches with the keys
+                "frame_index" (int64 frame index of each packet), "datetime" (int64, see index.datetime_to_us()),
+                "images" and "valid" (camera name to images and to a bool mask of the packets that have an image),
+                "telemetry" (channel name to values)
+        """
+
+        if fields is None:
+            fields = tuple(self.open_videos) + tuple(CHANNELS)
+
+        positions = [field for field in fields if field in self.open_videos]
+        channels = [field for field in fields if field in CHANNELS]
+
+        unknown = set(fields) - set(positions) - set(channels)
+        if unknown:
+            raise Exception(f"Unknown batch fields {sorted(unknown)}, expected enabled cameras or telemetry channels")
+
+        def allocate():
+            return {
+                "frame_index": np.empty(batch_size, dtype=np.int64),
+                "datetime": np.empty(batch_size, dtype=np.int64),
+                "images": {pos: np.empty((batch_size,) + self.open_videos[pos].frame_shape, dtype=np.uint8)
+                           for pos in positions},
+                "valid": {pos: np.empty(batch_size, dtype=bool) for pos in positions},
+                "telemetry": {channel: np.empty(batch_size, dtype=np.float64) for channel in channels}
+            }
+
+        def trimmed(batch, size):
+            return {
+                "frame_index": batch["frame_index"][:size],
+                "datetime": batch["datetime"][:size],
+                "images": {pos: images[:size] for pos, images in batch["images"].items()},
+                "valid": {pos: valid[:size] for pos, valid in batch["valid"].items()},
+                "telemetry": {channel: values[:size] for channel, values in batch["telemetry"].items()}
+            }
+
+        batch = allocate()
+        size = 0
+
+        while True:
+            packet = self._next_packet_metadata()
+
+            if packet is None:
+                break
+
+            # the last packet read, for a VariableSampleRatePlayer the one the merged packet is output for
+            batch["frame_index"][size] = self.crt_frame_index - 1
+            batch["datetime"][size] = datetime_to_us(packet["datetime"])
+
+            frame_numbers = packet.get("images", {})
+            for pos in positions:
+                img_num = frame_numbers.get(pos)
+                out = batch["images"][pos][size]
+
+                frame = None if img_num is None else self._read_image(pos, img_num, out)
+                batch["valid"][pos][size] = frame is not None
+                if frame is None:
+                    out.fill(0)
+
+            sensor_data = packet.get("sensor_data")
+            for channel in channels:
+                batch["telemetry"][channel][size] = channel_value(sensor_data, CHANNELS[channel])
+
+            size += 1
+
+            if size == batch_size:
+                yield trimmed(batch, size)
+
+                if not reuse_buffers:
+                    batch = allocate()
+                size = 0
+
+        if size > 0:
+            yield trimmed(batch, size)
+
 
 class VariableSampleRatePlayer(Player):
 
@@ -264,7 +1076,18 @@ class VariableSampleRatePlayer(Player):
                  in_path: Optional[str] = "./test_recording/",
                  min_packet_delay_ms: Optional[int] = 300,
                  compute_indices: Optional[bool] = True,
-                 enabled_positions: Optional[Tuple[str]] = ("center", "left", "right")
+                 enabled_positions: Optional[Tuple[str]] = ("center", "left", "right"),
+                 use_index_sidecar: Optional[bool] = True,
+                 index_method: Optional[str] = "scan",
+                 background_indexing: Optional[bool] = False,
+                 prefetch_frames: Optional[int] = 0,
+                 parallel_decode: Optional[bool] = False,
+                 keyframe_seeking: Optional[bool] = True,
+                 frame_cache_bytes: Optional[int] = 0,
+                 lazy_images: Optional[bool] = False,
+                 output_size: Optional[Union[Tuple[int, int], float]] = None,
+                 interpolation: Optional[int] = cv2.INTER_LINEAR,
+                 color_format: Optional[str] = "bgr"
                  ):
         """
         Instantiates the Player with the details of the dataset that will be played back.
@@ -280,12 +1103,33 @@ class VariableSampleRatePlayer(Player):
             min_packet_delay_ms (Optional[int]): skips packets until their time difference is bigger than this value
             compute_indices (Optional[bool]): If true seeking options for the dataset will be enabled
             enabled_positions (Optional[Tuple[str]]): Names of the cameras to be used (e.g. ("center", "left"))
+            use_index_sidecar (Optional[bool]): If true the indices are cached in a file next to metadata.pkl
+            index_method (Optional[str]): "scan" or "unpickle", see Player
+            background_indexing (Optional[bool]): If true the indices are built while streaming, see Player
+            prefetch_frames (Optional[int]): Frames each camera decodes ahead, see Player
+            parallel_decode (Optional[bool]): Decode the cameras of a packet concurrently, see Player
+            keyframe_seeking (Optional[bool]): See Player
+            frame_cache_bytes (Optional[int]): See Player
+            lazy_images (Optional[bool]): See Player
+            output_size (Optional[Union[Tuple[int, int], float]]): See Player
+            interpolation (Optional[int]): See Player
+            color_format (Optional[str]): See Player
         """
 
-        super(VariableSampleRatePlayer, self).__init__(in_path, compute_indices, enabled_positions)
+        super(VariableSampleRatePlayer, self).__init__(in_path, compute_indices, enabled_positions, use_index_sidecar,
+                                                       index_method, background_indexing,
+                                                       prefetch_frames=prefetch_frames,
+                                                       parallel_decode=parallel_decode,
+                                                       keyframe_seeking=keyframe_seeking,
+                                                       frame_cache_bytes=frame_cache_bytes,
+                                                       lazy_images=lazy_images,
+                                                       output_size=output_size,
+                                                       interpolation=interpolation,
+                                                       color_format=color_format)
 
         self.min_packet_delay_ms = min_packet_delay_ms
-        self._decompressor = JITDecompressor()
+        # the packets merged are freshly unpickled and handed out only once merged, so values are shared, not copied
+        self._decompressor = JITDecompressor(share_values=True)
 
     @property
     def crt_frame_index(self):
@@ -296,44 +1140,124 @@ class VariableSampleRatePlayer(Player):
         Player.crt_frame_index.fset(self, value)
         self._decompressor.rewind()
 
-    def get_next_packet(self) -> Optional[Union[dict, None]]:
+    def _next_packet_metadata(self) -> Optional[dict]:
         """
-        Return the next packet in the recording.
-        Recording will advance to the next packet after get_next_packet() is called.
-
+        Merges the packets up to the next one that is at least min_packet_delay_ms after the first, without loading
+        any images.
 
         Returns:
-            Optional[Union[dict, None]]: Read data packet. If recording has finished returns None.
+            Optional[dict]: The merged packet, with the frame numbers of its images. If recording has finished
+                returns None.
         """
 
-        initial_packet = super(VariableSampleRatePlayer, self).get_next_packet()
+        initial_index = self.crt_frame_index
+        initial_packet = self._read_metadata_packet()
 
         if initial_packet is None:
             self._decompressor.rewind()
             return None
-        else:
 
-            next_packet = super(VariableSampleRatePlayer, self).get_next_packet()
+        # packets in between are merged without decoding their images, the merged frame numbers of each camera
+        # point to the last image recorded up to the output packet, which is the only one decoded
+        merged_packet = self._decompressor.decompress_next_packet(initial_packet)
+        output_index = self._output_frame_index(initial_index)
+
+        while True:
+            if output_index is not None and self.crt_frame_index > output_index:
+                break
+
+            next_packet = self._read_metadata_packet()
 
             if next_packet is None:
-                self._decompressor.rewind()
-                return initial_packet
+                break
 
-            self._decompressor.decompress_next_packet(initial_packet)
+            merged_packet = self._decompressor.decompress_next_packet(next_packet)
 
-            d_next_packet = self._decompressor.decompress_next_packet(next_packet)
+            time_diff = merged_packet["datetime"] - initial_packet["datetime"]
 
-            time_diff = d_next_packet["datetime"] - initial_packet["datetime"]
+            if output_index is None and time_diff.total_seconds() * 1000 >= self.min_packet_delay_ms:
+                break
 
-            while time_diff.total_seconds() * 1000 < self.min_packet_delay_ms:
+        self._decompressor.rewind()
+        return merged_packet
 
-                next_packet = super(VariableSampleRatePlayer, self).get_next_packet()
-                d_next_packet = self._decompressor.decompress_next_packet(next_packet)
+    def _output_frame_index(self, initial_index: int) -> Optional[int]:
+        """
+        Finds the packet that is output after the one at initial_index, using a binary search over the packet datetimes.
 
-                time_diff = d_next_packet["datetime"] - initial_packet["datetime"]
+        Args:
+            initial_index (int): Frame index of the first packet merged into the output packet
 
-            self._decompressor.rewind()
-            return d_next_packet
+        Returns:
+            Optional[int]: Frame index of the first packet at least min_packet_delay_ms after the initial one,
+                None if the index doesn't reach it yet and the datetimes have to be compared while reading
+        """
+
+        if not self.uses_indices or self.frame_index is None:
+            return None
+
+        timestamps = self.frame_index.timestamps
+        if initial_index >= len(timestamps):
+            return None
+
+        target = timestamps[initial_index] + int(self.min_packet_delay_ms * 1000)
+        output_index = max(int(np.searchsorted(timestamps, target, side="left")), initial_index + 1)
+
+        if output_index >= len(timestamps) and not self.index_complete:
+            return None
+
+        return output_index
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[dict, list]:
+        """
+        Random access to the merged packets, without moving the get_next_packet() cursor.
+        Frame indices are those of the recording, as for crt_frame_index: the packet at a frame index is merged with
+        the ones that follow it, as get_next_packet() returns it after seeking to that frame index.
+
+        Args:
+            item (Union[int, slice]): Frame index of the first packet merged, negative values count from the end.
+                A slice gives the packets get_next_packet() returns from its start up to its stop, it can't have a step.
+
+        Returns:
+            Union[dict, list]: The merged packet, or a list of merged packets for a slice
+        """
+
+        self._ensure_open()
+
+        if not self.uses_indices:
+            raise Exception("Cannot index a player that has no frame indices")
+
+        # merging needs the datetimes of the packets that follow the first one
+        self.wait_for_index()
+
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                raise Exception("Cannot slice a VariableSampleRatePlayer with a step, its packets are merged")
+
+            packets = []
+            while start < stop:
+                packet_small, start = self._merged_packet_at(start)
+                packets.append(self._load_images(packet_small))
+            return packets
+
+        return self._load_images(self._merged_packet_at(self._resolve_index(item))[0])
+
+    def _merged_packet_at(self, frame_index: int) -> Tuple[dict, int]:
+        """
+        Merges the packets from frame_index on like _next_packet_metadata(), reading them by offset.
+
+        Returns:
+            Tuple[dict, int]: The merged packet, without its images, and the frame index of the next packet streamed
+        """
+
+        decompressor = JITDecompressor(share_values=True)
+        last_index = min(self._output_frame_index(frame_index), len(self) - 1)
+
+        for i in range(frame_index, last_index + 1):
+            merged_packet = decompressor.decompress_next_packet(self.metadata_file.read_packet_at(int(self.indices[i])))
+
+        return merged_packet, last_index + 1
 
     def rewind(self):
         """Rewinds the dataset, the next packet returned by the stream will be the first packet in the dataset"""
@@ -0,0 +1,372 @@
+from collections import namedtuple
+from typing import List, Optional, Union
+
+import numpy as np
+
+from .index import us_to_datetime
+from .resampling import hold
+from .telemetry import Telemetry
+
+
+# aggregations supported by Signal.rolling()
+AGGREGATIONS = ("mean", "sum", "count", "min", "max")
+
+
+class Segment(namedtuple("Segment", ["start", "end", "start_datetime", "end_datetime"])):
+    """
+    A run of consecutive rows where a Mask holds, start and end are both included.
+    For the telemetry of a Player the rows are frame indices, so segments can be passed to the Player directly:
+    p.crt_frame_index = segment.start or p[segment.slice].
+    """
+
+    __slots__ = ()
+
+    @property
+    def slice(self) -> slice:
+        return slice(self.start, self.end + 1)
+
+    @property
+    def duration(self):
+        return self.end_datetime - self.start_datetime
+
+
+def _runs(values: np.ndarray) -> np.ndarray:
+    """(start, end) rows of the runs of true values, end included"""
+
+    edges = np.diff(np.concatenate(([0], values.astype(np.int8), [0])))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1], axis=1)
+
+
+def _fill(length: int, runs: np.ndarray) -> np.ndarray:
+    """Inverse of _runs(), true on the rows of the given runs"""
+
+    edges = np.zeros(length + 1, dtype=np.int64)
+    np.add.at(edges, runs[:, 0], 1)
+    np.add.at(edges, runs[:, 1] + 1, -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def _range_reduce(values: np.ndarray, starts: np.ndarray, ends: np.ndarray, ufunc: np.ufunc) -> np.ndarray:
+    """
+    Reduces values[starts[i]:ends[i] + 1] for every i with a sparse table, O(n log n) for all the ranges.
+    ufunc must be idempotent (np.fmin, np.fmax), overlapping halves are combined.
+    """
+
+    table = [values]
+    width = 1
+    while 2 * width <= len(values):
+        previous = table[-1]
+        table.append(ufunc(previous[:-width], previous[width:]))
+        width *= 2
+
+    lengths = ends - starts + 1
+    levels = np.floor(np.log2(np.maximum(lengths, 1))).astype(np.int64)
+
+    out = np.full(len(starts), np.nan)
+    for level in np.unique(levels):
+        rows = np.flatnonzero(levels == level)
+        level_values = table[level]
+        out[rows] = ufunc(level_values[starts[rows]], level_values[ends[rows] - (1 << level) + 1])
+
+    return out
+
+
+class Mask:
+    """Rows of the telemetry where a condition holds, combined with &, | and ~."""
+
+    # NumPy arrays defer to the operators below instead of broadcasting over the Mask as an object
+    __array_ufunc__ = None
+
+    def __init__(self, query: "Query", values: np.ndarray):
+        self.query = query
+        self.values = np.asarray(values, dtype=bool)
+
+    def _other(self, other: Union["Mask", np.ndarray, bool]) -> np.ndarray:
+        return other.values if isinstance(other, Mask) else np.asarray(other, dtype=bool)
+
+    def __and__(self, other):
+        return Mask(self.query, self.values & self._other(other))
+
+    def __or__(self, other):
+        return Mask(self.query, self.values | self._other(other))
+
+    def __xor__(self, other):
+        return Mask(self.query, self.values ^ self._other(other))
+
+    def __invert__(self):
+        return Mask(self.query, ~self.values)
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __len__(self):
+        return len(self.values)
+
+    def any(self) -> bool:
+        return bool(self.values.any())
+
+    def fill_gaps(self, max_gap_ms: float) -> "Mask":
+        """
+        Joins runs separated by short interruptions, e.g. a flickering turn signal.
+
+        Args:
+            max_gap_ms (float): Longest interruption filled in, from the last row of a run to the first of the next
+
+        Returns:
+            Mask: The joined runs
+        """
+
+        timestamps = self.query.timestamps
+
+        # only the interruptions between two runs, not those at the start or end of the recording
+        gaps = _runs(~self.values)
+        gaps = gaps[(gaps[:, 0] > 0) & (gaps[:, 1] < len(self.values) - 1)]
+
+        duration = timestamps[gaps[:, 1] + 1] - timestamps[gaps[:, 0] - 1]
+        return Mask(self.query, self.values | _fill(len(self.values), gaps[duration <= max_gap_ms * 1000]))
+
+    def for_at_least(self, duration_ms: float) -> "Mask":
+        """
+        Keeps only the runs that last long enough, e.g. stops rather than slowing down.
+
+        Args:
+            duration_ms (float): Shortest run kept, from the timestamp of its first row to that of its last
+
+        Returns:
+            Mask: The long runs
+        """
+
+        timestamps = self.query.timestamps
+
+        runs = _runs(self.values)
+        duration = timestamps[runs[:, 1]] - timestamps[runs[:, 0]]
+        return Mask(self.query, _fill(len(self.values), runs[duration >= duration_ms * 1000]))
+
+    def segments(self) -> List[Segment]:
+        """
+        Returns:
+            List[Segment]: The runs of rows where the mask holds, in order
+        """
+
+        timestamps = self.query.timestamps
+        aware = self.query.aware
+
+        return [Segment(int(start), int(end), us_to_datetime(timestamps[start], aware),
+                        us_to_datetime(timestamps[end], aware))
+                for start, end in _runs(self.values)]
+
+
+class Signal:
+    """
+    A telemetry channel, or a value computed from channels, with one float64 value per row (NaN for no data).
+    Comparisons give Masks, which are false where either side is NaN.
+    """
+
+    # NumPy arrays defer to the operators below instead of broadcasting over the Signal as an object
+    __array_ufunc__ = None
+
+    def __init__(self, query: "Query", values: np.ndarray):
+        self.query = query
+        self.values = np.asarray(values, dtype=np.float64)
+
+    def _other(self, other: Union["Signal", np.ndarray, float]) -> np.ndarray:
+        return other.values if isinstance(other, Signal) else other
+
+    def __len__(self):
+        return len(self.values)
+
+    def _compare(self, other, operator) -> Mask:
+        with np.errstate(invalid="ignore"):
+            return Mask(self.query, operator(self.values, self._other(other)))
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+    def __eq__(self, other):
+        return self._compare(other, np.equal)
+
+    def __ne__(self, other):
+        # NaN has no data, it is neither equal nor different
+        mask = self._compare(other, np.not_equal) & self.valid()
+        return mask & other.valid() if isinstance(other, Signal) else mask
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return Signal(self.query, self.values + self._other(other))
+
+    def __sub__(self, other):
+        return Signal(self.query, self.values - self._other(other))
+
+    def __mul__(self, other):
+        return Signal(self.query, self.values * self._other(other))
+
+    def __truediv__(self, other):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return Signal(self.query, self.values / self._other(other))
+
+    def __neg__(self):
+        return Signal(self.query, -self.values)
+
+    def __abs__(self):
+        return Signal(self.query, np.abs(self.values))
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __rsub__(self, other):
+        return Signal(self.query, self._other(other) - self.values)
+
+    def __rtruediv__(self, other):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return Signal(self.query, self._other(other) / self.values)
+
+    def valid(self) -> Mask:
+        """Rows where the signal has data"""
+        return Mask(self.query, ~np.isnan(self.values))
+
+    def hold(self, max_age_ms: float) -> "Signal":
+        """
+        Carries each value forward over the following rows without data, so channels recorded in different packets
+        can be compared row by row, e.g. q["canbus_speed"].hold(500) > 50.
+
+        Args:
+            max_age_ms (float): Longest time a value is carried forward, from the row it was recorded on
+
+        Returns:
+            Signal: The held values, NaN before the first value and on rows older than max_age_ms
+        """
+
+        timestamps = self.query.timestamps
+        max_age_us = int(max_age_ms * 1000)
+        out = hold(timestamps, self.values, timestamps, max_age_us)
+
+        # hold() doesn't extrapolate past the last value, the rows after it are held as well
+        rows = np.flatnonzero(~np.isnan(self.values))
+        if len(rows):
+            last = rows[-1]
+            tail = np.arange(last + 1, len(self.values))
+            tail = tail[timestamps[tail] - timestamps[last] <= max_age_us]
+            out[tail] = self.values[last]
+
+        return Signal(self.query, out)
+
+    def between(self, low: float, high: float) -> Mask:
+        """Rows where low <= value <= high"""
+        return (self >= low) & (self <= high)
+
+    def rolling(self, window_ms: float, aggregation: Optional[str] = "mean") -> "Signal":
+        """
+        Aggregates the values of a trailing time window ending at each row, NaN values are ignored.
+
+        Args:
+            window_ms (float): Length of the window, rows with timestamps in [t - window_ms, t] are aggregated
+            aggregation (Optional[str]): One of AGGREGATIONS
+
+        Returns:
+            Signal: The aggregated values, NaN for windows without data ("count" and "sum" give 0 instead)
+        """
+
+        if aggregation not in AGGREGATIONS:
+            raise Exception(f"Unknown aggregation {aggregation}, expected one of {AGGREGATIONS}")
+
+        if len(self.values) == 0:
+            return Signal(self.query, self.values)
+
+        timestamps = self.query.timestamps
+        ends = np.arange(len(self.values))
+        starts = np.searchsorted(timestamps, timestamps - int(window_ms * 1000), side="left")
+
+        if aggregation in ("min", "max"):
+            ufunc = np.fmin if aggregation == "min" else np.fmax
+            return Signal(self.query, _range_reduce(self.values, starts, ends, ufunc))
+
+        valid = ~np.isnan(self.values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, self.values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+
+        window_sums = sums[ends + 1] - sums[starts]
+        window_counts = counts[ends + 1] - counts[starts]
+
+        if aggregation == "sum":
+            return Signal(self.query, window_sums)
+        if aggregation == "count":
+            return Signal(self.query, window_counts.astype(np.float64))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return Signal(self.query, np.where(window_counts > 0, window_sums / window_counts, np.nan))
+
+    def derivative(self) -> "Signal":
+        """
+        Rate of change per second, from each value to the previous one with data (e.g. acceleration from speed).
+
+        Returns:
+            Signal: The derivative, NaN on rows without data and on the first row with data
+        """
+
+        timestamps = self.query.timestamps
+        rows = np.flatnonzero(~np.isnan(self.values))
+        out = np.full(len(self.values), np.nan)
+
+        if len(rows) > 1:
+            dt = np.diff(timestamps[rows]) / 1e6
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out[rows[1:]] = np.where(dt > 0, np.diff(self.values[rows]) / dt, np.nan)
+
+        return Signal(self.query, out)
+
+
+class Query:
+    """
+    Vectorized queries over the telemetry of a recording, without playing it back.
+
+    Example:
+        q = Query.from_player(player)
+        braking = (q["canbus_speed"].derivative() < -3).segments()
+        turning_fast = (q["canbus_speed"].hold(500) > 50) & (q["canbus_signal"].hold(500) != 0)
+        turning_fast = turning_fast.fill_gaps(1000).segments()
+    """
+
+    def __init__(self, telemetry: Telemetry):
+        """
+        Args:
+            telemetry (Telemetry): Columns of the recording (see Player.telemetry()), or resampled ones
+                (see resampling.resample_telemetry()), whose rows are then grid points rather than frame indices
+        """
+
+        self.telemetry = telemetry
+        self.timestamps = np.asarray(telemetry.timestamps)
+        self.aware = telemetry.aware
+
+    @classmethod
+    def from_player(cls, player) -> "Query":
+        """
+        Args:
+            player (Player): Player of the recording, doesn't need to be started
+
+        Returns:
+            Query: Query over Player.telemetry()
+        """
+        return cls(player.telemetry())
+
+    def __getitem__(self, channel: str) -> Signal:
+        if channel not in self.telemetry:
+            raise Exception(f"Unknown channel {channel}, expected one of {list(self.telemetry.keys())}")
+        return Signal(self, self.telemetry[channel])
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def signal(self, values: np.ndarray) -> Signal:
+        """Wraps values computed elsewhere, one per row, so they can be combined with the channels."""
+        return Signal(self, values)
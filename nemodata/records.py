@@ -0,0 +1,515 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional, Tuple
+import datetime
+import json
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+import logging
+
+from .index import datetime_to_us, us_to_datetime, packet_frame_numbers, iter_records
+from .sidecar import source_signature
+
+
+# metadata files of a session, in order of preference
+METADATA_FILES = ("metadata.nrec", "metadata.pkl")
+
+MAGIC = b"NEMOREC\0"
+RECORDS_VERSION = 1
+ALIGNMENT = 64
+
+SYNC = b"NREC"
+
+# magic, length of the JSON header
+_FILE_HEADER = struct.Struct("<8sQ")
+
+# sync, crc32 of everything after it, record length, datetime (see index.datetime_to_us()), pickle length,
+# number of out-of-band buffers, flags
+_RECORD_HEADER = struct.Struct("<4sIQqQII")
+_BUFFER_ENTRY = struct.Struct("<QQ")
+
+_FLAG_AWARE = 1
+
+
+class RecordError(Exception):
+    """Raised when a record of a framed metadata file is corrupt"""
+
+
+def _align(value: int) -> int:
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _parse_header(data) -> Tuple[dict, int]:
+    """Returns the JSON header of a framed file and the offset of its first record"""
+
+    try:
+        magic, header_len = _FILE_HEADER.unpack_from(data, 0)
+        header = json.loads(bytes(data[_FILE_HEADER.size:_FILE_HEADER.size + header_len]).decode("utf-8"))
+    except (struct.error, ValueError) as e:
+        raise RecordError("Malformed header") from e
+
+    if magic != MAGIC or header.get("version") != RECORDS_VERSION:
+        raise RecordError(f"Not a version {RECORDS_VERSION} framed metadata file")
+
+    return header, _align(_FILE_HEADER.size + header_len)
+
+
+def read_header(path: str) -> dict:
+    """
+    Args:
+        path (str): Path to metadata.nrec
+
+    Returns:
+        dict: The JSON header of the file: version, video paths, camera names and, for files converted from
+            metadata.pkl, the source_signature() of the metadata.pkl they were converted from
+    """
+
+    with open(path, "rb") as f:
+        start = f.read(_FILE_HEADER.size)
+        try:
+            _, header_len = _FILE_HEADER.unpack(start)
+        except struct.error as e:
+            raise RecordError(f"Malformed header in {path}") from e
+
+        try:
+            return _parse_header(start + f.read(header_len))[0]
+        except RecordError as e:
+            raise RecordError(f"{e} in {path}") from e
+
+
+def _is_stale(framed_path: str, pickle_path: str) -> bool:
+    """Tells if metadata.nrec was converted from a metadata.pkl that has changed since"""
+
+    try:
+        source = read_header(framed_path).get("source")
+    except (OSError, RecordError):
+        # the Player reports the damaged file when it opens it
+        return False
+
+    return source is not None and source != source_signature(pickle_path)
+
+
+def session_metadata_path(session_path: str) -> str:
+    """
+    Args:
+        session_path (str): Directory of the recorded session
+
+    Returns:
+        str: Path of the metadata file of the session, metadata.nrec if there is one, otherwise metadata.pkl.
+            A metadata.nrec converted from an older version of metadata.pkl is ignored.
+    """
+
+    framed_path, pickle_path = (os.path.join(session_path, name) for name in METADATA_FILES)
+
+    if not os.path.exists(framed_path):
+        return pickle_path
+
+    if os.path.exists(pickle_path) and _is_stale(framed_path, pickle_path):
+        logging.warning(f"{framed_path} was converted from an older {pickle_path}, reading {pickle_path} instead")
+        return pickle_path
+
+    return framed_path
+
+
+def is_framed(path: str) -> bool:
+    """Tells if a metadata file uses the framed format (see FramedMetadataWriter) rather than a pickle stream."""
+
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def open_metadata(path: str) -> "MetadataReader":
+    """
+    Opens a metadata file in either format, detected from its first bytes.
+
+    Args:
+        path (str): Path to metadata.nrec or metadata.pkl
+
+    Returns:
+        MetadataReader: Reader positioned at the first packet
+    """
+
+    if is_framed(path):
+        return FramedMetadataReader(path)
+    return PickleMetadataReader(path)
+
+
+class MetadataReader(ABC):
+    """
+    Reads the packets of a metadata file. Packets are addressed by their byte offset in the file, the offsets
+    stored by FrameIndex.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.video_paths = {}
+
+    @abstractmethod
+    def tell(self) -> int:
+        """Offset of the next packet read_packet() returns"""
+
+    @abstractmethod
+    def seek(self, offset: int, whence: Optional[int] = 0):
+        """
+        Moves to the packet at the given offset, like file.seek() (seek(0, 2) moves to the end of the file).
+
+        Args:
+            offset (int): Byte offset of a packet
+            whence (Optional[int]): 0 for absolute offsets, 2 for offsets from the end of the file
+        """
+
+    @abstractmethod
+    def rewind(self):
+        """Moves to the first packet"""
+
+    @abstractmethod
+    def read_packet(self) -> Optional[dict]:
+        """
+        Reads the next packet and advances past it.
+
+        Returns:
+            Optional[dict]: The packet, None at the end of the file
+        """
+
+    def read_packet_at(self, offset: int) -> Optional[dict]:
+        """
+        Reads the packet at the given offset, without moving the position of read_packet().
+
+        Args:
+            offset (int): Byte offset of the packet
+
+        Returns:
+            Optional[dict]: The packet, None if there is no packet at the offset
+        """
+
+        position = self.tell()
+
+        try:
+            self.seek(offset)
+            return self.read_packet()
+        finally:
+            self.seek(position)
+
+    def iter_packets(self) -> Iterator[dict]:
+        """Reads all the packets from the current position on."""
+
+        while (packet := self.read_packet()) is not None:
+            yield packet
+
+    @abstractmethod
+    def iter_index_records(self, positions: Tuple[str],
+                           method: Optional[str] = "scan") -> Iterator[Tuple[int, datetime.datetime, Tuple[int]]]:
+        """
+        Yields what the index needs to know about each packet, from the current position on.
+
+        Args:
+            positions (Tuple[str]): Names of the cameras whose frame numbers will be recorded
+            method (Optional[str]): "scan" or "unpickle", see FrameIndex.build()
+
+        Returns:
+            Iterator[Tuple[int, datetime.datetime, Tuple[int]]]: see index.iter_unpickled_records()
+        """
+
+    @abstractmethod
+    def close(self):
+        """Releases the file, packets already read stay valid"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PickleMetadataReader(MetadataReader):
+    """
+    Reads the original metadata.pkl format, the video paths dict followed by one pickle per packet.
+    The end of the file can't be told apart from a damaged packet, both end the stream.
+    """
+
+    def __init__(self, path: str):
+        super(PickleMetadataReader, self).__init__(path)
+
+        self._file = open(path, "rb")
+        self.video_paths = pickle.load(self._file)
+        self._data_offset = self._file.tell()
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def seek(self, offset: int, whence: Optional[int] = 0):
+        self._file.seek(offset, whence)
+
+    def rewind(self):
+        self._file.seek(self._data_offset, 0)
+
+    def read_packet(self) -> Optional[dict]:
+        try:
+            return pickle.load(self._file)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+
+    def iter_index_records(self, positions: Tuple[str],
+                           method: Optional[str] = "scan") -> Iterator[Tuple[int, datetime.datetime, Tuple[int]]]:
+        return iter_records(self._file, positions, method)
+
+    def close(self):
+        self._file.close()
+
+
+class FramedMetadataReader(MetadataReader):
+    """
+    Reads metadata files written by FramedMetadataWriter. The file is memory mapped, arrays of the packets are
+    read-only views of the mapping instead of copies, and every record is checked against its CRC-32.
+    """
+
+    def __init__(self, path: str, verify: Optional[bool] = True):
+        """
+        Args:
+            path (str): Path to metadata.nrec
+            verify (Optional[bool]): If true the CRC-32 of every packet read is checked
+        """
+
+        super(FramedMetadataReader, self).__init__(path)
+
+        self.verify = verify
+
+        self._file = open(path, "rb")
+        self._map = None
+        self._remap()
+
+        try:
+            header, self._data_offset = _parse_header(self._map)
+        except RecordError as e:
+            raise RecordError(f"{e} in {path}") from e
+
+        self.video_paths = header["video_paths"]
+        self.positions = tuple(header["positions"])
+        self.source = header.get("source")
+        self._offset = self._data_offset
+
+    def _remap(self):
+        # arrays handed out keep the previous mapping alive for as long as they exist
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size > 0 else b""
+
+    def _available(self, end: int) -> bool:
+        """Tells if the file reaches the given offset, mapping data appended since it was opened"""
+
+        if end > len(self._map):
+            self._remap()
+        return end <= len(self._map)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def seek(self, offset: int, whence: Optional[int] = 0):
+        if whence == 2:
+            self._remap()
+            offset += len(self._map)
+        self._offset = offset
+
+    def rewind(self):
+        self._offset = self._data_offset
+
+    def _read_header(self, offset: int) -> Optional[tuple]:
+        """Returns the fixed header fields of the record at offset, None at the end of the file"""
+
+        if not self._available(offset + _RECORD_HEADER.size):
+            if offset < len(self._map):
+                logging.warning(f"Truncated record at offset {offset} of {self.path}, ignoring it")
+            return None
+
+        header = _RECORD_HEADER.unpack_from(self._map, offset)
+
+        if header[0] != SYNC:
+            raise RecordError(f"No record at offset {offset} of {self.path}")
+
+        return header
+
+    def _frame_numbers(self, offset: int) -> Tuple[int]:
+        start = offset + _RECORD_HEADER.size
+        return struct.unpack_from(f"<{len(self.positions)}q", self._map, start)
+
+    def read_packet(self) -> Optional[dict]:
+        packet, end = self._read_packet(self._offset)
+        if packet is not None:
+            self._offset = end
+        return packet
+
+    def read_packet_at(self, offset: int) -> Optional[dict]:
+        return self._read_packet(offset)[0]
+
+    def _read_packet(self, offset: int) -> Tuple[Optional[dict], int]:
+        header = self._read_header(offset)
+        if header is None:
+            return None, offset
+
+        _, crc, length, _, pickle_len, num_buffers, _ = header
+
+        if not self._available(offset + length):
+            logging.warning(f"Truncated record at offset {offset} of {self.path}, ignoring it")
+            return None, offset
+
+        record = memoryview(self._map)[offset:offset + length]
+
+        if self.verify and zlib.crc32(record[8:]) != crc:
+            raise RecordError(f"Checksum mismatch in the record at offset {offset} of {self.path}")
+
+        pos = _RECORD_HEADER.size + 8 * len(self.positions)
+
+        buffers = []
+        for _ in range(num_buffers):
+            start, size = _BUFFER_ENTRY.unpack_from(record, pos)
+            buffers.append(record[start:start + size])
+            pos += _BUFFER_ENTRY.size
+
+        try:
+            packet = pickle.loads(record[pos:pos + pickle_len], buffers=buffers)
+        except (EOFError, pickle.UnpicklingError) as e:
+            raise RecordError(f"Malformed packet at offset {offset} of {self.path}") from e
+
+        return packet, offset + length
+
+    def iter_index_records(self, positions: Tuple[str],
+                           method: Optional[str] = "scan") -> Iterator[Tuple[int, datetime.datetime, Tuple[int]]]:
+        # the datetime and frame numbers are in the record header, no packet is unpickled
+        columns = [self.positions.index(pos) if pos in self.positions else None for pos in positions]
+
+        offset = self._offset
+
+        while (header := self._read_header(offset)) is not None:
+            _, _, length, timestamp, _, _, flags = header
+
+            if not self._available(offset + length):
+                logging.warning(f"Truncated record at offset {offset} of {self.path}, ignoring it")
+                break
+
+            stored = self._frame_numbers(offset)
+            frames = tuple(-1 if column is None else stored[column] for column in columns)
+
+            yield offset, us_to_datetime(timestamp, bool(flags & _FLAG_AWARE)), frames
+            offset += length
+            self._offset = offset
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError:
+                # arrays of packets still view the mapping, it is closed once the last of them is freed
+                pass
+        self._file.close()
+
+
+class FramedMetadataWriter:
+    """
+    Writes packets to a framed metadata file (metadata.nrec), read back by FramedMetadataReader.
+
+    The file starts with MAGIC, the length of a JSON header (version, video paths and camera names) and the header.
+    Every record then starts at a multiple of ALIGNMENT bytes with a fixed size header (see _RECORD_HEADER):
+    sync bytes, CRC-32 of the rest of the record, record length, the packet datetime and one int64 frame number per
+    camera (-1 if the packet has no image), followed by the offsets and sizes of the out-of-band buffers,
+    the packet pickled with protocol 5 and finally the buffers (the data of the NumPy arrays), each aligned to
+    ALIGNMENT bytes so they can be viewed in place.
+    """
+
+    def __init__(self, path: str, video_paths: dict, source: Optional[dict] = None):
+        """
+        Creates the file and writes its header.
+
+        Args:
+            path (str): Destination, usually <session>/metadata.nrec
+            video_paths (dict): Camera name to video file, as stored at the start of metadata.pkl
+            source (Optional[dict]): source_signature() of the metadata.pkl the packets are converted from, if any.
+                The file is ignored by session_metadata_path() once metadata.pkl no longer matches it.
+        """
+
+        self.path = path
+        self.video_paths = dict(video_paths)
+        self.positions = tuple(self.video_paths)
+
+        header = {"version": RECORDS_VERSION, "video_paths": self.video_paths, "positions": list(self.positions)}
+        if source is not None:
+            header["source"] = source
+        header = json.dumps(header).encode("utf-8")
+
+        self._file = open(path, "wb")
+        self._file.write(_FILE_HEADER.pack(MAGIC, len(header)))
+        self._file.write(header)
+        self._offset = _FILE_HEADER.size + len(header)
+        self._pad()
+
+    def _pad(self):
+        padding = _align(self._offset) - self._offset
+        self._file.write(b"\0" * padding)
+        self._offset += padding
+
+    def append(self, packet: dict) -> int:
+        """
+        Writes one packet.
+
+        Args:
+            packet (dict): Packet as stored in metadata.pkl, with "datetime" and the frame numbers in "images"
+
+        Returns:
+            int: Byte offset of the record
+        """
+
+        buffers = []
+        payload = pickle.dumps(packet, protocol=5, buffer_callback=buffers.append)
+        buffers = [buffer.raw() for buffer in buffers]
+
+        frames = packet_frame_numbers(packet.get("images"), self.positions)
+        fixed_size = _RECORD_HEADER.size + 8 * len(self.positions) + _BUFFER_ENTRY.size * len(buffers)
+
+        # layout of the record, relative to its start
+        entries = []
+        end = fixed_size + len(payload)
+        for buffer in buffers:
+            start = _align(end)
+            entries.append((start, buffer.nbytes))
+            end = start + buffer.nbytes
+        length = _align(end)
+
+        body = bytearray(length - 8)
+        pos = _RECORD_HEADER.size - 8
+        struct.pack_into(f"<{len(frames)}q", body, pos, *frames)
+        pos += 8 * len(frames)
+
+        for entry in entries:
+            _BUFFER_ENTRY.pack_into(body, pos, *entry)
+            pos += _BUFFER_ENTRY.size
+
+        body[pos:pos + len(payload)] = payload
+
+        for (start, size), buffer in zip(entries, buffers):
+            body[start - 8:start - 8 + size] = buffer
+
+        packet_datetime = packet["datetime"]
+        flags = _FLAG_AWARE if packet_datetime.tzinfo is not None else 0
+
+        # the crc covers the rest of the fixed header too, which is packed last
+        fields = _RECORD_HEADER.pack(SYNC, 0, length, datetime_to_us(packet_datetime), len(payload), len(buffers),
+                                     flags)
+        body[:_RECORD_HEADER.size - 8] = fields[8:]
+        crc = zlib.crc32(body)
+
+        offset = self._offset
+        self._file.write(fields[:4] + struct.pack("<I", crc))
+        self._file.write(body)
+        self._offset += length
+
+        return offset
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
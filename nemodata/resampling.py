@@ -0,0 +1,275 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .index import FrameIndex
+from .telemetry import Telemetry
+
+
+# channels with discrete values, resampled by holding the last value instead of interpolating
+HELD_CHANNELS = ("canbus_signal", "gps_num_sats")
+
+# the IMU orientation, resampled as a unit quaternion by slerp, in x, y, z, w order
+QUATERNION_CHANNELS = ("imu_orientation_x", "imu_orientation_y", "imu_orientation_z", "imu_orientation_w")
+
+
+def uniform_grid(start_us: int, end_us: int, rate_hz: float) -> np.ndarray:
+    """
+    Args:
+        start_us (int): First timestamp, see index.datetime_to_us()
+        end_us (int): Last timestamp, included if it falls on the grid
+        rate_hz (float): Samples per second
+
+    Returns:
+        np.ndarray: int64 timestamps spaced 1 / rate_hz apart
+    """
+
+    if rate_hz <= 0:
+        raise Exception(f"Resampling rate must be positive, got {rate_hz}")
+
+    count = int(np.floor((end_us - start_us) * rate_hz / 1e6)) + 1 if end_us >= start_us else 0
+    return start_us + np.round(np.arange(count) * (1e6 / rate_hz)).astype(np.int64)
+
+
+def _bracket(timestamps: np.ndarray, grid: np.ndarray,
+             max_gap_us: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the samples around each grid point.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Sample at or before each point, sample after it,
+            weight of the later sample and mask of the points that lie between two samples (or on one)
+    """
+
+    before = np.searchsorted(timestamps, grid, side="right") - 1
+    after = np.minimum(before + 1, len(timestamps) - 1)
+    before_clipped = np.maximum(before, 0)
+
+    exact = (before >= 0) & (timestamps[before_clipped] == grid)
+    between = (before >= 0) & (before + 1 < len(timestamps))
+
+    span = timestamps[after] - timestamps[before_clipped]
+    if max_gap_us is not None:
+        between &= span <= max_gap_us
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.where(between & (span > 0), (grid - timestamps[before_clipped]) / span, 0.0)
+
+    return before_clipped, np.where(exact, before_clipped, after), np.where(exact, 0.0, weight), between | exact
+
+
+def interpolate(timestamps: np.ndarray, values: np.ndarray, grid: np.ndarray,
+                max_gap_us: Optional[int] = None) -> np.ndarray:
+    """
+    Linear interpolation of one channel at the grid timestamps, ignoring the samples that are NaN.
+
+    Args:
+        timestamps (np.ndarray): int64 sorted sample timestamps
+        values (np.ndarray): float64 samples, NaN where there is no data
+        grid (np.ndarray): int64 timestamps to interpolate at
+        max_gap_us (Optional[int]): Points between samples further apart than this are NaN
+
+    Returns:
+        np.ndarray: float64 values, NaN outside the samples and across gaps
+    """
+
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+
+    out = np.full(len(grid), np.nan)
+    if len(timestamps) == 0:
+        return out
+
+    before, after, weight, inside = _bracket(timestamps, grid, max_gap_us)
+    out[inside] = values[before[inside]] + (values[after[inside]] - values[before[inside]]) * weight[inside]
+
+    return out
+
+
+def hold(timestamps: np.ndarray, values: np.ndarray, grid: np.ndarray,
+         max_gap_us: Optional[int] = None) -> np.ndarray:
+    """
+    Resamples a discrete channel, each point takes the last sample at or before it (NaN samples are ignored).
+
+    Args:
+        timestamps (np.ndarray): int64 sorted sample timestamps
+        values (np.ndarray): float64 samples, NaN where there is no data
+        grid (np.ndarray): int64 timestamps to resample at
+        max_gap_us (Optional[int]): Points further than this after their sample are NaN
+
+    Returns:
+        np.ndarray: float64 values, NaN before the first and after the last sample
+    """
+
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+
+    out = np.full(len(grid), np.nan)
+    if len(timestamps) == 0:
+        return out
+
+    before = np.searchsorted(timestamps, grid, side="right") - 1
+    inside = (before >= 0) & (grid <= timestamps[-1])
+    if max_gap_us is not None:
+        inside &= grid - timestamps[np.maximum(before, 0)] <= max_gap_us
+
+    out[inside] = values[before[inside]]
+    return out
+
+
+def slerp(timestamps: np.ndarray, quaternions: np.ndarray, grid: np.ndarray,
+          max_gap_us: Optional[int] = None) -> np.ndarray:
+    """
+    Spherical linear interpolation of orientations at the grid timestamps, along the shortest arc.
+    Samples with NaN components or zero norm are ignored.
+
+    Args:
+        timestamps (np.ndarray): int64 sorted sample timestamps
+        quaternions (np.ndarray): float64 (N, 4) samples
+        grid (np.ndarray): int64 timestamps to interpolate at
+        max_gap_us (Optional[int]): Points between samples further apart than this are NaN
+
+    Returns:
+        np.ndarray: float64 (len(grid), 4) unit quaternions, NaN outside the samples and across gaps
+    """
+
+    norms = np.linalg.norm(quaternions, axis=1)
+    valid = np.isfinite(norms) & (norms > 0)
+    timestamps = timestamps[valid]
+    quaternions = quaternions[valid] / norms[valid, None]
+
+    out = np.full((len(grid), 4), np.nan)
+    if len(timestamps) == 0:
+        return out
+
+    before, after, weight, inside = _bracket(timestamps, grid, max_gap_us)
+    q0, q1, t = quaternions[before[inside]], quaternions[after[inside]], weight[inside, None]
+
+    # q and -q are the same orientation, the one closer to q0 gives the shortest arc
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.minimum(np.abs(dot), 1.0)
+
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    nearly_equal = sin_theta < 1e-6
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w0 = np.where(nearly_equal, 1 - t, np.sin((1 - t) * theta) / sin_theta)
+        w1 = np.where(nearly_equal, t, np.sin(t * theta) / sin_theta)
+
+    result = w0 * q0 + w1 * q1
+    out[inside] = result / np.linalg.norm(result, axis=1, keepdims=True)
+
+    return out
+
+
+def nearest_indices(timestamps: np.ndarray, grid: np.ndarray, mask: Optional[np.ndarray] = None,
+                    max_distance_us: Optional[int] = None) -> np.ndarray:
+    """
+    Finds the sample closest in time to each grid point.
+
+    Args:
+        timestamps (np.ndarray): int64 sorted sample timestamps
+        grid (np.ndarray): int64 timestamps to look up
+        mask (Optional[np.ndarray]): bool, only the samples where it is true are considered
+        max_distance_us (Optional[int]): Points further than this from every sample get -1
+
+    Returns:
+        np.ndarray: int64 index of the closest sample (into the unmasked timestamps), -1 if there is none
+    """
+
+    candidates = np.arange(len(timestamps)) if mask is None else np.flatnonzero(mask)
+    out = np.full(len(grid), -1, dtype=np.int64)
+
+    if len(candidates) == 0:
+        return out
+
+    candidate_timestamps = timestamps[candidates]
+
+    after = np.minimum(np.searchsorted(candidate_timestamps, grid, side="left"), len(candidates) - 1)
+    before = np.maximum(after - 1, 0)
+
+    # ties go to the earlier sample
+    use_before = np.abs(grid - candidate_timestamps[before]) <= np.abs(candidate_timestamps[after] - grid)
+    nearest = np.where(use_before, before, after)
+
+    found = np.ones(len(grid), dtype=bool)
+    if max_distance_us is not None:
+        found = np.abs(candidate_timestamps[nearest] - grid) <= max_distance_us
+
+    out[found] = candidates[nearest[found]]
+    return out
+
+
+def resample_telemetry(telemetry: Telemetry, rate_hz: float, start_us: Optional[int] = None,
+                       end_us: Optional[int] = None, max_gap_ms: Optional[float] = None) -> Telemetry:
+    """
+    Resamples every channel of a recording on a uniform time grid: scalar channels are interpolated linearly,
+    discrete ones (HELD_CHANNELS) hold their last value and the IMU orientation is interpolated by slerp.
+
+    Args:
+        telemetry (Telemetry): Columns of the recording, see Player.telemetry()
+        rate_hz (float): Samples per second of the result
+        start_us (Optional[int]): First grid timestamp, the first packet by default
+        end_us (Optional[int]): Last grid timestamp, the last packet by default
+        max_gap_ms (Optional[float]): Grid points across gaps longer than this in a channel's data are NaN
+
+    Returns:
+        Telemetry: Columns with one row per grid point instead of one per packet
+    """
+
+    timestamps = np.asarray(telemetry.timestamps)
+
+    if len(timestamps) == 0:
+        grid = np.empty(0, dtype=np.int64)
+    else:
+        grid = uniform_grid(timestamps[0] if start_us is None else start_us,
+                            timestamps[-1] if end_us is None else end_us, rate_hz)
+
+    max_gap_us = None if max_gap_ms is None else int(max_gap_ms * 1000)
+    columns = {}
+
+    for channel in telemetry.keys():
+        if channel in QUATERNION_CHANNELS:
+            continue
+
+        resample = hold if channel in HELD_CHANNELS else interpolate
+        columns[channel] = resample(timestamps, np.asarray(telemetry[channel]), grid, max_gap_us)
+
+    if all(channel in telemetry for channel in QUATERNION_CHANNELS):
+        quaternions = np.stack([np.asarray(telemetry[channel]) for channel in QUATERNION_CHANNELS], axis=1)
+        orientation = slerp(timestamps, quaternions, grid, max_gap_us)
+
+        for i, channel in enumerate(QUATERNION_CHANNELS):
+            columns[channel] = orientation[:, i]
+
+    # same column order as the source
+    columns = {channel: columns[channel] for channel in telemetry.keys() if channel in columns}
+
+    return Telemetry(grid, columns, telemetry.aware)
+
+
+def nearest_frames(frame_index: FrameIndex, grid: np.ndarray, positions: Optional[Tuple[str]] = None,
+                   max_distance_ms: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """
+    Picks the image of each camera recorded closest to each grid point.
+
+    Args:
+        frame_index (FrameIndex): Index of the recording, see Player.frame_index
+        grid (np.ndarray): int64 timestamps, e.g. the timestamps of resample_telemetry()
+        positions (Optional[Tuple[str]]): Cameras, all the cameras of the index by default
+        max_distance_ms (Optional[float]): Grid points further than this from every image of a camera get -1
+
+    Returns:
+        Dict[str, np.ndarray]: Camera name to the int64 frame index (packet) holding the image for each grid point,
+            -1 where there is none. Frame indices can be passed to Player[] or Player.crt_frame_index.
+    """
+
+    positions = frame_index.positions if positions is None else positions
+    max_distance_us = None if max_distance_ms is None else int(max_distance_ms * 1000)
+
+    return {pos: nearest_indices(frame_index.timestamps, grid,
+                                 frame_index.frame_numbers[:, frame_index.positions.index(pos)] >= 0,
+                                 max_distance_us)
+            for pos in positions}
@@ -0,0 +1,154 @@
+from collections import namedtuple
+from multiprocessing import shared_memory
+from typing import Optional, Tuple, Union
+import os
+
+import numpy as np
+import cv2
+
+import logging
+
+from .players import output_frame_shape
+from .records import open_metadata, session_metadata_path
+
+
+# placeholder for an image decoded into a FramePool slot, which crosses the process boundary instead of the image
+FrameSlot = namedtuple("FrameSlot", ["slot", "shape"])
+
+# blocks closed by FramePool.close() while frames still viewed them, detached once the frames are dropped
+_lingering_blocks = []
+
+
+def _close_lingering_blocks():
+    """Detaches from the blocks whose frames have all been dropped since their pool was closed"""
+
+    for memory in list(_lingering_blocks):
+        try:
+            memory.close()
+        except BufferError:
+            continue
+        _lingering_blocks.remove(memory)
+
+
+def session_frame_bytes(session_path: str, positions: Tuple[str],
+                        output_size: Optional[Union[Tuple[int, int], float]] = None,
+                        color_format: Optional[str] = "bgr") -> int:
+    """
+    Size of the biggest frame of a session, read from the video headers without decoding.
+
+    Args:
+        session_path (str): Directory of the recorded session
+        positions (Tuple[str]): Cameras that are played back
+        output_size (Optional[Union[Tuple[int, int], float]]): Resizing done by the Player, see VideoReadBuffer
+        color_format (Optional[str]): Colour format output by the Player, see VideoReadBuffer
+
+    Returns:
+        int: Bytes needed to hold one frame of any of the cameras
+    """
+
+    with open_metadata(session_metadata_path(session_path)) as reader:
+        video_paths = reader.video_paths
+
+    frame_bytes = 0
+    for pos in positions:
+        capture = cv2.VideoCapture(os.path.join(session_path, video_paths[pos]))
+        resolution = capture.get(cv2.CAP_PROP_FRAME_WIDTH), capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        capture.release()
+
+        frame_bytes = max(frame_bytes, int(np.prod(output_frame_shape(resolution, output_size, color_format))))
+
+    return frame_bytes
+
+
+class FramePool:
+    """
+    Fixed size slots in a shared memory block, each holding one decoded frame.
+    A worker process decodes frames straight into free slots and sends only the slot numbers to the consumer,
+    which reads the frames in place and gives the slots back once it is done with them.
+    """
+
+    def __init__(self, num_slots: int, slot_bytes: int, context):
+        """
+        Creates the shared memory block, to be done by the consumer process which also owns its lifetime.
+
+        Args:
+            num_slots (int): Number of frames that can be in flight at once, workers wait for a free slot beyond that
+            slot_bytes (int): Size of each slot, see session_frame_bytes()
+            context: multiprocessing context of the worker processes
+        """
+
+        self.num_slots = num_slots
+        self.slot_bytes = slot_bytes
+
+        _close_lingering_blocks()
+
+        self._memory = shared_memory.SharedMemory(create=True, size=max(num_slots * slot_bytes, 1))
+        self._free_slots = context.Queue()
+        for slot in range(num_slots):
+            self._free_slots.put(slot)
+
+        self._unlinked = False
+
+    def __getstate__(self):
+        # workers attach to the same block by name
+        state = self.__dict__.copy()
+        state["_memory"] = self._memory.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memory = shared_memory.SharedMemory(self._memory)
+
+    def acquire(self) -> int:
+        """
+        Waits for a free slot.
+
+        Returns:
+            int: The slot number
+        """
+        return self._free_slots.get()
+
+    def release(self, slot: int):
+        """
+        Gives a slot back, the frame it holds may be overwritten from now on.
+
+        Args:
+            slot (int): The slot number
+        """
+        self._free_slots.put(slot)
+
+    def view(self, slot: int, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Args:
+            slot (int): The slot number
+            shape (Tuple[int, ...]): Shape of the uint8 frame stored in the slot
+
+        Returns:
+            np.ndarray: Frame backed by the shared memory, no data is copied
+        """
+        # unlike np.ndarray(buffer=...), frombuffer keeps the shared memory mapped as long as the view exists
+        count = int(np.prod(shape))
+        return np.frombuffer(self._memory.buf, dtype=np.uint8, count=count, offset=slot * self.slot_bytes).reshape(shape)
+
+    def close(self, unlink: Optional[bool] = False):
+        """
+        Detaches from the shared memory block. Frames still referenced by the consumer keep the block mapped,
+        it is then detached by a later close() or FramePool once they have been dropped.
+
+        Args:
+            unlink (Optional[bool]): If true the block is also destroyed, done by the owner once all processes are
+                done with it. Its memory is freed once no process maps it any more.
+        """
+
+        if unlink and not self._unlinked:
+            self._memory.unlink()
+            self._unlinked = True
+
+        try:
+            self._memory.close()
+        except BufferError:
+            if self._memory not in _lingering_blocks:
+                logging.debug(f"Frames still view shared memory block {self._memory.name}, keeping it mapped")
+                _lingering_blocks.append(self._memory)
+
+        _close_lingering_blocks()
@@ -0,0 +1,128 @@
+from typing import Dict, Optional, Tuple
+import json
+import os
+import struct
+
+import numpy as np
+
+import logging
+
+
+MAGIC = b"NEMOSIDE"
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sQ")
+
+
+def source_signature(path: str) -> dict:
+    """
+    Describes the state of a source file, used to invalidate sidecars built from an older version of it.
+
+    Args:
+        path (str): Path to the source file (e.g. metadata.pkl)
+
+    Returns:
+        dict: Size and modification time of the file
+    """
+
+    stat = os.stat(path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _align(value: int) -> int:
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_columns(path: str, columns: Dict[str, np.ndarray], meta: dict):
+    """
+    Writes a set of arrays to a single sidecar file that can later be memory mapped.
+    Each array is stored contiguously, aligned to ALIGNMENT bytes, after a small JSON header.
+    The file is written next to its destination first and then moved in place,
+    so readers never see a partially written sidecar.
+
+    Args:
+        path (str): Destination of the sidecar file
+        columns (Dict[str, np.ndarray]): Arrays to store, by name
+        meta (dict): JSON serializable details checked by read_columns() (e.g. the source_signature())
+    """
+
+    columns = {name: np.ascontiguousarray(arr) for name, arr in columns.items()}
+
+    descriptions = []
+    header = b""
+
+    # the header size depends on the column offsets, which depend on the header size, iterate until stable
+    data_offset = 0
+    while True:
+        offset = data_offset
+        descriptions.clear()
+
+        for name, arr in columns.items():
+            descriptions.append({"name": name, "dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset})
+            offset = _align(offset + arr.nbytes)
+
+        header = json.dumps({"meta": meta, "columns": descriptions}).encode("utf-8")
+        needed_offset = _align(_PREAMBLE.size + len(header))
+
+        if needed_offset <= data_offset:
+            break
+        data_offset = needed_offset
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, len(header)))
+        f.write(header)
+
+        for description, arr in zip(descriptions, columns.values()):
+            f.write(b"\0" * (description["offset"] - f.tell()))
+            f.write(arr.tobytes())
+
+    os.replace(tmp_path, path)
+
+
+def read_columns(path: str, meta: Optional[dict] = None) -> Optional[Tuple[dict, Dict[str, np.ndarray]]]:
+    """
+    Memory maps the arrays of a sidecar written by write_columns().
+
+    Args:
+        path (str): Path to the sidecar file
+        meta (Optional[dict]): Every key given here must match the stored metadata, otherwise the sidecar is stale
+
+    Returns:
+        Optional[Tuple[dict, Dict[str, np.ndarray]]]: Stored metadata and read-only arrays by name.
+            None if the sidecar is missing, malformed or stale.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            magic, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != MAGIC:
+                return None
+            header = json.loads(f.read(header_len).decode("utf-8"))
+    except (OSError, struct.error, ValueError):
+        return None
+
+    stored_meta = header["meta"]
+
+    if meta is not None:
+        for k, v in meta.items():
+            if stored_meta.get(k) != v:
+                logging.info(f"Sidecar {path} is stale, ignoring it")
+                return None
+
+    data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) > 0 else np.empty(0, np.uint8)
+
+    columns = {}
+    for description in header["columns"]:
+        dtype = np.dtype(description["dtype"])
+        shape = tuple(description["shape"])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        start = description["offset"]
+
+        if start + nbytes > len(data):
+            return None
+
+        columns[description["name"]] = data[start:start + nbytes].view(dtype).reshape(shape)
+
+    return stored_meta, columns
@@ -0,0 +1,220 @@
+from typing import Dict, Iterator, Optional, Tuple
+import datetime
+
+import numpy as np
+
+import logging
+
+from .index import datetime_to_us, us_to_datetime
+from .sidecar import source_signature, read_columns, write_columns
+from .records import open_metadata
+
+
+TELEMETRY_VERSION = 1
+
+# column name -> where the value is found in packet["sensor_data"], dict keys or object attributes (GPS sentences)
+CHANNELS = {
+    "canbus_speed": ("canbus", "speed", "value"),
+    "canbus_steer": ("canbus", "steer", "value"),
+    "canbus_brake": ("canbus", "brake", "value"),
+    "canbus_signal": ("canbus", "signal", "value"),
+
+    "imu_acceleration_x": ("imu", "linear_acceleration", "x"),
+    "imu_acceleration_y": ("imu", "linear_acceleration", "y"),
+    "imu_acceleration_z": ("imu", "linear_acceleration", "z"),
+    "imu_gyro_x": ("imu", "gyro_rate", "x"),
+    "imu_gyro_y": ("imu", "gyro_rate", "y"),
+    "imu_gyro_z": ("imu", "gyro_rate", "z"),
+    "imu_orientation_x": ("imu", "orientation_quaternion", "x"),
+    "imu_orientation_y": ("imu", "orientation_quaternion", "y"),
+    "imu_orientation_z": ("imu", "orientation_quaternion", "z"),
+    "imu_orientation_w": ("imu", "orientation_quaternion", "w"),
+
+    "gps_latitude": ("gps", "GGA", "latitude"),
+    "gps_longitude": ("gps", "GGA", "longitude"),
+    "gps_altitude": ("gps", "GGA", "altitude"),
+    "gps_hdop": ("gps", "GGA", "horizontal_dil"),
+    "gps_num_sats": ("gps", "GGA", "num_sats"),
+}
+
+
+def telemetry_path_for(metadata_path: str) -> str:
+    """Path of the sidecar file that caches the telemetry columns of the given metadata file."""
+    return metadata_path + ".telemetry"
+
+
+def channel_value(sensor_data: Optional[dict], path: Tuple[str]) -> float:
+    """
+    Reads one sensor value from a packet.
+
+    Args:
+        sensor_data (Optional[dict]): The "sensor_data" field of a packet
+        path (Tuple[str]): Location of the value, see CHANNELS
+
+    Returns:
+        float: The value or NaN if the packet holds no data for it
+    """
+
+    value = sensor_data
+    for key in path:
+        if value is None:
+            return np.nan
+        if isinstance(value, dict):
+            value = value.get(key)
+        else:
+            value = getattr(value, key, None)
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class Telemetry:
+    """
+    Sensor channels of a recording as typed columns, one row per packet (row i belongs to frame index i).
+    Values are float64, NaN where the packet holds no data for the channel.
+    """
+
+    def __init__(self, timestamps: np.ndarray, columns: Dict[str, np.ndarray], aware: Optional[bool] = False):
+        """
+        Args:
+            timestamps (np.ndarray): int64 packet datetimes, see index.datetime_to_us()
+            columns (Dict[str, np.ndarray]): Column for each channel in CHANNELS
+            aware (Optional[bool]): True if the recording uses time zone aware datetimes
+        """
+
+        self.timestamps = timestamps
+        self.columns = columns
+        self.aware = aware
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, channel: str) -> np.ndarray:
+        return self.columns[channel]
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    def datetime_at(self, i: int) -> datetime.datetime:
+        """
+        Args:
+            i (int): Row (packet) index
+
+        Returns:
+            datetime.datetime: Datetime of the packet
+        """
+        return us_to_datetime(self.timestamps[i], self.aware)
+
+    @classmethod
+    def from_packets(cls, packets: Iterator[dict]) -> "Telemetry":
+        """
+        Extracts the channels from a sequence of packets.
+
+        Args:
+            packets (Iterator[dict]): Packets as read from metadata.pkl (images are ignored)
+
+        Returns:
+            Telemetry: Columns of all the packets
+        """
+
+        timestamps = []
+        values = {name: [] for name in CHANNELS}
+        aware = False
+
+        for packet in packets:
+            if not timestamps:
+                aware = packet["datetime"].tzinfo is not None
+
+            timestamps.append(datetime_to_us(packet["datetime"]))
+
+            sensor_data = packet.get("sensor_data")
+            for name, path in CHANNELS.items():
+                values[name].append(channel_value(sensor_data, path))
+
+        return cls(np.array(timestamps, dtype=np.int64),
+                   {name: np.array(column, dtype=np.float64) for name, column in values.items()},
+                   aware)
+
+    def save(self, path: str, signature: dict):
+        """
+        Writes the columns to a sidecar file.
+
+        Args:
+            path (str): Destination file
+            signature (dict): source_signature() of the metadata file the columns were extracted from
+        """
+
+        meta = {"kind": "telemetry", "version": TELEMETRY_VERSION, "aware": self.aware}
+        meta.update(signature)
+
+        columns = {"timestamps": self.timestamps}
+        columns.update(self.columns)
+
+        write_columns(path, columns, meta)
+
+    @classmethod
+    def load(cls, path: str, signature: dict) -> Optional["Telemetry"]:
+        """
+        Memory maps columns saved with save().
+
+        Args:
+            path (str): Sidecar file
+            signature (dict): source_signature() of the metadata file, the sidecar is ignored if it doesn't match
+
+        Returns:
+            Optional[Telemetry]: The columns or None if the sidecar is missing or stale
+        """
+
+        expected = {"kind": "telemetry", "version": TELEMETRY_VERSION}
+        expected.update(signature)
+
+        result = read_columns(path, expected)
+        if result is None:
+            return None
+
+        meta, columns = result
+        timestamps = columns.pop("timestamps")
+
+        return cls(timestamps, columns, meta["aware"])
+
+    @classmethod
+    def build(cls, metadata_path: str, use_sidecar: Optional[bool] = True) -> "Telemetry":
+        """
+        Loads the telemetry of a recording from its sidecar, or extracts it by reading all the packets once.
+        Freshly extracted telemetry is saved as a sidecar and returned memory mapped from there.
+
+        Args:
+            metadata_path (str): Path to metadata.pkl or metadata.nrec
+            use_sidecar (Optional[bool]): If false the sidecar is neither read nor written
+
+        Returns:
+            Telemetry: Columns of all the packets
+        """
+
+        sidecar_path = telemetry_path_for(metadata_path)
+        signature = source_signature(metadata_path)
+
+        if use_sidecar:
+            telemetry = cls.load(sidecar_path, signature)
+            if telemetry is not None:
+                return telemetry
+
+        logging.info(f"Extracting telemetry from {metadata_path}...")
+
+        with open_metadata(metadata_path) as reader:
+            telemetry = cls.from_packets(reader.iter_packets())
+
+        if use_sidecar:
+            try:
+                telemetry.save(sidecar_path, signature)
+                telemetry = cls.load(sidecar_path, signature) or telemetry
+            except OSError as e:
+                logging.warning(f"Could not save telemetry sidecar {sidecar_path}: {e}")
+
+        return telemetry
+
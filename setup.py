@@ -13,9 +13,14 @@ setup(
         'PyQt5',
         'pyqtgraph',
     ],
+    extras_require={
+        # lists video keyframes for frame accurate seeking
+        'keyframes': ['av'],
+    },
     # scripts=['scripts/nemoplayer'],
     entry_points={
-          'console_scripts': ['nemoplayer=nemodata.gui_player:main']
+          'console_scripts': ['nemoplayer=nemodata.gui_player:main',
+                              'nemoconvert=nemodata.convert:main']
     },
     include_package_data=True,
     classifiers=[
@@ -0,0 +1,136 @@
+import datetime
+import os
+import pickle
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from nemodata.records import FramedMetadataWriter
+
+
+FRAME_SIZE = (32, 24)
+
+
+class FakeGGA:
+    """Stands in for the NMEA GGA sentences recorded from the GPS"""
+
+    def __init__(self, i):
+        self.latitude = 44.43 + i * 1e-5
+        self.longitude = 26.1 + i * 1e-5
+        self.altitude = 80.0 + i
+        self.horizontal_dil = "0.9"
+        self.num_sats = "9"
+
+
+def frame_value(position_number, frame_number):
+    """Flat colour of a generated frame, so tests can tell which frame was decoded"""
+    return (position_number * 60 + frame_number * 3) % 256
+
+
+def make_session(path, num_packets=40, positions=("center", "left", "right"), fourcc="FFV1", extension="avi",
+                 missing_image_every=0, start=datetime.datetime(2020, 5, 17, 10, 0, 0), delay_ms=100, gaps=(),
+                 framed=False):
+    """
+    Writes a small synthetic recording in the layout read by Player.
+
+    Args:
+        missing_image_every: every n-th packet has no image on the "left" camera (0 disables)
+        gaps: packet numbers before which an extra 10 second gap is inserted
+        framed: write metadata.nrec (see nemodata.records) instead of metadata.pkl
+
+    Returns:
+        list: the packets as they were pickled
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    writers = {}
+    video_paths = {}
+    for pos in positions:
+        video_paths[pos] = f"{pos}.{extension}"
+        writers[pos] = cv2.VideoWriter(os.path.join(path, video_paths[pos]), cv2.VideoWriter_fourcc(*fourcc), 10,
+                                       FRAME_SIZE)
+
+    frame_counts = {pos: 0 for pos in positions}
+    packets = []
+    crt_datetime = start
+
+    if framed:
+        f = FramedMetadataWriter(os.path.join(path, "metadata.nrec"), video_paths)
+    else:
+        f = open(os.path.join(path, "metadata.pkl"), "wb")
+        pickle.dump(video_paths, f)
+
+    with f:
+        for i in range(num_packets):
+            if i in gaps:
+                crt_datetime += datetime.timedelta(seconds=10)
+
+            images = {}
+            for pos_number, pos in enumerate(positions):
+                if missing_image_every and pos == "left" and i % missing_image_every == 0:
+                    images[pos] = None
+                    continue
+
+                value = frame_value(pos_number, frame_counts[pos])
+                writers[pos].write(np.full((FRAME_SIZE[1], FRAME_SIZE[0], 3), value, dtype=np.uint8))
+                images[pos] = frame_counts[pos]
+                frame_counts[pos] += 1
+
+            packet = {
+                "datetime": crt_datetime,
+                "images": images,
+                "sensor_data": {
+                    "canbus": {
+                        "speed": {"value": float(i)},
+                        "steer": {"value": float(i % 7 - 3)},
+                        "brake": {"value": float(i % 5)},
+                        "signal": {"value": 2 if i % 10 < 3 else 0},
+                    },
+                    "imu": None if i % 4 == 1 else {
+                        "linear_acceleration": {"x": 0.1 * i, "y": 0.2, "z": 1.0},
+                        "gyro_rate": {"x": 0.0, "y": 0.01 * i, "z": 0.0},
+                        "orientation_quaternion": {"x": 0.0, "y": 0.0, "z": 0.0, "w": 1.0},
+                    },
+                    "gps": {"GGA": FakeGGA(i)} if i % 3 == 0 else None,
+                }
+            }
+
+            if framed:
+                f.append(packet)
+            else:
+                pickle.dump(packet, f)
+            packets.append(packet)
+
+            crt_datetime += datetime.timedelta(milliseconds=delay_ms)
+
+    for writer in writers.values():
+        writer.release()
+
+    return packets
+
+
+class SessionFixture:
+    """
+    Gives every test a temporary directory at self.path, removed afterwards.
+    Subclasses set SESSION to the make_session() arguments of a recording written there (its packets are kept in
+    self.packets), or leave it None and write their own.
+    """
+
+    SESSION = None
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self._tmp_dir.name
+
+        if self.SESSION is not None:
+            self.packets = make_session(self.path, **self.SESSION)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+
+class SessionTestCase(SessionFixture, unittest.TestCase):
+    pass
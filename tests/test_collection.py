@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import unittest
+
+from nemodata import SessionCollection, VariableSampleRatePlayer
+from nemodata import shared_frames
+from nemodata.shared_frames import FramePool
+
+from session_factory import make_session, frame_value, SessionTestCase
+
+
+class TestSessionCollection(SessionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.session_paths = [os.path.join(self.path, f"session_{i}") for i in range(4)]
+        self.packets = {path: make_session(path, num_packets=10 + i, positions=("center",))
+                        for i, path in enumerate(self.session_paths)}
+
+    def _collection(self, **kwargs):
+        return SessionCollection(self.session_paths, num_workers=2, max_buffered_packets=4,
+                                 player_kwargs={"enabled_positions": ("center",)}, **kwargs)
+
+    def test_ordered(self):
+
+        with self._collection() as collection:
+            received = list(collection.stream_generator())
+
+        expected = [(path, packet["datetime"]) for path in self.session_paths for packet in self.packets[path]]
+        self.assertEqual([(path, packet["datetime"]) for path, packet in received], expected)
+
+        for path, packet in received:
+            frame_number = packet["sensor_data"]["canbus"]["speed"]["value"]
+            self.assertEqual(int(packet["images"]["center"][0, 0, 0]), frame_value(0, frame_number))
+
+    def test_unordered(self):
+
+        with self._collection(ordered=False) as collection:
+            received = list(collection.stream_generator())
+
+        for path in self.session_paths:
+            datetimes = [packet["datetime"] for session_path, packet in received if session_path == path]
+            self.assertEqual(datetimes, [packet["datetime"] for packet in self.packets[path]])
+
+        self.assertEqual(len(received), sum(len(packets) for packets in self.packets.values()))
+
+    def test_player_class(self):
+
+        with self._collection(player_class=VariableSampleRatePlayer) as collection:
+            received = list(collection.stream_generator())
+
+        self.assertLess(len(received), sum(len(packets) for packets in self.packets.values()) / 2)
+
+    def test_worker_errors_are_raised(self):
+
+        self.session_paths.insert(1, os.path.join(self._tmp_dir.name, "missing"))
+
+        with self._collection() as collection:
+            generator = collection.stream_generator()
+
+            for _ in range(len(self.packets[self.session_paths[0]])):
+                next(generator)
+
+            with self.assertRaises(Exception) as context:
+                next(generator)
+
+            self.assertIn("missing", str(context.exception))
+
+    def test_shared_memory(self):
+
+        for ordered in (True, False):
+            with self._collection(ordered=ordered, shared_memory=True) as collection:
+                received = 0
+
+                for path, packet in collection.stream_generator():
+                    frame_number = packet["sensor_data"]["canbus"]["speed"]["value"]
+                    image = packet["images"]["center"]
+
+                    self.assertNotIn("left", packet["images"])
+                    self.assertEqual(image.shape, (24, 32, 3))
+                    self.assertEqual(int(image[0, 0, 0]), frame_value(0, frame_number))
+                    received += 1
+
+            self.assertEqual(received, sum(len(packets) for packets in self.packets.values()))
+
+    def test_shared_memory_output_format(self):
+
+        with SessionCollection(self.session_paths, num_workers=2, shared_memory=True,
+                               player_kwargs={"enabled_positions": ("center",), "output_size": 0.5,
+                                              "color_format": "gray"}) as collection:
+            for path, packet in collection.stream_generator():
+                self.assertEqual(packet["images"]["center"].shape, (12, 16))
+
+    def test_shared_memory_keep_frames(self):
+
+        with self._collection(shared_memory=True, keep_frames=True) as collection:
+            held = []
+
+            for path, packet in collection.stream_generator():
+                held.append(packet)
+
+                # workers can only run ahead as far as their free slots allow
+                if len(held) == 3:
+                    for i, held_packet in enumerate(held):
+                        self.assertEqual(int(held_packet["images"]["center"][0, 0, 0]),
+                                         frame_value(0, held_packet["sensor_data"]["canbus"]["speed"]["value"]))
+                        collection.release(held_packet)
+                    held = []
+
+        # images outlive the collection as long as they are referenced
+        self.assertEqual(int(held[-1]["images"]["center"][0, 0, 0]),
+                         frame_value(0, held[-1]["sensor_data"]["canbus"]["speed"]["value"]))
+
+    def test_pool_outlived_by_frames(self):
+
+        pool = FramePool(2, 16, multiprocessing.get_context())
+        frame = pool.view(pool.acquire(), (4, 4))
+        frame[:] = 7
+
+        # the block stays mapped for the frame, and is detached once the frame is dropped
+        pool.close(unlink=True)
+        self.assertEqual(int(frame.sum()), 7 * 16)
+        self.assertIn(pool._memory, shared_frames._lingering_blocks)
+
+        del frame
+        FramePool(1, 16, multiprocessing.get_context()).close(unlink=True)
+        self.assertNotIn(pool._memory, shared_frames._lingering_blocks)
+
+    def test_stop_early(self):
+
+        with self._collection() as collection:
+            for i, _ in enumerate(collection.stream_generator()):
+                if i == 2:
+                    break
+
+            self.assertEqual(collection._workers, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
+import pickle
 import unittest
+from copy import deepcopy
+
 import numpy as np
 
-from nemodata.compression import Compressor
-from nemodata.compression import Decompressor
+from nemodata.compression import Compressor, JITCompressor
+from nemodata.compression import Decompressor, JITDecompressor
+from nemodata.compression.compressor import ArrayDigest
+from nemodata.compression.array_codec import ArrayPatch, encode_array
 
 
 class TestCompressor(unittest.TestCase):
@@ -129,8 +134,230 @@ class TestCompressor(unittest.TestCase):
         self.assertEqual(packet2_uncomp["position"]["y"], 3)
         self.assertTrue("z" in packet2_uncomp["position"])
 
+    def test_jit_compression_keeps_digests(self):
+
+        image = np.zeros((100, 100, 3), dtype=np.uint8)
+        packets = [
+            {"images": {"center": image}, "position": {"x": 1, "y": 2}, "mask": np.ones(3)},
+            {"images": {"center": image.copy()}, "position": {"x": 1, "y": 3}, "mask": np.ones(3)},
+            {"images": {"center": image + 1}, "position": {"x": 1, "y": 3}, "mask": np.zeros(3)},
+        ]
+
+        compressor = JITCompressor(large_arrays="digest")
+
+        self.assertIs(compressor.compress_next_packet(packets[0]), packets[0])
+        self.assertIsInstance(compressor.last_packet["images"]["center"], ArrayDigest)
+        self.assertIsInstance(compressor.last_packet["mask"], np.ndarray)
+
+        packet2_comp = compressor.compress_next_packet(packets[1])
+        self.assertEqual(packet2_comp, {"position": {"y": 3}})
+
+        # the source packet is not modified
+        self.assertIn("center", packets[1]["images"])
+        self.assertEqual(packets[1]["position"], {"x": 1, "y": 3})
+
+        packet3_comp = compressor.compress_next_packet(packets[2])
+        self.assertIs(packet3_comp["images"]["center"], packets[2]["images"]["center"])
+        self.assertTrue(np.array_equal(packet3_comp["mask"], np.zeros(3)))
+        self.assertNotIn("position", packet3_comp)
+
+    def test_digests_match_copies(self):
+
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (64, 64, 3), dtype=np.uint8) for _ in range(3)]
+        sequence = [frames[0], frames[0], frames[1], frames[1].copy(), frames[2], frames[0]]
+
+        for large_arrays in ("digest", "reference", "copy"):
+            compressor = JITCompressor(large_arrays=large_arrays)
+            compressed = [compressor.compress_next_packet({"images": {"center": frame}}) for frame in sequence]
+
+            self.assertEqual(["images" in packet for packet in compressed], [True, False, True, False, True, True],
+                             large_arrays)
+
+    def test_dict_replacing_none(self):
+
+        packets = [
+            {"sensor_data": {"imu": {"x": 1}, "gps": None}},
+            {"sensor_data": {"imu": None, "gps": {"lat": 2}}},
+            {"sensor_data": {"imu": {"x": 1}, "gps": {"lat": 2}}},
+        ]
+
+        compressor = JITCompressor()
+        compressed = [compressor.compress_next_packet(packet) for packet in packets]
+
+        self.assertEqual(compressed[1], {"sensor_data": {"imu": None, "gps": {"lat": 2}}})
+        self.assertEqual(compressed[2], {"sensor_data": {"imu": {"x": 1}}})
+
     # TODO more tests!!!
 
 
+def _random_packets(rng: np.random.Generator, num_packets: int) -> list:
+    """Packets whose values change, repeat, become None or appear at random, like recorded sensor data"""
+
+    packets = []
+    packet = {"images": {"center": np.zeros((8, 8, 3), dtype=np.uint8)}, "sensor": {"speed": 0.0, "gear": 1}}
+
+    for i in range(num_packets):
+        packet = deepcopy(packet)
+
+        if rng.random() < 0.3:
+            packet["images"]["center"] = rng.integers(0, 255, (8, 8, 3), dtype=np.uint8)
+        if rng.random() < 0.5:
+            packet["sensor"]["speed"] = float(rng.random())
+        if rng.random() < 0.2:
+            packet["sensor"]["gear"] = None if rng.random() < 0.5 else int(rng.integers(1, 6))
+        if rng.random() < 0.1:
+            packet["sensor"][f"extra_{i}"] = rng.random(4)
+        packet["datetime"] = i
+
+        packets.append(packet)
+
+    return packets
+
+
+def _assert_packets_equal(test: unittest.TestCase, expected, actual):
+    if isinstance(expected, dict):
+        test.assertIsInstance(actual, dict)
+        test.assertEqual(set(expected), set(actual))
+        for k in expected:
+            _assert_packets_equal(test, expected[k], actual[k])
+    elif isinstance(expected, np.ndarray):
+        test.assertTrue(np.array_equal(expected, actual, equal_nan=expected.dtype.kind == "f"))
+    else:
+        test.assertEqual(expected, actual)
+
+
+class TestSharedDecompression(unittest.TestCase):
+
+    def test_jit_decompression_matches_copies(self):
+
+        packets = _random_packets(np.random.default_rng(1), 200)
+        compressor = JITCompressor()
+        compressed = [compressor.compress_next_packet(packet) for packet in packets]
+
+        copying, sharing = JITDecompressor(), JITDecompressor(share_values=True)
+        outputs = []
+
+        for packet in compressed:
+            expected = copying.decompress_next_packet(deepcopy(packet))
+            actual = sharing.decompress_next_packet(deepcopy(packet))
+
+            _assert_packets_equal(self, expected, actual)
+            outputs.append((deepcopy(actual), actual))
+
+        # packets handed out earlier are not changed by the following ones
+        for snapshot, actual in outputs:
+            _assert_packets_equal(self, snapshot, actual)
+
+    def test_decompression_matches_copies(self):
+
+        packets = _random_packets(np.random.default_rng(2), 200)
+        compressed = list(Compressor(iter(deepcopy(packets))).compressed_generator())
+
+        expected = list(Decompressor(iter(deepcopy(compressed))).uncompressed_generator())
+        actual = list(Decompressor(iter(deepcopy(compressed)), share_values=True).uncompressed_generator())
+
+        for expected_packet, actual_packet in zip(expected, actual):
+            _assert_packets_equal(self, expected_packet, actual_packet)
+
+    def test_unchanged_values_are_shared(self):
+
+        decompressor = JITDecompressor(share_values=True)
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+
+        first = decompressor.decompress_next_packet({"images": {"center": image}, "sensor": {"speed": 1}})
+        second = decompressor.decompress_next_packet({"sensor": {"speed": 2}})
+
+        self.assertIs(second["images"], first["images"])
+        self.assertIs(second["images"]["center"], image)
+        self.assertEqual(first["sensor"]["speed"], 1)
+        self.assertEqual(second["sensor"]["speed"], 2)
+
+
+class TestArrayCodec(unittest.TestCase):
+
+    def _slowly_varying_packets(self, rng: np.random.Generator, num_packets: int) -> list:
+        image = np.zeros((16, 16, 3), dtype=np.uint8)
+        ranges = np.full(32, np.nan)
+        packets = []
+
+        for i in range(num_packets):
+            image = image.copy()
+            ranges = ranges.copy()
+
+            if i % 10 == 9:
+                image[:] = rng.integers(0, 255, image.shape, dtype=np.uint8)
+            else:
+                image[rng.integers(0, 16), rng.integers(0, 16)] += 1
+            ranges[rng.integers(0, 32, 4)] = rng.random(4)
+
+            packets.append({"images": {"center": image}, "lidar": {"ranges": ranges}, "datetime": i})
+
+        return packets
+
+    def test_changed_element_is_patched(self):
+
+        packet1 = {"images": {"center": np.ones((7, 7, 3))}, "position": {"x": 12}}
+        packet2 = {"images": {"center": np.ones((7, 7, 3))}, "position": {"x": 12}}
+        packet2["images"]["center"][0][0][0] = 7
+
+        compressor = JITCompressor(array_codec="xor")
+        compressor.compress_next_packet(packet1)
+        patch = compressor.compress_next_packet(packet2)["images"]["center"]
+
+        self.assertIsInstance(patch, ArrayPatch)
+        self.assertTrue(patch.is_sparse)
+        self.assertEqual(patch.indices.tolist(), [0])
+        self.assertEqual(patch.data.tolist(), [7])
+
+        decompressor = JITDecompressor()
+        decompressor.decompress_next_packet(deepcopy(packet1))
+        center = decompressor.decompress_next_packet({"images": {"center": patch}})["images"]["center"]
+
+        self.assertTrue(np.array_equal(center, packet2["images"]["center"]))
+
+    def test_round_trip(self):
+
+        packets = self._slowly_varying_packets(np.random.default_rng(3), 50)
+
+        for codec in ("xor", "delta"):
+            compressor = JITCompressor(array_codec=codec, large_arrays="reference")
+            # patches also cross process boundaries and end up on disk
+            compressed = [pickle.loads(pickle.dumps(compressor.compress_next_packet(packet))) for packet in packets]
+
+            self.assertTrue(any(isinstance(p.get("images", {}).get("center"), ArrayPatch) for p in compressed))
+
+            for share_values in (False, True):
+                decompressor = JITDecompressor(share_values=share_values)
+                for packet, compressed_packet in zip(packets, deepcopy(compressed)):
+                    _assert_packets_equal(self, packet, decompressor.decompress_next_packet(compressed_packet))
+
+                decompressed = Decompressor(iter(deepcopy(compressed)), share_values=share_values)
+                for packet, decompressed_packet in zip(packets, decompressed.uncompressed_generator()):
+                    _assert_packets_equal(self, packet, decompressed_packet)
+
+    def test_dense_patches(self):
+
+        rng = np.random.default_rng(4)
+        reference = rng.integers(0, 2 ** 16, 100, dtype=np.uint16)
+        array = reference + rng.integers(0, 3, 100, dtype=np.uint16)
+
+        delta = encode_array("delta", array, reference, sparse_max_fraction=0)
+        self.assertFalse(delta.is_sparse)
+        self.assertTrue(np.array_equal(delta.apply(reference), array))
+
+        floats = rng.random(100)
+        xor = encode_array("delta", floats + 1, floats, sparse_max_fraction=0)
+        self.assertEqual(xor.codec, "xor")
+        self.assertTrue(np.array_equal(xor.apply(floats), floats + 1))
+
+        self.assertIsNone(encode_array("xor", array, reference.astype(np.int32)))
+
+    def test_codec_needs_previous_arrays(self):
+
+        with self.assertRaises(Exception):
+            JITCompressor(large_arrays="digest", array_codec="xor")
+
+
 if __name__ == '__main__':
     unittest.main()
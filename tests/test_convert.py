@@ -0,0 +1,127 @@
+import os
+import unittest
+
+from nemodata import Player
+from nemodata.convert import STATE_FILE, convert_session, convert_sessions, find_sessions, main, reframe_metadata, \
+    verify_session
+from nemodata.index import index_path_for
+from nemodata.keyframes import av, keyframes_path_for
+from nemodata.records import FramedMetadataWriter, PickleMetadataReader, session_metadata_path
+from nemodata.telemetry import telemetry_path_for
+
+from session_factory import make_session, SessionTestCase
+
+
+class TestConvert(SessionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.archive = self.path
+        self.sessions = [os.path.join(self.archive, "day_1", f"session_{i}") for i in range(3)]
+
+        for i, path in enumerate(self.sessions):
+            make_session(path, num_packets=10 + i, missing_image_every=3)
+
+    def test_sessions_are_found(self):
+
+        self.assertEqual(find_sessions([self.archive]), self.sessions)
+
+    def test_parallel_conversion(self):
+
+        results = list(convert_sessions(self.sessions, num_workers=2, reframe=True))
+
+        self.assertEqual(sorted(path for path, _, _ in results), self.sessions)
+        self.assertEqual([error for _, _, error in results], [None] * 3)
+
+        for path in self.sessions:
+            metadata_path = os.path.join(path, "metadata.nrec")
+
+            self.assertTrue(os.path.exists(index_path_for(metadata_path)))
+            self.assertTrue(os.path.exists(telemetry_path_for(metadata_path)))
+            self.assertTrue(os.path.exists(os.path.join(path, STATE_FILE)))
+            if av is not None:
+                self.assertTrue(os.path.exists(keyframes_path_for(os.path.join(path, "center.avi"))))
+
+            with Player(path) as p:
+                self.assertEqual(p.metadata_path, metadata_path)
+
+    def test_conversion_resumes(self):
+
+        report = convert_session(self.sessions[0], reframe=True)
+        self.assertIn("reframe", report["done"])
+        self.assertIn("verify", report["done"])
+
+        report = convert_session(self.sessions[0], reframe=True)
+        self.assertEqual(report["done"], [])
+        self.assertIn("reframe", report["skipped"])
+        self.assertIn("verify", report["skipped"])
+
+        # a changed recording is converted again
+        make_session(self.sessions[0], num_packets=5)
+        report = convert_session(self.sessions[0], reframe=True)
+        self.assertIn("reframe", report["done"])
+
+        with Player(self.sessions[0]) as p:
+            self.assertEqual(len(p), 5)
+
+    def test_stale_framed_metadata_is_ignored(self):
+
+        path = self.sessions[0]
+        reframe_metadata(os.path.join(path, "metadata.pkl"), os.path.join(path, "metadata.nrec"))
+        self.assertEqual(session_metadata_path(path), os.path.join(path, "metadata.nrec"))
+
+        # re-recorded after the conversion, metadata.nrec still holds the 10 old packets
+        make_session(path, num_packets=4)
+
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(session_metadata_path(path), os.path.join(path, "metadata.pkl"))
+
+        with self.assertLogs(level="WARNING"), Player(path) as p:
+            self.assertEqual(p.metadata_path, os.path.join(path, "metadata.pkl"))
+            self.assertEqual(len(p), 4)
+
+        # a metadata.nrec recorded directly has no source to go stale
+        make_session(self.sessions[1], num_packets=3, framed=True)
+        self.assertEqual(session_metadata_path(self.sessions[1]), os.path.join(self.sessions[1], "metadata.nrec"))
+
+    def test_deleted_sidecars_are_rebuilt(self):
+
+        convert_session(self.sessions[0])
+        metadata_path = os.path.join(self.sessions[0], "metadata.pkl")
+
+        os.remove(index_path_for(metadata_path))
+        os.remove(telemetry_path_for(metadata_path))
+
+        report = convert_session(self.sessions[0])
+        self.assertIn("index", report["done"])
+        self.assertIn("telemetry", report["done"])
+        self.assertTrue(os.path.exists(index_path_for(metadata_path)))
+        self.assertTrue(os.path.exists(telemetry_path_for(metadata_path)))
+
+    def test_verification_detects_differences(self):
+
+        path = self.sessions[1]
+
+        # a metadata.nrec missing the last packet of metadata.pkl
+        with PickleMetadataReader(os.path.join(path, "metadata.pkl")) as reader:
+            packets = list(reader.iter_packets())
+            with FramedMetadataWriter(os.path.join(path, "metadata.nrec"), reader.video_paths) as writer:
+                for packet in packets[:-1]:
+                    writer.append(packet)
+
+        with self.assertRaises(Exception):
+            verify_session(path)
+
+        verify_session(self.sessions[0])
+
+    def test_command_line(self):
+
+        self.assertEqual(main([self.archive, "--workers", "2", "--no-verify"]), 0)
+
+        for path in self.sessions:
+            self.assertTrue(os.path.exists(index_path_for(os.path.join(path, "metadata.pkl"))))
+            self.assertFalse(os.path.exists(os.path.join(path, "metadata.nrec")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from nemodata import Player
+from nemodata.frame_cache import FrameCache
+
+from session_factory import frame_value, SessionTestCase
+
+
+class TestFrameCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+
+        frame = np.zeros((10, 10, 3), dtype=np.uint8)
+        cache = FrameCache(3 * frame.nbytes)
+
+        for i in range(3):
+            cache.put(("center", i), frame + i)
+
+        # touching frame 0 makes frame 1 the least recently used
+        self.assertEqual(int(cache.get(("center", 0))[0, 0, 0]), 0)
+        cache.put(("center", 3), frame + 3)
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.size_bytes, 3 * frame.nbytes)
+        self.assertNotIn(("center", 1), cache)
+        self.assertIsNone(cache.get(("center", 1)))
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_frames_are_copied(self):
+
+        cache = FrameCache(2 ** 20)
+        frame = np.zeros((10, 10, 3), dtype=np.uint8)
+
+        cache.put(("center", 0), frame)
+        frame[:] = 1
+        cache.get(("center", 0))[:] = 2
+
+        self.assertEqual(int(cache.get(("center", 0)).max()), 0)
+
+    def test_oversized_frames_are_skipped(self):
+
+        cache = FrameCache(10)
+        cache.put(("center", 0), np.zeros(100, dtype=np.uint8))
+        cache.put(("center", 1), None)
+
+        self.assertEqual(len(cache), 0)
+
+
+class TestPlayerFrameCache(SessionTestCase):
+
+    SESSION = dict(num_packets=20)
+
+    def test_revisited_frames_are_hits(self):
+
+        with Player(self.path, frame_cache_bytes=2 ** 20) as p:
+            for _ in range(10):
+                p.get_next_packet()
+
+            self.assertEqual(p.frame_cache.misses, 30)
+            self.assertEqual(p.frame_cache.hits, 0)
+
+            p.crt_frame_index = 5
+            for i in range(5, 15):
+                packet = p.get_next_packet()
+                self.assertEqual(int(packet["images"]["left"][0, 0, 0]), frame_value(1, i))
+
+            # frames 5 to 9 were cached, the videos resync when reaching frame 10
+            self.assertEqual(p.frame_cache.hits, 15)
+            self.assertEqual(p.frame_cache.misses, 45)
+
+
+if __name__ == '__main__':
+    unittest.main()
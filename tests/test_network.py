@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from nemodata import Player
+from nemodata.network import PacketClient, PacketServer
+
+from session_factory import SessionFixture
+
+
+async def _receive(port: int, max_packets: int = None) -> list:
+    packets = []
+
+    async with PacketClient(port=port) as client:
+        async for packet in client:
+            packets.append(packet)
+            if len(packets) == max_packets:
+                break
+
+    return packets
+
+
+class TestNetwork(SessionFixture, unittest.IsolatedAsyncioTestCase):
+
+    SESSION = dict(num_packets=30, missing_image_every=4)
+
+    def setUp(self):
+        super().setUp()
+        with Player(self.path) as p:
+            self.expected = list(iter(p.get_next_packet, None))
+
+    def _assert_packets_equal(self, expected: list, received: list):
+        self.assertEqual(len(received), len(expected))
+
+        # like JITDecompressor, the client fills missing images with the previous ones
+        last_images = {}
+
+        for expected_packet, packet in zip(expected, received):
+            self.assertEqual(packet["datetime"], expected_packet["datetime"])
+            self.assertEqual(packet["sensor_data"]["canbus"], expected_packet["sensor_data"]["canbus"])
+
+            for pos, image in expected_packet["images"].items():
+                if image is not None:
+                    last_images[pos] = image
+
+                if pos in last_images:
+                    self.assertTrue(np.array_equal(packet["images"][pos], last_images[pos]))
+                else:
+                    self.assertIsNone(packet["images"][pos])
+
+    async def test_concurrent_subscribers(self):
+
+        with Player(self.path) as p:
+            async with PacketServer(p, min_subscribers=3, max_queued_packets=2, array_codec="xor") as server:
+                received = await asyncio.gather(*(_receive(server.port) for _ in range(3)))
+
+                self.assertTrue(server.finished)
+                self.assertEqual(server.packets_sent, len(self.expected))
+
+        for packets in received:
+            self._assert_packets_equal(self.expected, packets)
+
+    async def test_disconnected_subscriber_does_not_stall(self):
+
+        with Player(self.path) as p:
+            async with PacketServer(p, min_subscribers=2, max_queued_packets=1) as server:
+                early, complete = await asyncio.gather(_receive(server.port, max_packets=3), _receive(server.port))
+                await server.wait_finished()
+
+                # clients connecting after the end are told so
+                self.assertEqual(await _receive(server.port), [])
+
+        self._assert_packets_equal(self.expected[:3], early)
+        self._assert_packets_equal(self.expected, complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import datetime
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from nemodata.index import iter_unpickled_records
+from nemodata.pickle_scanner import iter_scanned_records, scan_record
+
+
+class TestPickleScanner(unittest.TestCase):
+
+    def _records(self, packets, protocol):
+        positions = ("center", "left")
+
+        with tempfile.TemporaryFile() as f:
+            pickle.dump({"center": "center.avi", "left": "left.avi"}, f, protocol=protocol)
+            for packet in packets:
+                pickle.dump(packet, f, protocol=protocol)
+
+            f.seek(0)
+            pickle.load(f)
+            scanned = list(iter_scanned_records(f, positions))
+
+            f.seek(0)
+            pickle.load(f)
+            unpickled = list(iter_unpickled_records(f, positions))
+
+        return scanned, unpickled
+
+    def test_all_protocols(self):
+
+        start = datetime.datetime(2020, 5, 17, 10, 0, 0)
+        packets = [
+            {"datetime": start, "images": {"center": 0, "left": None}, "sensor_data": {"a": np.ones(100000)}},
+            {"sensor_data": {"gps": {"GGA": "raw"}}, "datetime": start, "images": {"center": 1}},
+            {"datetime": start.replace(tzinfo=datetime.timezone.utc), "images": {"center": 2, "left": 0}},
+            {"datetime": start, "images": {"center": np.int64(3), "left": 1}, "sensor_data": None},
+        ]
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            scanned, unpickled = self._records(packets, protocol)
+            self.assertEqual(scanned, unpickled, f"protocol {protocol}")
+            self.assertEqual(len(scanned), len(packets))
+
+    def test_nested_wanted_keys(self):
+
+        start = datetime.datetime(2020, 5, 17, 10, 0, 0)
+        gps_time = datetime.datetime(2001, 1, 1)
+        packets = [
+            # single item dicts are filled by a SETITEM without a MARK of their own
+            {"images": {"center": 4}, "sensor_data": {"gps": {"datetime": gps_time}}, "datetime": start},
+            {"sensor_data": {"gps": {"datetime": gps_time}}, "images": {"center": 4}, "datetime": start},
+            {"sensor_data": {"camera": {"images": {"center": 99}}}, "datetime": start, "images": {"center": 4}},
+            {"images": {"center": 4}, "sensor_data": {"log": [{"datetime": gps_time}]}, "datetime": start,
+             "extra": np.ones(10)},
+            {"images": {"center": 4}, "sensor_data": {}, "datetime": start},
+        ]
+
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            for packet in packets:
+                data = pickle.dumps(packet, protocol=protocol)
+                expected = pickle.loads(data)
+
+                end, fields = scan_record(data, 0)
+
+                self.assertEqual(end, len(data), f"protocol {protocol}")
+                self.assertEqual(fields["datetime"], expected["datetime"], f"protocol {protocol}")
+                self.assertEqual(fields["images"], expected["images"], f"protocol {protocol}")
+
+            scanned, unpickled = self._records(packets, protocol)
+            self.assertEqual(scanned, unpickled, f"protocol {protocol}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,654 @@
+import asyncio
+import copy
+import datetime
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from nemodata import Player, VariableSampleRatePlayer
+from nemodata.compression import JITDecompressor
+from nemodata.players import VideoReadBuffer, LazyImages
+from nemodata.index import FrameIndex, IndexBuilder, datetime_to_us, index_path_for
+from nemodata.keyframes import KeyframeIndex, av
+
+from session_factory import make_session, frame_value, SessionTestCase, SessionFixture
+
+
+class TestFrameIndex(SessionTestCase):
+
+    SESSION = dict(missing_image_every=4)
+
+    def setUp(self):
+        super().setUp()
+        self.metadata_path = os.path.join(self.path, "metadata.pkl")
+
+    def test_index_matches_packets(self):
+
+        with Player(self.path) as p:
+            self.assertEqual(len(p), len(self.packets))
+            self.assertEqual(p.start_datetime, self.packets[0]["datetime"])
+            self.assertEqual(p.end_datetime, self.packets[-1]["datetime"])
+
+            self.assertIsNone(p.frame_index.frame_number(0, "left"))
+            self.assertEqual(p.frame_index.frame_number(5, "center"), 5)
+
+            p.crt_frame_index = 7
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[7]["datetime"])
+
+    def test_sidecar_is_reused(self):
+
+        with Player(self.path) as p:
+            built_offsets = list(p.indices)
+
+        self.assertTrue(os.path.exists(index_path_for(self.metadata_path)))
+
+        with Player(self.path) as p:
+            self.assertEqual(list(p.indices), built_offsets)
+            self.assertEqual(p.end_datetime, self.packets[-1]["datetime"])
+
+    def test_sidecar_invalidated_on_change(self):
+
+        with Player(self.path):
+            pass
+
+        time.sleep(0.01)
+        make_session(self.path, num_packets=12)
+
+        with Player(self.path) as p:
+            self.assertEqual(len(p), 12)
+
+    def test_stale_sidecar_is_not_loaded(self):
+
+        with Player(self.path):
+            pass
+
+        signature = {"source_size": 1, "source_mtime_ns": 0}
+        self.assertIsNone(FrameIndex.load(index_path_for(self.metadata_path), signature))
+
+    def test_scan_matches_unpickle(self):
+
+        scanned = FrameIndex.build(self.metadata_path, use_sidecar=False, method="scan")
+        unpickled = FrameIndex.build(self.metadata_path, use_sidecar=False, method="unpickle")
+
+        self.assertTrue(np.array_equal(scanned.offsets, unpickled.offsets))
+        self.assertTrue(np.array_equal(scanned.timestamps, unpickled.timestamps))
+        self.assertTrue(np.array_equal(scanned.frame_numbers, unpickled.frame_numbers))
+
+    def test_background_indexing(self):
+
+        with Player(self.path, use_index_sidecar=False, background_indexing=True) as p:
+            self.assertEqual(p.start_datetime, self.packets[0]["datetime"])
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[0]["datetime"])
+
+            # seeking waits for the packet to be indexed
+            p.crt_frame_index = len(self.packets) - 1
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[-1]["datetime"])
+
+            p.wait_for_index()
+            self.assertTrue(p.index_complete)
+            self.assertEqual(len(p), len(self.packets))
+            self.assertEqual(p.end_datetime, self.packets[-1]["datetime"])
+
+    def test_index_grows_while_read(self):
+
+        index = FrameIndex(("center",))
+        errors = []
+
+        def write():
+            # crosses several reallocations of the storage
+            for start in range(0, 5000, 100):
+                index.extend((i, datetime.datetime(2020, 1, 1) + datetime.timedelta(microseconds=i), (i,))
+                             for i in range(start, start + 100))
+
+        # switch threads as often as possible, so reads land in the middle of writes
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        while writer.is_alive() or len(index) < 5000:
+            size = len(index)
+            offsets, frame_numbers = index.offsets, index.frame_numbers
+
+            if len(offsets) < size or len(frame_numbers) < size or \
+                    not np.array_equal(offsets[:size], np.arange(size)) or \
+                    not np.array_equal(frame_numbers[:size, 0], np.arange(size)):
+                errors.append(size)
+
+        writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(index.timestamps), 5000)
+
+    def test_stopped_build_is_not_complete(self):
+
+        builder = IndexBuilder(self.metadata_path, save_sidecar=False)
+        builder.BATCH_SIZE = 8
+        builder.stop()
+        builder.run()
+
+        self.assertTrue(builder.stopped)
+        self.assertFalse(builder.complete)
+        self.assertEqual(builder.wait_for_length(8), 8)
+
+        with self.assertRaises(Exception):
+            builder.wait_for_length()
+        with self.assertRaises(Exception):
+            builder.wait_for_length(len(self.packets))
+        with self.assertRaises(Exception):
+            builder.wait_for_timestamp(datetime_to_us(self.packets[-1]["datetime"]))
+
+    def test_background_indexing_saves_sidecar(self):
+
+        with Player(self.path, background_indexing=True) as p:
+            p.wait_for_index()
+
+        with Player(self.path, background_indexing=True) as p:
+            self.assertTrue(p.index_complete)
+            self.assertEqual(len(p), len(self.packets))
+
+
+class TestSeekDatetime(SessionTestCase):
+
+    SESSION = dict(gaps=(10, 25))
+
+    def test_frame_at(self):
+
+        with Player(self.path) as p:
+            for i, packet in enumerate(self.packets):
+                self.assertEqual(p.frame_at(packet["datetime"]), i)
+                self.assertEqual(p.frame_at(packet["datetime"] + datetime.timedelta(milliseconds=50)), i)
+
+            self.assertEqual(p.frame_at(self.packets[0]["datetime"] - datetime.timedelta(days=1)), 0)
+            self.assertEqual(p.frame_at(self.packets[-1]["datetime"] + datetime.timedelta(days=1)),
+                             len(self.packets) - 1)
+
+            # inside a gap the last packet before it is current
+            self.assertEqual(p.frame_at(self.packets[10]["datetime"] - datetime.timedelta(seconds=5)), 9)
+
+    def test_seek_datetime(self):
+
+        with Player(self.path, use_index_sidecar=False, background_indexing=True) as p:
+            p.seek_datetime(self.packets[30]["datetime"])
+            self.assertEqual(p.crt_frame_index, 30)
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[30]["datetime"])
+
+
+class TestVideoReadBuffer(SessionTestCase):
+
+    SESSION = dict(num_packets=30, positions=("center",))
+
+    def setUp(self):
+        super().setUp()
+        self.video_path = os.path.join(self.path, "center.avi")
+
+    def assertFrame(self, frame, frame_number):
+        self.assertIsNotNone(frame)
+        self.assertEqual(int(frame[0, 0, 0]), frame_value(0, frame_number))
+
+    def test_prefetch(self):
+
+        buffer = VideoReadBuffer(self.video_path, prefetch_frames=4)
+
+        for i in range(10):
+            self.assertFrame(buffer.read_frame(), i)
+
+        buffer.set_frame(25)
+        for i in range(25, 30):
+            self.assertFrame(buffer.read_frame(), i)
+
+        self.assertIsNone(buffer.read_frame())
+        self.assertIsNone(buffer.read_frame())
+
+        buffer.rewind()
+        self.assertFrame(buffer.read_frame(), 0)
+        self.assertEqual(buffer.get_crt_frame_number(), 1)
+
+        buffer.close()
+
+    def test_player_prefetch(self):
+
+        with Player(self.path, enabled_positions=("center",), prefetch_frames=3) as p:
+            for i in range(len(self.packets)):
+                self.assertFrame(p.get_next_packet()["images"]["center"], i)
+
+            self.assertIsNone(p.get_next_packet())
+
+            p.rewind()
+            self.assertFrame(p.get_next_packet()["images"]["center"], 0)
+
+
+@unittest.skipIf(av is None, "PyAV is not installed")
+class TestOutputFormat(SessionTestCase):
+
+    SESSION = dict(num_packets=10, positions=("center",))
+
+    def setUp(self):
+        super().setUp()
+        self.video_path = os.path.join(self.path, "center.avi")
+
+        buffer = VideoReadBuffer(self.video_path)
+        self.frames = [buffer.read_frame() for _ in range(len(self.packets))]
+        buffer.close()
+
+    def test_resize_and_convert(self):
+
+        cases = [
+            ({"output_size": (16, 12)}, lambda f: cv2.resize(f, (16, 12))),
+            ({"output_size": 0.5, "interpolation": cv2.INTER_AREA},
+             lambda f: cv2.resize(f, (16, 12), interpolation=cv2.INTER_AREA)),
+            ({"color_format": "rgb"}, lambda f: cv2.cvtColor(f, cv2.COLOR_BGR2RGB)),
+            ({"output_size": (8, 6), "color_format": "gray"},
+             lambda f: cv2.cvtColor(cv2.resize(f, (8, 6)), cv2.COLOR_BGR2GRAY)),
+        ]
+
+        for kwargs, convert in cases:
+            for prefetch_frames in (0, 2):
+                buffer = VideoReadBuffer(self.video_path, prefetch_frames=prefetch_frames, **kwargs)
+                frames = [buffer.read_frame() for _ in range(len(self.packets))]
+                buffer.close()
+
+                for frame, expected in zip(frames, self.frames):
+                    self.assertEqual(frame.shape, buffer.frame_shape)
+                    self.assertTrue(np.array_equal(frame, convert(expected)), kwargs)
+
+                # every frame is a separate array, even though the intermediate buffers are reused
+                self.assertEqual(len({frame.ctypes.data for frame in frames}), len(frames))
+
+    def test_player_output_format(self):
+
+        with Player(self.path, enabled_positions=("center",), output_size=0.5, color_format="rgb") as p:
+            image = p.get_next_packet()["images"]["center"]
+            self.assertTrue(np.array_equal(image, cv2.cvtColor(cv2.resize(self.frames[0], (16, 12)),
+                                                               cv2.COLOR_BGR2RGB)))
+
+            batch = next(p.stream_batches(4))
+            self.assertEqual(batch["images"]["center"].shape, (4, 12, 16, 3))
+            self.assertTrue(np.array_equal(batch["images"]["center"][0], p[1]["images"]["center"]))
+
+
+class TestKeyframeSeeking(SessionTestCase):
+
+    # mp4v places a keyframe every 12 frames, unlike the intra only FFV1
+    SESSION = dict(num_packets=60, positions=("center",), fourcc="mp4v", extension="mp4")
+
+    def setUp(self):
+        super().setUp()
+        self.video_path = os.path.join(self.path, "center.mp4")
+
+        buffer = VideoReadBuffer(self.video_path, keyframe_seeking=False)
+        self.frames = [buffer.read_frame() for _ in range(len(self.packets))]
+        buffer.close()
+
+    def test_keyframe_index(self):
+
+        keyframes = KeyframeIndex.build(self.video_path)
+        self.assertEqual(keyframes.num_frames, len(self.packets))
+        self.assertGreater(len(keyframes), 1)
+        self.assertEqual(keyframes.keyframe_for(0)[0], 0)
+
+        for frame_number in range(len(self.packets)):
+            keyframe, _ = keyframes.keyframe_for(frame_number)
+            self.assertIn(keyframe, keyframes.frame_numbers)
+            self.assertLessEqual(keyframe, frame_number)
+
+        # loaded from the sidecar the second time
+        self.assertTrue(np.array_equal(KeyframeIndex.build(self.video_path).frame_numbers, keyframes.frame_numbers))
+
+    def test_random_seeks_are_frame_accurate(self):
+
+        for prefetch_frames in (0, 3):
+            buffer = VideoReadBuffer(self.video_path, prefetch_frames=prefetch_frames, max_grab_frames=4)
+
+            for frame_number in (37, 5, 59, 12, 13, 30, 0, 45, 44):
+                buffer.set_frame(frame_number)
+                self.assertTrue(np.array_equal(buffer.read_frame(), self.frames[frame_number]), frame_number)
+                self.assertEqual(buffer.get_crt_frame_number(), frame_number + 1)
+
+            buffer.close()
+
+    def test_player_seeks(self):
+
+        with Player(self.path, enabled_positions=("center",)) as p:
+            for value in (50, 3, 24, 25):
+                p.crt_frame_index = value
+                self.assertTrue(np.array_equal(p.get_next_packet()["images"]["center"], self.frames[value]))
+
+
+class TestParallelDecode(SessionTestCase):
+
+    SESSION = dict(num_packets=20, missing_image_every=3)
+
+    def test_same_images_as_sequential(self):
+
+        with Player(self.path) as sequential, Player(self.path, parallel_decode=True, prefetch_frames=2) as parallel:
+            for _ in range(len(self.packets)):
+                expected = sequential.get_next_packet()
+                packet = parallel.get_next_packet()
+
+                for pos, img in expected["images"].items():
+                    if img is None:
+                        self.assertIsNone(packet["images"][pos])
+                    else:
+                        self.assertTrue(np.array_equal(img, packet["images"][pos]))
+
+    def test_disabled_positions_are_skipped(self):
+
+        with Player(self.path, enabled_positions=("center", "right"), parallel_decode=True) as p:
+            packet = p.get_next_packet()
+            self.assertIsNone(packet["images"]["left"])
+            self.assertEqual(int(packet["images"]["right"][0, 0, 0]), frame_value(2, 0))
+
+
+class TestLazyImages(SessionTestCase):
+
+    SESSION = dict(num_packets=20, missing_image_every=3)
+
+    def test_images_decode_on_access(self):
+
+        with Player(self.path, lazy_images=True) as p:
+            for i in range(len(self.packets)):
+                packet = p.get_next_packet()
+                images = packet["images"]
+
+                self.assertIsInstance(images, LazyImages)
+                self.assertEqual(list(images), ["center", "left", "right"])
+                self.assertEqual(packet["sensor_data"]["canbus"]["speed"]["value"], i)
+
+                # only every 5th center frame is decoded, the others are skipped
+                if i % 5 == 0:
+                    self.assertFalse(images.is_loaded("center"))
+                    self.assertEqual(int(images["center"][0, 0, 0]), frame_value(0, i))
+                    self.assertTrue(images.is_loaded("center"))
+
+                if self.packets[i]["images"]["left"] is None:
+                    self.assertIsNone(images["left"])
+
+            # videos that were never read are not touched
+            self.assertEqual(p.open_videos["right"].get_crt_frame_number(), 0)
+
+    def test_copy_matches_eager_packet(self):
+
+        with Player(self.path) as eager, Player(self.path, lazy_images=True) as lazy:
+            for _ in range(len(self.packets)):
+                expected = eager.get_next_packet()
+                images = copy.deepcopy(lazy.get_next_packet())["images"]
+
+                self.assertIsInstance(images, dict)
+                for pos, img in expected["images"].items():
+                    if img is None:
+                        self.assertIsNone(images[pos])
+                    else:
+                        self.assertTrue(np.array_equal(img, images[pos]))
+
+    def test_pickle(self):
+
+        with Player(self.path, lazy_images=True) as p:
+            images = pickle.loads(pickle.dumps(p.get_next_packet()["images"]))
+
+        self.assertIsInstance(images, dict)
+        self.assertEqual(int(images["right"][0, 0, 0]), frame_value(2, 0))
+
+
+class TestVariableSampleRatePlayer(SessionTestCase):
+
+    SESSION = dict(num_packets=50, missing_image_every=4, gaps=(20,))
+
+    def _merged_packets(self, min_packet_delay_ms):
+        """Downsamples by decoding and merging every packet, as VariableSampleRatePlayer used to"""
+
+        merged_packets = []
+
+        with Player(self.path) as p:
+            while True:
+                decompressor = JITDecompressor()
+
+                initial_packet = p.get_next_packet()
+                if initial_packet is None:
+                    return merged_packets
+
+                merged = decompressor.decompress_next_packet(copy.deepcopy(initial_packet))
+
+                while True:
+                    next_packet = p.get_next_packet()
+                    if next_packet is None:
+                        break
+
+                    merged = decompressor.decompress_next_packet(next_packet)
+                    if (merged["datetime"] - initial_packet["datetime"]).total_seconds() * 1000 >= min_packet_delay_ms:
+                        break
+
+                merged_packets.append(merged)
+
+    def assertSamePackets(self, packets, expected_packets):
+        self.assertEqual(len(packets), len(expected_packets))
+
+        for packet, expected in zip(packets, expected_packets):
+            self.assertEqual(packet["datetime"], expected["datetime"])
+            self.assertEqual(packet["sensor_data"]["canbus"], expected["sensor_data"]["canbus"])
+            self.assertEqual(packet["sensor_data"]["imu"], expected["sensor_data"]["imu"])
+
+            for pos, img in expected["images"].items():
+                self.assertTrue(np.array_equal(img, packet["images"][pos]), pos)
+
+    def test_same_packets_as_merging_every_packet(self):
+
+        expected_packets = self._merged_packets(300)
+
+        for kwargs in ({}, {"compute_indices": False}, {"use_index_sidecar": False, "background_indexing": True}):
+            with VariableSampleRatePlayer(self.path, min_packet_delay_ms=300, **kwargs) as p:
+                self.assertSamePackets(list(iter(p.get_next_packet, None)), expected_packets)
+
+    def test_random_access(self):
+
+        with VariableSampleRatePlayer(self.path, min_packet_delay_ms=300) as p:
+            streamed = list(iter(p.get_next_packet, None))
+
+            # a slice gives the merged packets, as streamed
+            self.assertSamePackets(p[:], streamed)
+            self.assertSamePackets(p[0:1], streamed[:1])
+
+            # an index gives the packet streamed after seeking to it
+            for frame_index in (7, 20, len(self.packets) - 2):
+                p.crt_frame_index = frame_index
+                expected = p.get_next_packet()
+                self.assertSamePackets([p[frame_index]], [expected])
+
+            self.assertEqual(p[-1]["datetime"], self.packets[-1]["datetime"])
+
+            with self.assertRaises(Exception):
+                p[::2]
+
+    def test_skipped_images_are_not_decoded(self):
+
+        with VariableSampleRatePlayer(self.path, min_packet_delay_ms=300, frame_cache_bytes=2 ** 20) as p:
+            emitted = list(iter(p.get_next_packet, None))
+
+            # one decode per camera of each output packet
+            self.assertEqual(p.frame_cache.misses, 3 * len(emitted))
+            self.assertLess(len(emitted), len(self.packets) / 3)
+
+
+def _first_pixels(args):
+    player, frame_indices = args
+    return [int(player[i]["images"]["center"][0, 0, 0]) for i in frame_indices]
+
+
+_inherited_player = None
+
+
+def _inherited_first_pixels(frame_indices):
+    return _first_pixels((_inherited_player, frame_indices))
+
+
+class TestRandomAccess(SessionTestCase):
+
+    SESSION = dict(num_packets=30, missing_image_every=4)
+
+    def test_getitem(self):
+
+        with Player(self.path) as p:
+            p.get_next_packet()
+
+            self.assertEqual(p[12]["datetime"], self.packets[12]["datetime"])
+            self.assertEqual(int(p[12]["images"]["right"][0, 0, 0]), frame_value(2, 12))
+            self.assertEqual(p[-1]["datetime"], self.packets[-1]["datetime"])
+            self.assertEqual([packet["datetime"] for packet in p[3:10:3]],
+                             [packet["datetime"] for packet in self.packets[3:10:3]])
+
+            with self.assertRaises(IndexError):
+                p[len(self.packets)]
+
+            # the streaming cursor is not moved
+            self.assertEqual(p.crt_frame_index, 1)
+            self.assertEqual(int(p.get_next_packet()["images"]["center"][0, 0, 0]), frame_value(0, 1))
+
+    def test_opens_lazily(self):
+
+        p = Player(self.path, background_indexing=True, use_index_sidecar=False)
+        self.assertEqual(p[5]["datetime"], self.packets[5]["datetime"])
+        self.assertEqual(len(list(p)), len(self.packets))
+        p.close()
+
+    def test_workers(self):
+
+        with Player(self.path, enabled_positions=("center",)) as p:
+            p[0]
+            jobs = [(p, range(i, len(self.packets), 3)) for i in range(3)]
+
+            for method in ("fork", "spawn"):
+                with multiprocessing.get_context(method).Pool(2) as pool:
+                    results = pool.map(_first_pixels, jobs)
+
+                for i, pixels in enumerate(results):
+                    self.assertEqual(pixels, [frame_value(0, j) for j in range(i, len(self.packets), 3)], method)
+
+    def test_forked_workers_reopen_files(self):
+        global _inherited_player
+
+        with Player(self.path, enabled_positions=("center",)) as p:
+            _inherited_player = p
+            p[0]
+
+            with multiprocessing.get_context("fork").Pool(2) as pool:
+                results = pool.map(_inherited_first_pixels, [range(i, len(self.packets), 2) for i in range(2)])
+
+            for i, pixels in enumerate(results):
+                self.assertEqual(pixels, [frame_value(0, j) for j in range(i, len(self.packets), 2)])
+
+            # the parent's files were not disturbed by the workers
+            self.assertEqual(int(p.get_next_packet()["images"]["center"][0, 0, 0]), frame_value(0, 0))
+
+        _inherited_player = None
+
+
+class TestStreamBatches(SessionTestCase):
+
+    SESSION = dict(num_packets=23, missing_image_every=4)
+
+    def test_batches_match_packets(self):
+
+        with Player(self.path) as p:
+            batches = [copy.deepcopy(batch) for batch in p.stream_batches(10)]
+
+        self.assertEqual([len(batch["datetime"]) for batch in batches], [10, 10, 3])
+        self.assertEqual(batches[0]["images"]["center"].shape, (10, 24, 32, 3))
+
+        frame_indices = np.concatenate([batch["frame_index"] for batch in batches])
+        self.assertTrue(np.array_equal(frame_indices, np.arange(len(self.packets))))
+
+        speed = np.concatenate([batch["telemetry"]["canbus_speed"] for batch in batches])
+        self.assertTrue(np.array_equal(speed, np.arange(len(self.packets), dtype=np.float64)))
+
+        for i, packet in enumerate(self.packets):
+            batch, row = batches[i // 10], i % 10
+
+            self.assertEqual(batch["datetime"][row], datetime_to_us(packet["datetime"]))
+
+            for pos_number, pos in enumerate(("center", "left", "right")):
+                img_num = packet["images"][pos]
+                self.assertEqual(batch["valid"][pos][row], img_num is not None)
+                if img_num is not None:
+                    self.assertEqual(int(batch["images"][pos][row, 0, 0, 0]), frame_value(pos_number, img_num))
+
+    def test_buffers_are_reused(self):
+
+        with Player(self.path) as p:
+            batches = p.stream_batches(5, fields=("right", "imu_gyro_x"))
+            first = next(batches)
+            second = next(batches)
+
+            self.assertIs(first["images"]["right"].base, second["images"]["right"].base)
+            self.assertEqual(set(first["images"]), {"right"})
+            self.assertEqual(set(first["telemetry"]), {"imu_gyro_x"})
+
+            with self.assertRaises(Exception):
+                next(p.stream_batches(5, fields=("rear",)))
+
+    def test_variable_sample_rate(self):
+
+        with VariableSampleRatePlayer(self.path, min_packet_delay_ms=300) as p:
+            expected = [packet["datetime"] for packet in iter(p.get_next_packet, None)]
+            p.rewind()
+
+            batch = next(p.stream_batches(100))
+
+        self.assertEqual(list(batch["datetime"]), [datetime_to_us(dt) for dt in expected])
+
+
+class TestAsyncStream(SessionFixture, unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.paths = [os.path.join(self.path, f"session_{i}") for i in range(3)]
+        self.packets = [make_session(path, num_packets=20 + i, missing_image_every=4) for i, path in
+                        enumerate(self.paths)]
+
+    async def _datetimes(self, player_class, path, **kwargs):
+        async with player_class(path, **kwargs) as p:
+            return [packet["datetime"] async for packet in p]
+
+    async def test_matches_stream_generator(self):
+
+        for player_class in (Player, VariableSampleRatePlayer):
+            with player_class(self.paths[0]) as p:
+                expected = list(p.stream_generator())
+
+            with player_class(self.paths[0]) as p:
+                packets = [packet async for packet in p.astream(max_in_flight=3)]
+
+            self.assertEqual([packet["datetime"] for packet in packets], [packet["datetime"] for packet in expected])
+            self.assertTrue(np.array_equal(packets[2]["images"]["center"], expected[2]["images"]["center"]))
+
+    async def test_many_sessions_on_one_loop(self):
+
+        results = await asyncio.gather(*(self._datetimes(Player, path) for path in self.paths))
+
+        for packets, datetimes in zip(self.packets, results):
+            self.assertEqual(datetimes, [packet["datetime"] for packet in packets])
+
+    async def test_close_ends_stream(self):
+
+        p = Player(self.paths[0])
+        p.start()
+
+        received = 0
+        async for _ in p.astream(max_in_flight=4):
+            received += 1
+            if received == 2:
+                p.close()
+
+        # packets already read ahead may still be delivered, then the stream ends without error
+        self.assertLess(received, len(self.packets[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import datetime
+import tempfile
+import unittest
+
+import numpy as np
+
+from nemodata import Player
+from nemodata.query import Query
+from nemodata.telemetry import Telemetry
+
+from session_factory import make_session
+
+
+def _query(values: dict, timestamps=None) -> Query:
+    length = len(next(iter(values.values())))
+    timestamps = np.arange(length, dtype=np.int64) * 100000 if timestamps is None else np.asarray(timestamps)
+    return Query(Telemetry(timestamps, {k: np.asarray(v, dtype=np.float64) for k, v in values.items()}))
+
+
+class TestQuery(unittest.TestCase):
+
+    def test_comparisons_and_logic(self):
+
+        q = _query({"speed": [0, 60, 70, np.nan, 80, 20], "signal": [0, 2, 0, 2, 2, np.nan]})
+
+        fast = q["speed"] > 50
+        self.assertEqual(fast.values.tolist(), [False, True, True, False, True, False])
+        self.assertEqual(((q["speed"] > 50) & (q["signal"] != 0)).values.tolist(),
+                         [False, True, False, False, True, False])
+        self.assertEqual((~fast | q["speed"].between(60, 70)).values.tolist(),
+                         [True, True, True, True, False, True])
+
+        # no data is neither equal nor different
+        self.assertEqual((q["signal"] != 0).values.tolist(), [False, True, False, True, True, False])
+        self.assertEqual((abs(q["speed"] - 65) < 6).values.tolist(), [False, True, True, False, False, False])
+        self.assertEqual((q["speed"] != q["signal"]).values.tolist(), [False, True, True, False, True, False])
+        self.assertEqual((q["speed"] == q["signal"]).values.tolist(), [True, False, False, False, False, False])
+
+        # arrays and scalars on the left go through the Signal's operators
+        self.assertIsInstance(np.ones(6) + q["speed"], type(q["speed"]))
+        np.testing.assert_allclose((np.ones(6) - q["speed"]).values, [1, -59, -69, np.nan, -79, -19])
+        np.testing.assert_allclose((120 / q["speed"]).values, [np.inf, 2, 120 / 70, np.nan, 1.5, 6])
+        self.assertEqual((np.array([True, False, True, False, True, False]) ^ fast).values.tolist(),
+                         [True, True, False, False, False, False])
+
+        with self.assertRaises(Exception):
+            q["missing"]
+
+    def test_hold(self):
+
+        # speed and signal are recorded in alternate packets, a 1 s gap before the last two
+        timestamps = [0, 100000, 200000, 300000, 400000, 500000, 1500000, 1600000]
+        q = _query({"speed": [60, np.nan, 70, np.nan, 20, np.nan, 80, np.nan],
+                    "signal": [np.nan, 2, np.nan, 2, np.nan, 0, np.nan, 2]}, timestamps)
+
+        self.assertFalse(((q["speed"] > 50) & (q["signal"] != 0)).any())
+
+        np.testing.assert_allclose(q["speed"].hold(100).values, [60, 60, 70, 70, 20, 20, 80, 80])
+        np.testing.assert_allclose(q["signal"].hold(100).values, [np.nan, 2, 2, 2, 2, 0, np.nan, 2])
+        np.testing.assert_allclose(q["signal"].hold(1000).values, [np.nan, 2, 2, 2, 2, 0, 0, 2])
+        np.testing.assert_allclose(q["speed"].hold(50).values, q["speed"].values)
+
+        signalling = (q["speed"].hold(100) > 50) & (q["signal"].hold(100) != 0)
+        self.assertEqual([(s.start, s.end) for s in signalling.segments()], [(1, 3), (7, 7)])
+
+    def test_rolling(self):
+
+        # 100 ms apart, then a 1 s gap
+        timestamps = [0, 100000, 200000, 300000, 1300000]
+        q = _query({"x": [1.0, np.nan, 3.0, 5.0, 7.0]}, timestamps)
+
+        np.testing.assert_allclose(q["x"].rolling(200, "mean").values, [1.0, 1.0, 2.0, 4.0, 7.0])
+        np.testing.assert_allclose(q["x"].rolling(200, "sum").values, [1.0, 1.0, 4.0, 8.0, 7.0])
+        np.testing.assert_allclose(q["x"].rolling(200, "count").values, [1, 1, 2, 2, 1])
+        np.testing.assert_allclose(q["x"].rolling(1000, "min").values, [1.0, 1.0, 1.0, 1.0, 5.0])
+        np.testing.assert_allclose(q["x"].rolling(1000, "max").values, [1.0, 1.0, 3.0, 5.0, 7.0])
+
+        with self.assertRaises(Exception):
+            q["x"].rolling(100, "median")
+
+    def test_rolling_extremes_match_brute_force(self):
+
+        rng = np.random.default_rng(3)
+        timestamps = np.cumsum(rng.integers(1, 200000, 300))
+        values = rng.normal(size=300)
+        values[rng.random(300) < 0.2] = np.nan
+        q = _query({"x": values}, timestamps)
+
+        window_us = 700000
+        expected_min, expected_max = [], []
+        for i, t in enumerate(timestamps):
+            window = values[(timestamps >= t - window_us) & (timestamps <= t)]
+            window = window[~np.isnan(window)]
+            expected_min.append(window.min() if len(window) else np.nan)
+            expected_max.append(window.max() if len(window) else np.nan)
+
+        np.testing.assert_allclose(q["x"].rolling(700, "min").values, expected_min)
+        np.testing.assert_allclose(q["x"].rolling(700, "max").values, expected_max)
+
+    def test_derivative(self):
+
+        q = _query({"speed": [10.0, 12.0, np.nan, 8.0, 8.0]})
+
+        np.testing.assert_allclose(q["speed"].derivative().values, [np.nan, 20.0, np.nan, -20.0, 0.0])
+
+    def test_segments(self):
+
+        q = _query({"x": [0, 1, 1, 0, 1, 0, 0, 0, 1, 1, 1, 1]})
+        mask = q["x"] > 0
+
+        self.assertEqual([(s.start, s.end) for s in mask.segments()], [(1, 2), (4, 4), (8, 11)])
+        self.assertEqual([(s.start, s.end) for s in mask.fill_gaps(200).segments()], [(1, 4), (8, 11)])
+        self.assertEqual([(s.start, s.end) for s in mask.for_at_least(300).segments()], [(8, 11)])
+        self.assertEqual([(s.start, s.end) for s in (q["x"] > 5).segments()], [])
+
+        segment = mask.segments()[-1]
+        self.assertEqual(segment.slice, slice(8, 12))
+        self.assertEqual(segment.duration, datetime.timedelta(milliseconds=300))
+
+    def test_player_events(self):
+
+        with tempfile.TemporaryDirectory() as path:
+            packets = make_session(path, num_packets=40)
+
+            with Player(path) as p:
+                q = Query.from_player(p)
+
+                # the turn signal is on for the first 3 of every 10 packets
+                signalling = (q["canbus_speed"] > 15) & (q["canbus_signal"] != 0)
+                segments = signalling.segments()
+                self.assertEqual([(s.start, s.end) for s in segments], [(20, 22), (30, 32)])
+                self.assertEqual(segments[0].start_datetime, packets[20]["datetime"])
+                self.assertEqual(segments[0].end_datetime, packets[22]["datetime"])
+
+                # brake pressure drops from 4 to 0 every 5 packets
+                releases = (q["canbus_brake"].derivative() < -30).segments()
+                self.assertEqual([s.start for s in releases], list(range(5, 40, 5)))
+
+                p.crt_frame_index = segments[1].start
+                self.assertEqual(p.get_next_packet()["datetime"], packets[30]["datetime"])
+                self.assertEqual([packet["datetime"] for packet in p[segments[0].slice]],
+                                 [packet["datetime"] for packet in packets[20:23]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import datetime
+import os
+import unittest
+
+import numpy as np
+
+from nemodata import Player, VariableSampleRatePlayer
+from nemodata.records import FramedMetadataReader, FramedMetadataWriter, MetadataReader, RecordError, \
+    open_metadata, session_metadata_path
+
+from session_factory import make_session, SessionTestCase
+
+
+class TestFramedRecords(SessionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.path, "metadata.nrec")
+
+        start = datetime.datetime(2020, 5, 17, 10, 0, 0)
+        self.packets = [
+            {"datetime": start, "images": {"center": 0, "left": None},
+             "sensor_data": {"lidar": np.arange(1000, dtype=np.float32), "mask": np.ones(3, dtype=bool)}},
+            {"datetime": start.replace(tzinfo=datetime.timezone.utc), "images": {"center": 1, "left": 0},
+             "sensor_data": None},
+            {"datetime": start, "sensor_data": {"lidar": np.arange(10, dtype=np.uint8).reshape(2, 5)}},
+        ]
+
+        with FramedMetadataWriter(self.path, {"center": "center.avi", "left": "left.avi"}) as writer:
+            self.offsets = [writer.append(packet) for packet in self.packets]
+
+    def _corrupt(self, offset: int):
+        with open(self.path, "r+b") as f:
+            f.seek(offset)
+            value = f.read(1)
+            f.seek(offset)
+            f.write(bytes([value[0] ^ 0xff]))
+
+    def test_round_trip(self):
+
+        with open_metadata(self.path) as reader:
+            self.assertIsInstance(reader, FramedMetadataReader)
+            self.assertEqual(reader.video_paths, {"center": "center.avi", "left": "left.avi"})
+
+            packets = list(reader.iter_packets())
+            self.assertEqual(len(packets), len(self.packets))
+
+            lidar = packets[0]["sensor_data"]["lidar"]
+            self.assertTrue(np.array_equal(lidar, self.packets[0]["sensor_data"]["lidar"]))
+            self.assertTrue(np.array_equal(packets[2]["sensor_data"]["lidar"], self.packets[2]["sensor_data"]["lidar"]))
+            self.assertEqual(packets[1]["datetime"], self.packets[1]["datetime"])
+
+            # arrays are aligned views of the mapped file
+            self.assertFalse(lidar.flags.writeable)
+            self.assertEqual(lidar.ctypes.data % 64, 0)
+
+            self.assertEqual(reader.read_packet_at(self.offsets[1])["images"], {"center": 1, "left": 0})
+            del lidar, packets
+
+    def test_index_records_from_headers(self):
+
+        with open_metadata(self.path) as reader:
+            records = list(reader.iter_index_records(("left", "center", "right")))
+
+        self.assertEqual([record[0] for record in records], self.offsets)
+        self.assertEqual([record[1] for record in records], [packet["datetime"] for packet in self.packets])
+        self.assertEqual([record[2] for record in records], [(-1, 0, -1), (0, 1, -1), (-1, -1, -1)])
+
+    def test_corruption_is_detected(self):
+
+        self._corrupt(self.offsets[1] + 100)
+
+        with open_metadata(self.path) as reader:
+            self.assertIsNotNone(reader.read_packet())
+            with self.assertRaises(RecordError):
+                reader.read_packet()
+
+        self._corrupt(self.offsets[2])
+
+        with open_metadata(self.path) as reader:
+            with self.assertRaises(RecordError):
+                list(reader.iter_index_records(("center",)))
+
+    def test_incomplete_reader_is_rejected(self):
+
+        class SeekOnlyReader(MetadataReader):
+            def seek(self, offset, whence=0):
+                pass
+
+        with self.assertRaises(TypeError):
+            SeekOnlyReader(self.path)
+
+    def test_truncated_record_ends_stream(self):
+
+        with open(self.path, "r+b") as f:
+            f.truncate(self.offsets[2] + 70)
+
+        with open_metadata(self.path) as reader:
+            self.assertEqual(len(list(reader.iter_packets())), 2)
+
+
+class TestFramedPlayer(SessionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pickle_path = os.path.join(self.path, "pickle")
+        self.framed_path = os.path.join(self.path, "framed")
+
+        self.packets = make_session(self.pickle_path, missing_image_every=4)
+        make_session(self.framed_path, missing_image_every=4, framed=True)
+
+    def test_format_is_detected(self):
+
+        self.assertEqual(session_metadata_path(self.pickle_path), os.path.join(self.pickle_path, "metadata.pkl"))
+        self.assertEqual(session_metadata_path(self.framed_path), os.path.join(self.framed_path, "metadata.nrec"))
+
+    def test_same_playback(self):
+
+        for player_class in (Player, VariableSampleRatePlayer):
+            with player_class(self.pickle_path) as expected, player_class(self.framed_path) as actual:
+                self.assertEqual(len(expected), len(actual))
+
+                for expected_packet in iter(expected.get_next_packet, None):
+                    actual_packet = actual.get_next_packet()
+
+                    self.assertEqual(actual_packet["datetime"], expected_packet["datetime"])
+                    for pos, image in expected_packet["images"].items():
+                        if image is None:
+                            self.assertIsNone(actual_packet["images"][pos])
+                        else:
+                            self.assertTrue(np.array_equal(actual_packet["images"][pos], image))
+
+                self.assertIsNone(actual.get_next_packet())
+
+    def test_seeking_and_random_access(self):
+
+        with Player(self.framed_path, background_indexing=True) as p:
+            p.wait_for_index()
+            self.assertEqual(p.frame_index.frame_number(5, "center"), 5)
+            self.assertIsNone(p.frame_index.frame_number(4, "left"))
+
+            p.seek_datetime(self.packets[12]["datetime"])
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[12]["datetime"])
+            self.assertEqual(p[3]["datetime"], self.packets[3]["datetime"])
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[13]["datetime"])
+
+            p.rewind()
+            self.assertEqual(p.get_next_packet()["datetime"], self.packets[0]["datetime"])
+
+        self.assertTrue(np.array_equal(Player(self.framed_path).telemetry()["canbus_speed"],
+                                       Player(self.pickle_path).telemetry()["canbus_speed"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
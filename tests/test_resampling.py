@@ -0,0 +1,87 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from nemodata import Player
+from nemodata.index import datetime_to_us
+from nemodata.resampling import hold, interpolate, nearest_frames, nearest_indices, resample_telemetry, slerp, \
+    uniform_grid
+
+from session_factory import SessionTestCase
+
+
+class TestResampling(unittest.TestCase):
+
+    def test_uniform_grid(self):
+
+        self.assertEqual(uniform_grid(1000, 1000 + 10 ** 6, 4).tolist(),
+                         [1000, 251000, 501000, 751000, 1001000])
+        self.assertEqual(len(uniform_grid(0, 999, 1)), 1)
+
+    def test_interpolation_skips_nan(self):
+
+        timestamps = np.array([0, 100, 200, 300, 1000], dtype=np.int64)
+        values = np.array([0.0, np.nan, 2.0, 3.0, 10.0])
+        grid = np.array([-50, 0, 50, 250, 300, 650, 1000, 1100], dtype=np.int64)
+
+        result = interpolate(timestamps, values, grid)
+        np.testing.assert_allclose(result, [np.nan, 0.0, 0.5, 2.5, 3.0, 6.5, 10.0, np.nan])
+
+        gapped = interpolate(timestamps, values, grid, max_gap_us=300)
+        np.testing.assert_allclose(gapped, [np.nan, 0.0, 0.5, 2.5, 3.0, np.nan, 10.0, np.nan])
+
+        held = hold(timestamps, np.array([0.0, 1.0, np.nan, 2.0, 0.0]), grid)
+        np.testing.assert_allclose(held, [np.nan, 0.0, 0.0, 1.0, 2.0, 2.0, 0.0, np.nan])
+
+    def test_slerp(self):
+
+        half_turn = np.sqrt(0.5)
+        timestamps = np.array([0, 100], dtype=np.int64)
+        # identity, then 90 degrees around z given with the opposite sign
+        quaternions = np.array([[0.0, 0.0, 0.0, 1.0], [0.0, 0.0, -half_turn, -half_turn]])
+
+        result = slerp(timestamps, quaternions, np.array([0, 50, 100], dtype=np.int64))
+
+        angle = np.pi / 8
+        np.testing.assert_allclose(result[1], [0.0, 0.0, np.sin(angle), np.cos(angle)], atol=1e-12)
+        np.testing.assert_allclose(np.abs(result[2]), [0.0, 0.0, half_turn, half_turn], atol=1e-12)
+        np.testing.assert_allclose(np.linalg.norm(result, axis=1), 1.0)
+
+    def test_nearest_indices(self):
+
+        timestamps = np.array([0, 100, 200, 300], dtype=np.int64)
+        grid = np.array([-10, 40, 50, 60, 290, 500], dtype=np.int64)
+
+        self.assertEqual(nearest_indices(timestamps, grid).tolist(), [0, 0, 0, 1, 3, 3])
+        self.assertEqual(nearest_indices(timestamps, grid, mask=np.array([False, True, False, True])).tolist(),
+                         [1, 1, 1, 1, 3, 3])
+        self.assertEqual(nearest_indices(timestamps, grid, max_distance_us=50).tolist(), [0, 0, 0, 1, 3, -1])
+
+
+class TestResampleSession(SessionTestCase):
+
+    SESSION = dict(num_packets=20, missing_image_every=2)
+
+    def test_uniform_sequence(self):
+
+        with Player(self.path) as p:
+            telemetry = resample_telemetry(p.telemetry(), rate_hz=20)
+            frames = nearest_frames(p.frame_index, telemetry.timestamps, ("center", "left"))
+
+        # packets are 100 ms apart, speed is the packet number
+        self.assertEqual(len(telemetry), 39)
+        np.testing.assert_allclose(telemetry["canbus_speed"], np.arange(39) / 2)
+        self.assertEqual(telemetry.datetime_at(1), self.packets[0]["datetime"] + datetime.timedelta(milliseconds=50))
+        self.assertEqual(datetime_to_us(telemetry.datetime_at(2)), datetime_to_us(self.packets[1]["datetime"]))
+
+        self.assertTrue(np.isin(telemetry["canbus_signal"], [0, 2]).all())
+        np.testing.assert_allclose(telemetry["imu_orientation_w"][~np.isnan(telemetry["imu_orientation_w"])], 1.0)
+
+        self.assertEqual(frames["center"][:4].tolist(), [0, 0, 1, 1])
+        # every other packet has no left image
+        self.assertEqual(frames["left"][:6].tolist(), [1, 1, 1, 1, 1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import math
+import os
+import unittest
+
+import numpy as np
+
+from nemodata import Player
+from nemodata.telemetry import telemetry_path_for
+
+from session_factory import SessionTestCase
+
+
+class TestTelemetry(SessionTestCase):
+
+    SESSION = dict()
+
+    def test_columns_match_packets(self):
+
+        telemetry = Player(self.path).telemetry()
+
+        self.assertEqual(len(telemetry), len(self.packets))
+        self.assertTrue(np.array_equal(telemetry["canbus_speed"], np.arange(len(self.packets), dtype=np.float64)))
+
+        for i, packet in enumerate(self.packets):
+            self.assertEqual(telemetry.datetime_at(i), packet["datetime"])
+
+            imu = packet["sensor_data"]["imu"]
+            if imu is None:
+                self.assertTrue(math.isnan(telemetry["imu_acceleration_x"][i]))
+            else:
+                self.assertEqual(telemetry["imu_acceleration_x"][i], imu["linear_acceleration"]["x"])
+
+            gps = packet["sensor_data"]["gps"]
+            if gps is None:
+                self.assertTrue(math.isnan(telemetry["gps_hdop"][i]))
+            else:
+                self.assertEqual(telemetry["gps_latitude"][i], gps["GGA"].latitude)
+                self.assertEqual(telemetry["gps_hdop"][i], 0.9)
+
+    def test_sidecar_is_memory_mapped(self):
+
+        Player(self.path).telemetry()
+        self.assertTrue(os.path.exists(telemetry_path_for(os.path.join(self.path, "metadata.pkl"))))
+
+        telemetry = Player(self.path).telemetry()
+        self.assertIsInstance(telemetry["canbus_speed"].base, np.memmap)
+        self.assertEqual(telemetry["canbus_speed"][5], 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()